@@ -0,0 +1,421 @@
+import os
+import io
+import glob
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import calendar
+import datetime
+import functools
+import threading
+import http.server
+import resource
+
+import duckdb
+
+from improved_etl import convert_parquet, download_and_extract_files_generator, process_csv_to_duckdb
+from schema_registry import HEADER_VARIANTS, detect_plan_timestamp_format, plan_for_header, sniff_csv, timestamp_parse_sql
+
+HEADERS = {variant['name']: variant['header'] for variant in HEADER_VARIANTS}
+
+# Rows per CSV inside the 2024+ monthly zips; the published files are split at 1M rows
+NEW_SCHEMA_ROWS_PER_CSV = 1000000
+
+# Synthetic station coordinates span roughly the Citi Bike service area
+STATION_LAT_SQL = "40.65 + (({station} * 7919) % 1000) / 4000.0"
+STATION_LNG_SQL = "-74.03 + (({station} * 104729) % 1000) / 4500.0"
+# Table one synthetic month is generated into before it is written out as CSV
+MONTH_TRIPS_TABLE = "month_trips"
+# Table the timestamp columns of one CSV are loaded into for the parse timing
+TIMESTAMP_VALUES_TABLE = "timestamp_values"
+# The per-row CASE/LIKE parse of old-schema timestamps that format detection replaced. Its
+# strptime fails the whole query on a value matching neither format (m/d/Y without seconds).
+LEGACY_TIMESTAMP_PARSE_SQL = """CASE
+        WHEN "{col}" LIKE '%-%-%' THEN strptime(NULLIF(TRIM("{col}"), ''), '%Y-%m-%d %H:%M:%S')
+        WHEN "{col}" LIKE '%/%/%' THEN strptime(NULLIF(TRIM("{col}"), ''), '%m/%d/%Y %H:%M:%S')
+        ELSE NULL
+    END"""
+
+def _distance_km_sql(start_station, end_station):
+    """
+    Haversine distance in km between the synthetic coordinates of two station expressions.
+    """
+    start_lat, start_lng = STATION_LAT_SQL.replace('{station}', start_station), STATION_LNG_SQL.replace('{station}', start_station)
+    end_lat, end_lng = STATION_LAT_SQL.replace('{station}', end_station), STATION_LNG_SQL.replace('{station}', end_station)
+    return (f"2 * 6371 * asin(sqrt(pow(sin(radians(({end_lat}) - ({start_lat})) / 2), 2) + "
+            f"cos(radians({start_lat})) * cos(radians({end_lat})) * pow(sin(radians(({end_lng}) - ({start_lng})) / 2), 2)))")
+
+def _create_month_trips(db_connection, year, month, rows, stations):
+    """
+    Generates one month of synthetic trips into MONTH_TRIPS_TABLE: start times spread over
+    the month, start/end stations drawn from a fixed set of stations and durations derived
+    from the distance between them at 8-20 km/h plus an exponential stop time, with a few
+    negative ones. Apart from those, the trips pass data_quality's checks.
+    """
+    month_seconds = calendar.monthrange(year, month)[1] * 86400
+    db_connection.execute(f"""
+        CREATE OR REPLACE TEMP TABLE "{MONTH_TRIPS_TABLE}" AS
+        SELECT row_id, start_ts,
+               CASE WHEN random() < 0.001 THEN -(random() * 600)::INTEGER
+                    ELSE (60 + {_distance_km_sql('start_station', 'end_station')} / (8 + random() * 12) * 3600
+                          - ln(random()) * 300)::INTEGER END AS duration_s,
+               start_station, end_station, is_member
+        FROM (
+            SELECT row_id,
+                   TIMESTAMP '{year}-{month:02d}-01' + to_microseconds((random() * {month_seconds} * 1000000)::BIGINT) AS start_ts,
+                   (random() * {stations})::INTEGER AS start_station,
+                   (random() * {stations})::INTEGER AS end_station,
+                   random() < 0.75 AS is_member
+            FROM range({rows}) t(row_id)
+        )
+    """)
+
+def _station_columns_sql(end, id_sql):
+    """
+    Returns the id, name, latitude and longitude expressions of the start or end station;
+    id_sql is the id expression with a {station} placeholder.
+    """
+    station = f"{end}_station"
+    return [
+        id_sql.replace('{station}', station),
+        f"'Station ' || {station}",
+        f"round({STATION_LAT_SQL.replace('{station}', station)}, 8)",
+        f"round({STATION_LNG_SQL.replace('{station}', station)}, 8)",
+    ]
+
+def _old_schema_select_sql(header, timestamp_format, iso_share=0.0):
+    """
+    Returns the SELECT list of an old-schema CSV in header order. A share of the rows
+    (iso_share) is written in ISO format to mimic the mixed formats of the real files.
+    """
+    def timestamp_sql(column):
+        return (f"CASE WHEN random() < {iso_share} THEN strftime({column}, '%Y-%m-%d %H:%M:%S') "
+                f"ELSE strftime({column}, '{timestamp_format}') END")
+    start_id, start_name, start_lat, start_lng = _station_columns_sql("start", "72 + {station}")
+    end_id, end_name, end_lat, end_lng = _station_columns_sql("end", "72 + {station}")
+    expressions = [
+        "duration_s", timestamp_sql("start_ts"), timestamp_sql("start_ts + to_seconds(duration_s)"),
+        start_id, start_name, start_lat, start_lng,
+        end_id, end_name, end_lat, end_lng,
+        "14529 + (row_id * 31) % 6000",
+        "CASE WHEN is_member THEN 'Subscriber' ELSE 'Customer' END",
+        "CASE WHEN random() < 0.1 THEN '\\N' ELSE (1940 + (random() * 60)::INTEGER)::VARCHAR END",
+        "(random() * 2.99)::INTEGER",
+    ]
+    return ", ".join(f'{expression} AS "{name}"' for expression, name in zip(expressions, header))
+
+def _new_schema_select_sql(header):
+    """
+    Returns the SELECT list of a member_casual CSV in header order. Electric bikes report
+    GPS coordinates, so theirs are jittered around the station.
+    """
+    station_id_sql = "(5000 + {station} // 10)::VARCHAR || '.' || lpad(({station} % 10)::VARCHAR, 2, '0')"
+    start_id, start_name, start_lat, start_lng = _station_columns_sql("start", station_id_sql)
+    end_id, end_name, end_lat, end_lng = _station_columns_sql("end", station_id_sql)
+    jitter = "CASE WHEN row_id % 5 < 2 THEN (random() - 0.5) / 2000 ELSE 0 END"
+    expressions = [
+        "upper(md5(row_id::VARCHAR || start_ts::VARCHAR)[:16])",
+        "CASE WHEN row_id % 5 < 2 THEN 'electric_bike' ELSE 'classic_bike' END",
+        "strftime(start_ts, '%Y-%m-%d %H:%M:%S.%g')",
+        "strftime(start_ts + to_seconds(duration_s), '%Y-%m-%d %H:%M:%S.%g')",
+        start_name, start_id, end_name, end_id,
+        f"{start_lat} + {jitter}", f"{start_lng} + {jitter}",
+        f"{end_lat} + {jitter}", f"{end_lng} + {jitter}",
+        "CASE WHEN is_member THEN 'member' ELSE 'casual' END",
+    ]
+    return ", ".join(f'{expression} AS "{name}"' for expression, name in zip(expressions, header))
+
+def _write_month_csv(db_connection, csv_path, select_sql, offset=0, limit=None):
+    """
+    Writes trips [offset, offset + limit) of MONTH_TRIPS_TABLE, in start time order like the
+    published files, to csv_path. Returns the row count.
+    """
+    limit_sql = f"LIMIT {limit} OFFSET {offset}" if limit is not None else ""
+    return db_connection.execute(f"""
+        COPY (
+            SELECT {select_sql} FROM "{MONTH_TRIPS_TABLE}" ORDER BY start_ts, row_id {limit_sql}
+        ) TO '{csv_path}' (FORMAT CSV, HEADER)
+    """).fetchone()[0]
+
+def generate_synthetic_archives(archive_dir, rows_per_month=100000, months_per_era=2, stations=800, seed=0.42):
+    """
+    Writes synthetic Citi Bike archives into archive_dir, one layout per schema era:
+    - 2013-citibike-tripdata.zip: annual zip of monthly CSVs, lowercase headers, ISO times
+    - 2014-citibike-tripdata.zip: annual zip of nested monthly zips, Title Case headers,
+      m/d/Y times with and without seconds and a share of ISO times, plus __MACOSX junk
+    - 2024MM-citibike-tripdata.csv.zip: member_casual CSVs split into _1, _2, ... parts
+    Returns (archive file names, total rows).
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    work_dir = os.path.join(archive_dir, "_work")
+    os.makedirs(work_dir, exist_ok=True)
+    db_connection = duckdb.connect()
+    db_connection.execute(f"SELECT setseed({seed})")
+    archive_names = []
+    total_rows = 0
+    try:
+        archive_name = "2013-citibike-tripdata.zip"
+        with zipfile.ZipFile(os.path.join(archive_dir, archive_name), 'w', zipfile.ZIP_DEFLATED) as annual_zip:
+            for month in range(6, 6 + months_per_era):
+                csv_path = os.path.join(work_dir, f"2013{month:02d}-citibike-tripdata.csv")
+                _create_month_trips(db_connection, 2013, month, rows_per_month, stations)
+                total_rows += _write_month_csv(
+                    db_connection, csv_path, _old_schema_select_sql(HEADERS['lowercase_2013'], '%Y-%m-%d %H:%M:%S'))
+                annual_zip.write(csv_path, os.path.basename(csv_path))
+                os.remove(csv_path)
+        archive_names.append(archive_name)
+
+        archive_name = "2014-citibike-tripdata.zip"
+        with zipfile.ZipFile(os.path.join(archive_dir, archive_name), 'w', zipfile.ZIP_DEFLATED) as annual_zip:
+            for month in range(1, 1 + months_per_era):
+                csv_name = f"2014{month:02d}-citibike-tripdata.csv"
+                csv_path = os.path.join(work_dir, csv_name)
+                timestamp_format = '%-m/%-d/%Y %H:%M:%S' if month % 2 else '%-m/%-d/%Y %H:%M'
+                _create_month_trips(db_connection, 2014, month, rows_per_month, stations)
+                total_rows += _write_month_csv(
+                    db_connection, csv_path, _old_schema_select_sql(HEADERS['title_case_2016'], timestamp_format, iso_share=0.01))
+                nested_buffer = io.BytesIO()
+                with zipfile.ZipFile(nested_buffer, 'w', zipfile.ZIP_DEFLATED) as nested_zip:
+                    nested_zip.write(csv_path, csv_name)
+                annual_zip.writestr(f"2014{month:02d}-citibike-tripdata.zip", nested_buffer.getvalue())
+                os.remove(csv_path)
+            annual_zip.writestr("__MACOSX/._2014-citibike-tripdata", b"\x00\x05\x16\x07")
+        archive_names.append(archive_name)
+
+        for month in range(1, 1 + months_per_era):
+            archive_name = f"2024{month:02d}-citibike-tripdata.csv.zip"
+            _create_month_trips(db_connection, 2024, month, rows_per_month, stations)
+            with zipfile.ZipFile(os.path.join(archive_dir, archive_name), 'w', zipfile.ZIP_DEFLATED) as month_zip:
+                for part, offset in enumerate(range(0, rows_per_month, NEW_SCHEMA_ROWS_PER_CSV), start=1):
+                    csv_name = f"2024{month:02d}-citibike-tripdata_{part}.csv"
+                    csv_path = os.path.join(work_dir, csv_name)
+                    total_rows += _write_month_csv(db_connection, csv_path, _new_schema_select_sql(HEADERS['member_casual_2020']),
+                                                   offset, NEW_SCHEMA_ROWS_PER_CSV)
+                    month_zip.write(csv_path, csv_name)
+                    os.remove(csv_path)
+            archive_names.append(archive_name)
+    finally:
+        db_connection.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return archive_names, total_rows
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def start_file_server(directory):
+    """
+    Serves directory over HTTP on a free localhost port from a daemon thread.
+    Returns (server, base_url); call server.shutdown() when done.
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+def _current_rss_bytes():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # No procfs: fall back to the process-wide high-water mark (KB on Linux, bytes on macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if os.uname().sysname == 'Darwin' else max_rss * 1024
+
+def measure_stage(stage_function, sample_interval=0.05):
+    """
+    Runs stage_function() while a thread samples the process RSS.
+    Returns (result, seconds, peak RSS in bytes during the stage).
+    """
+    peak_rss = [_current_rss_bytes()]
+    stop_event = threading.Event()
+
+    def sample():
+        while not stop_event.wait(sample_interval):
+            peak_rss[0] = max(peak_rss[0], _current_rss_bytes())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start_time = time.time()
+    try:
+        result = stage_function()
+    finally:
+        seconds = time.time() - start_time
+        stop_event.set()
+        sampler.join()
+    peak_rss[0] = max(peak_rss[0], _current_rss_bytes())
+    return result, seconds, peak_rss[0]
+
+def _stage_result(seconds, peak_rss, rows=None, data_bytes=None):
+    result = {'seconds': round(seconds, 3), 'peak_rss_mb': round(peak_rss / (1024 * 1024), 1)}
+    if rows is not None:
+        result['rows'] = rows
+        result['rows_per_second'] = round(rows / seconds, 1) if seconds > 0 else None
+    if data_bytes is not None:
+        result['mb'] = round(data_bytes / (1024 * 1024), 2)
+        result['mb_per_second'] = round(data_bytes / (1024 * 1024) / seconds, 2) if seconds > 0 else None
+    return result
+
+def time_timestamp_parsing(db_connection, csv_paths):
+    """
+    Times parsing the timestamp columns of the old-schema CSVs with LEGACY_TIMESTAMP_PARSE_SQL
+    and with timestamp_parse_sql for the format detected from each file's sample. The columns
+    are loaded as VARCHAR first, so only the parse is timed. Files the legacy parse fails on
+    are counted in its failed_files and left out of both timings. Returns {'legacy': stage
+    result, 'detected': stage result}, rows/s counting CSV rows.
+    """
+    totals = {name: {'seconds': 0.0, 'peak_rss': 0, 'rows': 0, 'parsed_values': 0} for name in ('legacy', 'detected')}
+    failed_files = 0
+    for csv_path in csv_paths:
+        with open(csv_path, 'rb') as f:
+            columns, sample_rows, _ = sniff_csv(f)
+        plan = plan_for_header(columns)
+        if plan is None or plan['schema'] != 'old_schema':
+            continue
+        timestamp_format = detect_plan_timestamp_format(plan, columns, sample_rows)
+        db_connection.execute(f"""
+            CREATE OR REPLACE TEMP TABLE "{TIMESTAMP_VALUES_TABLE}" AS
+            SELECT {", ".join(f'"{column}"' for column in plan['timestamp_columns'])}
+            FROM read_csv('{csv_path}', header=true, all_varchar=true)
+        """)
+        parse_sql = {
+            'legacy': [LEGACY_TIMESTAMP_PARSE_SQL.replace('{col}', column) for column in plan['timestamp_columns']],
+            'detected': [timestamp_parse_sql(column, timestamp_format) for column in plan['timestamp_columns']],
+        }
+        timings = {}
+        try:
+            for name, expressions in parse_sql.items():
+                counts_sql = " + ".join(f"count({expression})" for expression in expressions)
+                query = f'SELECT count(*), {counts_sql} FROM "{TIMESTAMP_VALUES_TABLE}"'
+                timings[name] = measure_stage(lambda: db_connection.execute(query).fetchone())
+        except duckdb.Error as e:
+            print(f"Legacy timestamp parse failed on {os.path.basename(csv_path)}: {str(e).splitlines()[0]}")
+            failed_files += 1
+            continue
+        for name, ((rows, parsed_values), seconds, peak_rss) in timings.items():
+            totals[name]['seconds'] += seconds
+            totals[name]['peak_rss'] = max(totals[name]['peak_rss'], peak_rss)
+            totals[name]['rows'] += rows
+            totals[name]['parsed_values'] += parsed_values
+    db_connection.execute(f'DROP TABLE IF EXISTS "{TIMESTAMP_VALUES_TABLE}"')
+
+    results = {}
+    for name, total in totals.items():
+        results[name] = _stage_result(total['seconds'], total['peak_rss'], rows=total['rows'])
+        results[name]['parsed_values'] = total['parsed_values']
+    results['legacy']['failed_files'] = failed_files
+    return results
+
+def run_benchmark(work_dir, rows_per_month=100000, months_per_era=2, stations=800):
+    """
+    Generates synthetic archives under work_dir, serves them locally and times the three
+    pipeline stages separately: download_and_extract_files_generator (MB/s of archives),
+    process_csv_to_duckdb (rows/s and MB/s of CSV) and convert_parquet (rows/s and MB/s
+    of Parquet written). The old-schema timestamp parse is timed on its own as well, the
+    legacy CASE/LIKE parse against the detected format (see time_timestamp_parsing).
+    Returns the result dict.
+    """
+    archive_dir = os.path.join(work_dir, "archives")
+    download_dir = os.path.join(work_dir, "download")
+    parquet_dir = os.path.join(work_dir, "parquet")
+    db_file = os.path.join(work_dir, "benchmark.db")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(download_dir)
+
+    (archive_names, generated_rows), generate_seconds, _ = measure_stage(
+        lambda: generate_synthetic_archives(archive_dir, rows_per_month, months_per_era, stations))
+    archive_bytes = sum(os.path.getsize(os.path.join(archive_dir, name)) for name in archive_names)
+    print(f"Generated {generated_rows} rows in {len(archive_names)} archives "
+          f"({archive_bytes / (1024 * 1024):.1f} MB) in {generate_seconds:.2f} seconds")
+
+    server, base_url = start_file_server(archive_dir)
+    db_connection = duckdb.connect(database=db_file, read_only=False)
+    stages = {}
+    try:
+        urls = [f"{base_url}{name}" for name in archive_names]
+        csv_paths, seconds, peak_rss = measure_stage(
+            lambda: list(download_and_extract_files_generator(urls, download_dir)))
+        csv_bytes = sum(os.path.getsize(path) for path in csv_paths)
+        stages['download_extract'] = _stage_result(seconds, peak_rss, data_bytes=archive_bytes)
+        stages['download_extract']['csv_files'] = len(csv_paths)
+
+        parse_connection = duckdb.connect()
+        try:
+            parse_results = time_timestamp_parsing(parse_connection, csv_paths)
+        finally:
+            parse_connection.close()
+        stages['parse_legacy'], stages['parse_detected'] = parse_results['legacy'], parse_results['detected']
+
+        def load_csvs():
+            # Rows read, quarantined ones included: flagging them is part of the load
+            read_rows = quarantined_rows = 0
+            for csv_path in csv_paths:
+                load_result = process_csv_to_duckdb(csv_path, db_connection)
+                if load_result is not None:
+                    read_rows += load_result[1] + load_result[2]
+                    quarantined_rows += load_result[2]
+            return read_rows, quarantined_rows
+        (read_rows, quarantined_rows), seconds, peak_rss = measure_stage(load_csvs)
+        stages['load'] = _stage_result(seconds, peak_rss, rows=read_rows, data_bytes=csv_bytes)
+        stages['load']['quarantined_rows'] = quarantined_rows
+
+        _, seconds, peak_rss = measure_stage(lambda: convert_parquet(db_connection, parquet_dir))
+        parquet_files = glob.glob(os.path.join(parquet_dir, "**", "*.parquet"), recursive=True)
+        parquet_files = [path for path in parquet_files if os.path.isfile(path)]
+        exported_rows = duckdb.sql(f"SELECT COUNT(*) FROM read_parquet({parquet_files!r})").fetchone()[0] if parquet_files else 0
+        stages['export'] = _stage_result(seconds, peak_rss, rows=exported_rows,
+                                         data_bytes=sum(os.path.getsize(path) for path in parquet_files))
+    finally:
+        db_connection.close()
+        server.shutdown()
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'duckdb_version': duckdb.__version__,
+        'rows_per_month': rows_per_month,
+        'months_per_era': months_per_era,
+        'generated_rows': generated_rows,
+        'stages': stages,
+    }
+
+def append_result(results_file, result):
+    """
+    Appends a benchmark result to the JSON list in results_file, creating it if needed.
+    """
+    results = []
+    if os.path.exists(results_file):
+        with open(results_file, 'r') as f:
+            results = json.load(f)
+    results.append(result)
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the Citi Bike ETL on synthetic archives')
+    parser.add_argument('--rows-per-month', type=int, default=100000, help='Synthetic trips per month and era')
+    parser.add_argument('--months-per-era', type=int, default=2, help='Months generated for each schema era')
+    parser.add_argument('--stations', type=int, default=800, help='Number of synthetic stations')
+    parser.add_argument('--work-dir', type=str, default="benchmark_work", help='Scratch directory for archives, database and output')
+    parser.add_argument('--results-file', type=str, default="benchmark_results.json", help='JSON file the results are appended to')
+    parser.add_argument('--keep-work-dir', action='store_true', help='Keep the scratch directory after the run')
+    args = parser.parse_args()
+
+    ROWS_PER_MONTH = args.rows_per_month
+    MONTHS_PER_ERA = args.months_per_era
+    STATIONS = args.stations
+    WORK_DIR = args.work_dir
+    RESULTS_FILE = args.results_file
+    KEEP_WORK_DIR = args.keep_work_dir
+
+    result = run_benchmark(WORK_DIR, ROWS_PER_MONTH, MONTHS_PER_ERA, STATIONS)
+    append_result(RESULTS_FILE, result)
+    if not KEEP_WORK_DIR:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    print(f"\n{'stage':<18}{'seconds':>10}{'rows/s':>14}{'MB/s':>10}{'peak RSS MB':>14}")
+    for stage_name, stage in result['stages'].items():
+        rows_per_second = stage.get('rows_per_second')
+        print(f"{stage_name:<18}{stage['seconds']:>10.2f}{rows_per_second if rows_per_second is not None else '-':>14}"
+              f"{stage.get('mb_per_second') or '-':>10}{stage['peak_rss_mb']:>14}")
+    print(f"Results appended to {RESULTS_FILE}")
@@ -11,6 +11,7 @@ import re
 # import requests # Not directly used by this version of the pipeline functions
 import duckdb
 import shutil
+from schema_registry import detect_plan_timestamp_format, plan_for_header, sniff_csv, timestamp_parse_sql
 
 # Function to generate file names based on year and month ranges
 def generate_file_names(start_year_param, end_year_param, end_month_for_final_year_param):
@@ -209,9 +210,11 @@ def process_csv_to_duckdb(csv_file_path, db_connection):
 
     select_statement = None
     final_table_name = ""
+    plan = plan_for_header(sample_df.columns.tolist())
+    schema_name = plan['schema'] if plan else None
     
     # --- Schema Detection and SELECT Statement Construction ---
-    if 'member_casual' in sample_df.columns:
+    if schema_name == 'new_schema':
         final_table_name = f"citibike_data_{table_name_suffix}_new_schema"
         select_statement = f"""
         SELECT
@@ -230,81 +233,56 @@ def process_csv_to_duckdb(csv_file_path, db_connection):
             "member_casual"::VARCHAR AS member_casual
         FROM read_csv('{csv_file_path}', header=true, ignore_errors=true, types={{'start_station_id': 'VARCHAR', 'end_station_id': 'VARCHAR'}})
         """
-    elif 'gender' in sample_df.columns or 'Gender' in sample_df.columns:
+    elif schema_name == 'old_schema':
         final_table_name = f"citibike_data_{table_name_suffix}_old_schema"
-        
-        def get_col_name(potential_names, df_cols_list):
-            col_map = {col.lower(): col for col in df_cols_list}
-            col_map.update({col.lower().replace(' ', ''): col for col in df_cols_list})
-
-            for name_variant in potential_names:
-                if name_variant in df_cols_list: return name_variant
-                if name_variant.lower() in col_map: return col_map[name_variant.lower()]
-                if name_variant.lower().replace(' ', '') in col_map: return col_map[name_variant.lower().replace(' ', '')]
-            return None
 
+        # Column names as spelled in this file's header variant (see schema_registry.py)
         s_cols = sample_df.columns.tolist()
-        start_time_col = get_col_name(['starttime', 'Start Time'], s_cols)
-        stop_time_col = get_col_name(['stoptime', 'Stop Time'], s_cols)
-        start_station_id_col = get_col_name(['start station id', 'Start Station ID'], s_cols)
-        start_station_name_col = get_col_name(['start station name', 'Start Station Name'], s_cols)
-        start_station_lat_col = get_col_name(['start station latitude', 'Start Station Latitude'], s_cols)
-        start_station_lng_col = get_col_name(['start station longitude', 'Start Station Longitude'], s_cols)
-        end_station_id_col = get_col_name(['end station id', 'End Station ID'], s_cols)
-        end_station_name_col = get_col_name(['end station name', 'End Station Name'], s_cols)
-        end_station_lat_col = get_col_name(['end station latitude', 'End Station Latitude'], s_cols)
-        end_station_lng_col = get_col_name(['end station longitude', 'End Station Longitude'], s_cols)
-        bikeid_col = get_col_name(['bikeid', 'Bike ID'], s_cols)
-        usertype_col = get_col_name(['usertype', 'User Type'], s_cols)
-        birth_year_col = get_col_name(['birth year', 'Birth Year'], s_cols)
-        gender_col = get_col_name(['gender', 'Gender'], s_cols)
-
-        required_cols_present = all([
-            start_time_col, stop_time_col, start_station_id_col, start_station_name_col,
-            start_station_lat_col, start_station_lng_col, end_station_id_col, end_station_name_col,
-            end_station_lat_col, end_station_lng_col, bikeid_col, usertype_col, gender_col
-        ])
-
-        if not required_cols_present:
-            print(f"Missing one or more critical columns for old schema in {filename}. Skipping.")
-            return
-
-        is_starttime_string = start_time_col and start_time_col in sample_df and sample_df[start_time_col].dtype == 'object'
-        
+        old_schema_columns = plan['columns']
+        start_time_col = old_schema_columns['starttime']
+        stop_time_col = old_schema_columns['stoptime']
+        start_station_id_col = old_schema_columns['start_station_id']
+        start_station_name_col = old_schema_columns['start_station_name']
+        start_station_lat_col = old_schema_columns['start_station_latitude']
+        start_station_lng_col = old_schema_columns['start_station_longitude']
+        end_station_id_col = old_schema_columns['end_station_id']
+        end_station_name_col = old_schema_columns['end_station_name']
+        end_station_lat_col = old_schema_columns['end_station_latitude']
+        end_station_lng_col = old_schema_columns['end_station_longitude']
+        bikeid_col = old_schema_columns['bikeid']
+        usertype_col = old_schema_columns['usertype']
+        birth_year_col = old_schema_columns.get('birth_year')
+        gender_col = old_schema_columns['gender']
+
+        # Decide the timestamp format once from a sample instead of pattern-matching every row
+        with open(csv_file_path, 'rb') as f:
+            header_columns, sample_rows, _ = sniff_csv(f)
+        timestamp_format = detect_plan_timestamp_format(plan, header_columns, sample_rows)
+        print(f"Detected timestamp format for {filename}: {timestamp_format or 'none (using fallbacks)'}")
+
         current_read_csv_types = {
-            f'"{start_station_id_col}"': 'VARCHAR', f'"{end_station_id_col}"': 'VARCHAR',
-            f'"{end_station_lat_col}"': 'VARCHAR', f'"{end_station_lng_col}"': 'VARCHAR'
+            start_station_id_col: 'VARCHAR', end_station_id_col: 'VARCHAR',
+            end_station_lat_col: 'VARCHAR', end_station_lng_col: 'VARCHAR',
+            start_time_col: 'VARCHAR', stop_time_col: 'VARCHAR'
         }
-
-        if is_starttime_string:
-            if start_time_col: current_read_csv_types[f'"{start_time_col}"'] = 'VARCHAR'
-            if stop_time_col: current_read_csv_types[f'"{stop_time_col}"'] = 'VARCHAR'
-            time_select_sql = f"""
-                CASE
-                    WHEN "{start_time_col}" ~ '^\\d{{1,2}}/\\d{{1,2}}/\\d{{4}} \\d{{1,2}}:\\d{{1,2}}:\\d{{1,2}}$' THEN strptime("{start_time_col}", '%m/%d/%Y %H:%M:%S')
-                    WHEN "{start_time_col}" ~ '^\\d{{1,2}}/\\d{{1,2}}/\\d{{4}} \\d{{1,2}}:\\d{{1,2}}$' THEN strptime("{start_time_col}", '%m/%d/%Y %H:%M')
-                    WHEN "{start_time_col}" ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}} \\d{{2}}:\\d{{2}}:\\d{{2}}(\\.\\d{{1,6}})?$' THEN strptime("{start_time_col}", '%Y-%m-%d %H:%M:%S.%f')
-                    WHEN "{start_time_col}" ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}} \\d{{2}}:\\d{{2}}:\\d{{2}}$' THEN strptime("{start_time_col}", '%Y-%m-%d %H:%M:%S')
-                    ELSE NULL
-                END AS starttime,
-                CASE
-                    WHEN "{stop_time_col}" ~ '^\\d{{1,2}}/\\d{{1,2}}/\\d{{4}} \\d{{1,2}}:\\d{{1,2}}:\\d{{1,2}}$' THEN strptime("{stop_time_col}", '%m/%d/%Y %H:%M:%S')
-                    WHEN "{stop_time_col}" ~ '^\\d{{1,2}}/\\d{{1,2}}/\\d{{4}} \\d{{1,2}}:\\d{{1,2}}$' THEN strptime("{stop_time_col}", '%m/%d/%Y %H:%M')
-                    WHEN "{stop_time_col}" ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}} \\d{{2}}:\\d{{2}}:\\d{{2}}(\\.\\d{{1,6}})?$' THEN strptime("{stop_time_col}", '%Y-%m-%d %H:%M:%S.%f')
-                    WHEN "{stop_time_col}" ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}} \\d{{2}}:\\d{{2}}:\\d{{2}}$' THEN strptime("{stop_time_col}", '%Y-%m-%d %H:%M:%S')
-                    ELSE NULL
-                END AS stoptime
-            """
-        else: 
-            time_select_sql = f"""
-                "{start_time_col}"::TIMESTAMP AS starttime,
-                "{stop_time_col}"::TIMESTAMP AS stoptime
+        time_select_sql = f"""
+                {timestamp_parse_sql(start_time_col, timestamp_format)} AS starttime,
+                {timestamp_parse_sql(stop_time_col, timestamp_format)} AS stoptime
             """
         
-        types_str_parts = [f"'{k.strip().stripchr('\"')}': '{v}'" for k, v in current_read_csv_types.items() if k.strip().stripchr('"') in s_cols]
+        types_str_parts = [f"'{k}': '{v}'" for k, v in current_read_csv_types.items() if k in s_cols]
         types_dict_str = f"{{{', '.join(types_str_parts)}}}"
         read_csv_options_old_schema = f"'{csv_file_path}', header=true, ignore_errors=true, types={types_dict_str}, auto_detect=true"
 
+        if birth_year_col:
+            birth_year_sql = f"""CASE 
+                WHEN "{birth_year_col}" IS NOT NULL AND TRIM(CAST("{birth_year_col}" AS VARCHAR)) != '' 
+                THEN LEFT(TRIM(CAST("{birth_year_col}" AS VARCHAR)), 4) 
+                ELSE NULL 
+            END"""
+        else:
+            birth_year_sql = "NULL"
+
         select_statement = f"""
         SELECT
             {time_select_sql},
@@ -318,11 +296,7 @@ def process_csv_to_duckdb(csv_file_path, db_connection):
             NULLIF(CAST("{end_station_lng_col}" AS VARCHAR), 'NULL')::DOUBLE AS end_station_longitude,
             "{bikeid_col}"::BIGINT AS bikeid,
             "{usertype_col}"::VARCHAR AS usertype,
-            CASE 
-                WHEN "{birth_year_col}" IS NOT NULL AND TRIM(CAST("{birth_year_col}" AS VARCHAR)) != '' 
-                THEN LEFT(TRIM(CAST("{birth_year_col}" AS VARCHAR)), 4) 
-                ELSE NULL 
-            END::VARCHAR AS birth_year,
+            {birth_year_sql}::VARCHAR AS birth_year,
             "{gender_col}"::BIGINT AS gender
         FROM read_csv({read_csv_options_old_schema})
         """
@@ -1,64 +1,38 @@
 #!/bin/bash
 
+# improved_etl.py now writes GeoParquet (CRS and bbox metadata) itself. This script is only
+# needed to rewrite plain Parquet output produced by earlier versions of the pipeline.
+# The work is done by geoparquet_finalize.py, which rewrites files in parallel, replaces
+# each one atomically and skips files whose footer already carries valid geo metadata.
+
 # --- CONFIGURATION ---
 # Define the parent folder where the output directories are located.
 OUTPUT_PARENT_FOLDER="final_parquet_folder"
 
 # Define an array containing the names of the two possible sub-directories.
-# The script will loop through this array.
 SCHEMA_FOLDERS=(
     "new_schema_combined_with_geom.parquet"
     "old_schema_combined_with_geom.parquet"
 )
 
+# Number of files rewritten in parallel (defaults to the number of CPUs)
+WORKERS=$(nproc)
+
 
 # --- SCRIPT LOGIC ---
 echo "--- Starting Bulk Conversion to GeoParquet ---"
 
-# Create an outer loop to process each schema folder defined above.
+DATASETS=()
 for schema_folder in "${SCHEMA_FOLDERS[@]}"; do
-    
-    # Construct the full path to the directory to be processed.
-    PARQUET_ROOT="$OUTPUT_PARENT_FOLDER/$schema_folder"
-
-    # First, check if this directory actually exists. If not, skip it.
-    if [ ! -d "$PARQUET_ROOT" ]; then
-        echo
-        echo "--> Directory not found, skipping: $PARQUET_ROOT"
-        continue # Go to the next item in the SCHEMA_FOLDERS array
-    fi
-
-    echo
-    echo ">>> Processing all files in root directory: $PARQUET_ROOT"
-
-    # Find every individual .parquet file within the current directory and loop through them.
-    find "$PARQUET_ROOT" -type f -name "*.parquet" | while read original_file; do
-        echo "--------------------------------------------------"
-        echo "Processing: $original_file"
-
-        # Create a temporary file name.
-        temp_file="$(dirname "$original_file")/temp_geoparquet.parquet"
-
-        # Run the conversion, writing the corrected data to the temporary file.
-        ogr2ogr -f Parquet \
-                -a_srs "EPSG:4326" \
-                -lco GEOMETRY_NAME=start_geom \
-                "$temp_file" \
-                "$original_file"
-
-        # Check if the conversion was successful.
-        if [ $? -eq 0 ]; then
-            # If successful, replace the original file with the new one.
-            mv "$temp_file" "$original_file"
-            echo "Success. Original file has been updated to GeoParquet."
-        else
-            # If it failed, print an error and stop the entire script.
-            echo "ERROR: ogr2ogr failed for $original_file. Aborting."
-            rm -f "$temp_file" # Clean up the failed temp file
-            exit 1
-        fi
-    done
+    DATASETS+=("$OUTPUT_PARENT_FOLDER/$schema_folder")
 done
 
+# Missing directories are reported and skipped; any failed file makes the script exit non-zero.
+python3 geoparquet_finalize.py --workers "$WORKERS" "${DATASETS[@]}"
+if [ $? -ne 0 ]; then
+    echo "ERROR: GeoParquet conversion failed for some files. Rerun to retry only those."
+    exit 1
+fi
+
 echo
-echo "--- Bulk Conversion Complete for All Directories ---"
\ No newline at end of file
+echo "--- Bulk Conversion Complete for All Directories ---"
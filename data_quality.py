@@ -0,0 +1,216 @@
+import os
+
+import metrics
+
+# Checks computed for every loaded row, as bits of its dq_flags column
+DQ_CHECKS = [
+    ("missing_time", 1, "start or end time missing or unparseable"),
+    ("null_coordinates", 2, "a start/end coordinate is empty"),
+    ("invalid_coordinates", 4, "a start/end coordinate is text that isn't a number"),
+    ("negative_duration", 8, "trip ends before it starts"),
+    ("outside_nyc", 16, "start or end point outside the NYC service area"),
+    ("impossible_speed", 32, "straight-line speed between start and end above MAX_SPEED_KMH"),
+    ("outside_profile_type", 64, "a value the storage profile's narrower type (e.g. an ENUM) can't hold"),
+]
+# Service area (Jersey City included); the same box the Hilbert sort uses
+NYC_BOUNDS = {'min_lng': -74.3, 'min_lat': 40.45, 'max_lng': -73.65, 'max_lat': 40.95}
+# Straight-line station-to-station speed no bike ride reaches (e-bikes are capped at ~30 km/h)
+MAX_SPEED_KMH = 60
+# Every table created here starts with this prefix so table discovery can leave them out
+DQ_TABLE_PREFIX = "dq_"
+QUALITY_COUNTS_TABLE = "dq_month_counts"
+COUNTS_COLUMNS = (["table_name", "source_file", "year", "month", "rows_loaded", "quarantined"]
+                  + [name for name, _, _ in DQ_CHECKS] + ["loaded_at"])
+# Set by the load plan (see schema_registry.compile_plan) and folded into dq_flags
+INVALID_COORDINATES_MARKER = "dq_invalid_coordinates"
+OUTSIDE_PROFILE_TYPE_MARKER = "dq_outside_profile_type"
+
+def quarantine_table_name(schema_name):
+    """
+    Returns the quarantine table of a schema family ('old_schema' or 'new_schema').
+    """
+    return f"{DQ_TABLE_PREFIX}quarantine_{schema_name}"
+
+def is_quality_table(table_name):
+    return table_name.startswith(DQ_TABLE_PREFIX)
+
+def dq_flags_sql(details):
+    """
+    Returns the dq_flags expression (a UTINYINT bitmask of DQ_CHECKS) over the typed columns
+    of a load SELECT, details giving its time and coordinate columns (an EXPORT_SCHEMAS entry).
+    """
+    start_time, end_time = f'"{details["time_col"]}"', f'"{details["end_time_col"]}"'
+    start_lng, start_lat = f'"{details["start_lng_col"]}"', f'"{details["start_lat_col"]}"'
+    end_lng, end_lat = f'"{details["end_lng_col"]}"', f'"{details["end_lat_col"]}"'
+    coordinates = (start_lng, start_lat, end_lng, end_lat)
+    inside_nyc = " AND ".join(
+        f"{lng} BETWEEN {NYC_BOUNDS['min_lng']} AND {NYC_BOUNDS['max_lng']} "
+        f"AND {lat} BETWEEN {NYC_BOUNDS['min_lat']} AND {NYC_BOUNDS['max_lat']}"
+        for lng, lat in ((start_lng, start_lat), (end_lng, end_lat)))
+    # Haversine distance in km between the start and end points
+    distance_km = (f"2 * 6371 * asin(sqrt(pow(sin(radians({end_lat} - {start_lat}) / 2), 2) + "
+                   f"cos(radians({start_lat})) * cos(radians({end_lat})) * pow(sin(radians({end_lng} - {start_lng}) / 2), 2)))")
+    duration_seconds = f"date_diff('second', {start_time}, {end_time})"
+    conditions = {
+        "missing_time": f"{start_time} IS NULL OR {end_time} IS NULL",
+        "null_coordinates": f"({' OR '.join(f'{column} IS NULL' for column in coordinates)}) AND NOT {INVALID_COORDINATES_MARKER}",
+        "invalid_coordinates": INVALID_COORDINATES_MARKER,
+        "negative_duration": f"{end_time} < {start_time}",
+        "outside_nyc": f"NOT ({inside_nyc})",
+        "impossible_speed": f"{duration_seconds} > 0 AND {distance_km} * 3600 > {MAX_SPEED_KMH} * {duration_seconds}",
+        "outside_profile_type": OUTSIDE_PROFILE_TYPE_MARKER,
+    }
+    bits = [f"CASE WHEN {conditions[name]} THEN {bit} ELSE 0 END" for name, bit, _ in DQ_CHECKS]
+    return f"({' + '.join(bits)})::UTINYINT"
+
+def flagged_select_sql(select_sql, details):
+    """
+    Wraps a load SELECT (a compiled schema_registry plan) so every row comes out with its
+    dq_flags. The checks are column expressions over the same scan, so flagging costs no
+    extra pass over the CSV.
+    """
+    return f"""SELECT * EXCLUDE ({INVALID_COORDINATES_MARKER}, {OUTSIDE_PROFILE_TYPE_MARKER}), {dq_flags_sql(details)} AS dq_flags
+        FROM ({select_sql})"""
+
+def ensure_counts_table(db_connection):
+    """
+    Creates dq_month_counts, one row of per-check counts per loaded file, if it doesn't exist.
+    rows_loaded counts the rows kept in the monthly table, quarantined the rows moved out.
+    A table from before a check was added gets its column, so write it by column name
+    (see COUNTS_COLUMNS).
+    """
+    check_columns = ", ".join(f"{name} BIGINT" for name, _, _ in DQ_CHECKS)
+    db_connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS "{QUALITY_COUNTS_TABLE}" (
+            table_name VARCHAR, source_file VARCHAR, year INTEGER, month INTEGER,
+            rows_loaded BIGINT, quarantined BIGINT, {check_columns}, loaded_at TIMESTAMP
+        )
+    """)
+    for name, _, _ in DQ_CHECKS:
+        db_connection.execute(f'ALTER TABLE "{QUALITY_COUNTS_TABLE}" ADD COLUMN IF NOT EXISTS {name} BIGINT')
+
+def _quarantine_tables(db_connection):
+    return sorted(row[0] for row in db_connection.execute(
+        "SELECT table_name FROM information_schema.tables WHERE starts_with(table_name, ?)",
+        [f"{DQ_TABLE_PREFIX}quarantine_"]).fetchall())
+
+def load_flagged_rows(db_connection, flagged_sql, table_name, schema_name, source_file, append=False, partition=None):
+    """
+    Loads a flagged load SELECT (see flagged_select_sql) straight into table_name (created
+    unless append), then moves its flagged rows to the schema family's quarantine table
+    (created with table_name's columns plus source_table/source_file) and records the
+    file's per-check counts in dq_month_counts. The CSV is read and written once; finding
+    the flagged rows only reads the one-byte dq_flags column, and the counts, the quarantine
+    copy and the delete only touch those rows. Earlier loads left no flagged rows behind, so
+    every flagged row in table_name is from this file. Runs in one transaction, so a failed
+    load leaves table_name as it was. Returns {check: count} plus 'loaded' and 'quarantined'.
+    """
+    ensure_counts_table(db_connection)
+    quarantine_table = quarantine_table_name(schema_name)
+    db_connection.begin()
+    try:
+        if append:
+            total_rows = db_connection.execute(f'INSERT INTO "{table_name}" {flagged_sql}').fetchone()[0]
+        else:
+            total_rows = db_connection.execute(f'CREATE TABLE "{table_name}" AS {flagged_sql}').fetchone()[0]
+        # The CSV scan is this query; the rest only reads the flagged rows
+        metrics.record_duckdb_profile(db_connection)
+
+        count_columns = ", ".join(f"count(*) FILTER (WHERE dq_flags & {bit} <> 0)" for _, bit, _ in DQ_CHECKS)
+        flagged_counts = db_connection.execute(
+            f'SELECT count(*), {count_columns} FROM "{table_name}" WHERE dq_flags <> 0').fetchone()
+        db_connection.execute(f"""
+            CREATE TABLE IF NOT EXISTS "{quarantine_table}" AS
+            SELECT *, NULL::VARCHAR AS source_table, NULL::VARCHAR AS source_file FROM "{table_name}" LIMIT 0
+        """)
+        if flagged_counts[0]:
+            db_connection.execute(f"""
+                INSERT INTO "{quarantine_table}" BY NAME
+                SELECT *, ? AS source_table, ? AS source_file FROM "{table_name}" WHERE dq_flags <> 0
+            """, [table_name, source_file])
+            db_connection.execute(f'DELETE FROM "{table_name}" WHERE dq_flags <> 0')
+
+        counts = [total_rows - flagged_counts[0]] + list(flagged_counts)
+        year, month = partition or (None, None)
+        db_connection.execute(f'INSERT INTO "{QUALITY_COUNTS_TABLE}" ({", ".join(COUNTS_COLUMNS)}) '
+                              f'VALUES (?, ?, ?, ?, {", ".join("?" for _ in counts)}, current_timestamp)',
+                              [table_name, source_file, year, month] + counts)
+        db_connection.commit()
+    except Exception:
+        db_connection.rollback()
+        raise
+    check_counts = dict(zip([name for name, _, _ in DQ_CHECKS], counts[2:]))
+    check_counts['loaded'], check_counts['quarantined'] = counts[0], counts[1]
+    return check_counts
+
+def clear_quality_records(db_connection, table_name):
+    """
+    Forgets the quarantined rows and counts of a monthly table that is about to be reloaded.
+    """
+    for quality_table in _quarantine_tables(db_connection):
+        db_connection.execute(f'DELETE FROM "{quality_table}" WHERE source_table = ?', [table_name])
+    ensure_counts_table(db_connection)
+    db_connection.execute(f'DELETE FROM "{QUALITY_COUNTS_TABLE}" WHERE table_name = ?', [table_name])
+
+def stage_quality_records(db_connection, staging_dir, stem):
+    """
+    For ingest workers with a private DuckDB: writes each non-empty quarantine table to a
+    staging Parquet file and returns {'quarantine': [(table, path)], 'counts': [rows]} for
+    register_staged_quality to load into the main database.
+    """
+    staged = {'quarantine': [], 'counts': []}
+    for quality_table in _quarantine_tables(db_connection):
+        if db_connection.execute(f'SELECT count(*) FROM "{quality_table}"').fetchone()[0] == 0:
+            continue
+        staging_path = os.path.join(staging_dir, f"{stem}.{quality_table}.parquet")
+        db_connection.execute(f"""COPY "{quality_table}" TO '{staging_path}' (FORMAT PARQUET, COMPRESSION ZSTD)""")
+        staged['quarantine'].append((quality_table, staging_path))
+    ensure_counts_table(db_connection)
+    staged['counts'] = db_connection.execute(f'SELECT {", ".join(COUNTS_COLUMNS)} FROM "{QUALITY_COUNTS_TABLE}"').fetchall()
+    return staged
+
+def register_staged_quality(db_connection, staged):
+    """
+    Loads what stage_quality_records staged into the main database and deletes the staging files.
+    """
+    for quality_table, staging_path in staged['quarantine']:
+        db_connection.execute(f"""CREATE TABLE IF NOT EXISTS "{quality_table}" AS SELECT * FROM read_parquet('{staging_path}') LIMIT 0""")
+        db_connection.execute(f"""INSERT INTO "{quality_table}" BY NAME SELECT * FROM read_parquet('{staging_path}')""")
+        os.remove(staging_path)
+    if staged['counts']:
+        ensure_counts_table(db_connection)
+        placeholders = ", ".join("?" for _ in COUNTS_COLUMNS)
+        db_connection.executemany(f'INSERT INTO "{QUALITY_COUNTS_TABLE}" ({", ".join(COUNTS_COLUMNS)}) VALUES ({placeholders})',
+                                  staged['counts'])
+
+def export_quality_report(db_connection, output_dir):
+    """
+    Writes the per-month quality counts to <output_dir>/data_quality_counts.parquet and each
+    quarantine table to <output_dir>/<table>.parquet, and prints the counts. Returns the
+    number of monthly tables reported.
+    """
+    ensure_counts_table(db_connection)
+    check_names = [name for name, _, _ in DQ_CHECKS]
+    month_counts_sql = f"""
+        SELECT year, month, table_name, sum(rows_loaded) AS rows_loaded, sum(quarantined) AS quarantined,
+               {", ".join(f"sum({name}) AS {name}" for name in check_names)}
+        FROM "{QUALITY_COUNTS_TABLE}"
+        GROUP BY ALL
+        ORDER BY year, month, table_name
+    """
+    months = db_connection.execute(month_counts_sql).fetchall()
+    if not months:
+        return 0
+    counts_path = os.path.join(output_dir, "data_quality_counts.parquet")
+    db_connection.execute(f"""COPY ({month_counts_sql}) TO '{counts_path}' (FORMAT PARQUET)""")
+    print(f"\n{'table':<36}{'rows':>11}{'quarantined':>13}" + "".join(f"{name:>{len(name) + 2}}" for name in check_names))
+    for year, month, table_name, rows_loaded, quarantined, *check_counts in months:
+        print(f"{table_name:<36}{rows_loaded:>11}{quarantined:>13}"
+              + "".join(f"{count:>{len(name) + 2}}" for name, count in zip(check_names, check_counts)))
+    print(f"Wrote data quality counts to {counts_path}")
+
+    for quality_table in _quarantine_tables(db_connection):
+        quarantine_path = os.path.join(output_dir, f"{quality_table}.parquet")
+        db_connection.execute(f"""COPY "{quality_table}" TO '{quarantine_path}' (FORMAT PARQUET, COMPRESSION ZSTD)""")
+        print(f"Exported quarantined rows of {quality_table} to {quarantine_path}")
+    return len(months)
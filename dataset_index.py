@@ -0,0 +1,229 @@
+import os
+import re
+import glob
+import json
+import datetime
+
+import duckdb
+
+from export_schemas import STATIONS_TABLE
+
+# Sidecar written at the root of each exported dataset (e.g. old_schema_combined_with_geom.parquet/_index.json)
+INDEX_FILE_NAME = "_index.json"
+# Version 2 resolves station keys to ids; entries written by older versions are re-read
+INDEX_VERSION = 2
+
+_PARTITION_PATTERN = re.compile(r"year=(\d+)/month=(\d+)/")
+
+def station_id_sql(end, column_names):
+    """
+    Station id expression of the start or end (end) station of a trip dataset with
+    column_names, read as alias t: its id column, or for datasets keyed by the station
+    dimension (--station-dimension output, any era) the id of the station joined as
+    {end}_station, or the first of the two when files of both kinds are read together.
+    """
+    id_sql = f't."{end}_station_id"::VARCHAR'
+    key_sql = f"{end}_station.station_id::VARCHAR"
+    if f"{end}_station_key" not in column_names:
+        return id_sql
+    if f"{end}_station_id" not in column_names:
+        return key_sql
+    return f"COALESCE({id_sql}, {key_sql})"
+
+def _stations_source(db_connection, dataset_path):
+    """
+    Where station keys are looked up: the stations table of db_connection, else the
+    stations.parquet exported next to the dataset. None when there is neither.
+    """
+    if db_connection.execute("SELECT count(*) FROM information_schema.tables WHERE table_name = ?",
+                             [STATIONS_TABLE]).fetchone()[0]:
+        return f'"{STATIONS_TABLE}"'
+    stations_path = os.path.join(os.path.dirname(os.path.normpath(dataset_path)), f"{STATIONS_TABLE}.parquet")
+    if os.path.exists(stations_path):
+        return "read_parquet('" + stations_path.replace("'", "''") + "')"
+    return None
+
+def _file_stats(db_connection, dataset_path, relative_paths, details):
+    """
+    Returns {relative path: entry} with the row count, min/max trip start time, bbox of the
+    start and end points and sorted station ids of each file, read in one grouped scan that
+    only touches those columns. Station keys are resolved to ids through the station
+    dimension; without one, a keyed file's entry lists station_keys instead of station_ids.
+    """
+    paths = [os.path.join(dataset_path, relative_path) for relative_path in relative_paths]
+    file_list = ", ".join("'" + path.replace("'", "''") + "'" for path in paths)
+    source_sql = f"read_parquet([{file_list}], filename = true, union_by_name = true)"
+    column_names = {row[0] for row in db_connection.execute(f"DESCRIBE SELECT * FROM {source_sql}").fetchall()}
+    keyed = {"start_station_key", "end_station_key"} <= column_names
+    stations_source = _stations_source(db_connection, dataset_path) if keyed else None
+    if keyed and stations_source is None:
+        station_field, station_columns = 'station_keys', ('t.start_station_key::VARCHAR', 't.end_station_key::VARCHAR')
+    else:
+        station_field, station_columns = 'station_ids', (station_id_sql("start", column_names), station_id_sql("end", column_names))
+    station_joins = ""
+    if stations_source is not None:
+        station_joins = "".join(f"""
+        LEFT JOIN {stations_source} {end}_station ON {end}_station.station_key = t.{end}_station_key""" for end in ("start", "end"))
+    rows = db_connection.execute(f"""
+        SELECT t.filename,
+               count(*),
+               min(t."{details["time_col"]}"), max(t."{details["time_col"]}"),
+               least(min(t."{details["start_lng_col"]}"), min(t."{details["end_lng_col"]}")),
+               least(min(t."{details["start_lat_col"]}"), min(t."{details["end_lat_col"]}")),
+               greatest(max(t."{details["start_lng_col"]}"), max(t."{details["end_lng_col"]}")),
+               greatest(max(t."{details["start_lat_col"]}"), max(t."{details["end_lat_col"]}")),
+               list_sort(list_distinct(flatten([list(DISTINCT {station_columns[0]}), list(DISTINCT {station_columns[1]})])))
+        FROM {source_sql} t{station_joins}
+        GROUP BY t.filename
+    """).fetchall()
+    relative_by_path = dict(zip(paths, relative_paths))
+    stats = {}
+    for filename, row_count, min_time, max_time, xmin, ymin, xmax, ymax, stations in rows:
+        stats[relative_by_path.get(filename, os.path.relpath(filename, dataset_path).replace(os.sep, "/"))] = {
+            'rows': row_count,
+            'min_time': min_time.isoformat() if min_time else None,
+            'max_time': max_time.isoformat() if max_time else None,
+            'bbox': [xmin, ymin, xmax, ymax] if xmin is not None else None,
+            station_field: stations,
+        }
+    return stats
+
+def write_dataset_index(db_connection, dataset_path, details):
+    """
+    Writes dataset_path/_index.json listing every Parquet file of the dataset with its
+    year/month partition, row count, min/max time, bbox and station ids, so readers can
+    choose files without opening their footers. Entries of files whose size and mtime are
+    unchanged since the last index are reused, so after an incremental export only the
+    re-written partitions are read. details gives the time and coordinate columns (an
+    EXPORT_SCHEMAS entry). Returns the number of files indexed.
+    """
+    index_path = os.path.join(dataset_path, INDEX_FILE_NAME)
+    previous_entries = {}
+    try:
+        with open(index_path, 'r') as f:
+            previous_index = json.load(f)
+        if previous_index.get('version') == INDEX_VERSION:
+            previous_entries = {entry['path']: entry for entry in previous_index.get('files', [])}
+    except (OSError, ValueError):
+        pass
+
+    entries = {}
+    changed_paths = []
+    for path in sorted(glob.glob(os.path.join(dataset_path, "year=*", "month=*", "*.parquet"))):
+        relative_path = os.path.relpath(path, dataset_path).replace(os.sep, "/")
+        stat = os.stat(path)
+        partition = _PARTITION_PATTERN.match(relative_path)
+        entry = {'path': relative_path, 'year': int(partition.group(1)), 'month': int(partition.group(2)),
+                 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+        previous = previous_entries.get(relative_path)
+        if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+            entries[relative_path] = previous
+        else:
+            entries[relative_path] = entry
+            changed_paths.append(relative_path)
+
+    if changed_paths:
+        for relative_path, file_stats in _file_stats(db_connection, dataset_path, changed_paths, details).items():
+            entries[relative_path].update(file_stats)
+        for relative_path in changed_paths:
+            # A file with no rows doesn't show up in the grouped scan
+            entries[relative_path].setdefault('rows', 0)
+
+    index = {
+        'version': INDEX_VERSION,
+        'dataset': os.path.basename(os.path.normpath(dataset_path)),
+        'time_col': details["time_col"],
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'files': [entries[relative_path] for relative_path in sorted(entries)],
+    }
+    temp_path = f"{index_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(temp_path, index_path)
+    print(f"Indexed {len(entries)} files of {dataset_path} ({len(changed_paths)} re-read)")
+    return len(entries)
+
+def read_dataset_index(dataset_path, db_connection=None):
+    """
+    Returns the parsed _index.json of a dataset, or None if it has none. dataset_path can be
+    a local directory or a URL DuckDB can read (s3://, https://), so a remote dataset costs
+    one request for its index instead of one per file footer.
+    """
+    index_path = f"{dataset_path.rstrip('/')}/{INDEX_FILE_NAME}"
+    if "://" not in dataset_path:
+        try:
+            with open(index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    try:
+        db_connection = db_connection or duckdb.connect()
+        return json.loads(db_connection.execute("SELECT content FROM read_text(?)", [index_path]).fetchone()[0])
+    except Exception as e:
+        print(f"Could not read dataset index {index_path}: {str(e)}")
+        return None
+
+def _as_time(value):
+    return value if isinstance(value, datetime.datetime) else datetime.datetime.fromisoformat(str(value))
+
+def select_indexed_files(dataset_path, start_time=None, end_time=None, bbox=None, station_ids=None, db_connection=None):
+    """
+    Returns the files of a dataset that may hold trips starting in [start_time, end_time),
+    with a point inside bbox ([xmin, ymin, xmax, ymax]) and touching one of station_ids,
+    judged from the dataset index; every criterion is optional. Returns None when the
+    dataset has no index, so callers can fall back to a glob. Raises ValueError for a
+    station_ids lookup against files indexed by station key (no station dimension was
+    available when they were indexed).
+    """
+    index = read_dataset_index(dataset_path, db_connection)
+    if index is None:
+        return None
+    start_time = _as_time(start_time) if start_time is not None else None
+    end_time = _as_time(end_time) if end_time is not None else None
+    station_ids = {str(station_id) for station_id in station_ids} if station_ids is not None else None
+    selected_files = []
+    for entry in index['files']:
+        if not entry.get('rows'):
+            continue
+        if start_time is not None and entry['max_time'] and _as_time(entry['max_time']) < start_time:
+            continue
+        if end_time is not None and entry['min_time'] and _as_time(entry['min_time']) >= end_time:
+            continue
+        if bbox is not None and entry.get('bbox'):
+            xmin, ymin, xmax, ymax = entry['bbox']
+            if xmax < bbox[0] or xmin > bbox[2] or ymax < bbox[1] or ymin > bbox[3]:
+                continue
+        if station_ids is not None:
+            if 'station_ids' not in entry:
+                raise ValueError(f"{dataset_path}/{INDEX_FILE_NAME} lists station keys, not ids, for {entry['path']}; "
+                                 f"re-index it with the station dimension available to look up station ids")
+            if not station_ids.intersection(entry['station_ids'] or []):
+                continue
+        selected_files.append(f"{dataset_path.rstrip('/')}/{entry['path']}")
+    return selected_files
+
+def read_parquet_sql(dataset_path, start_time=None, end_time=None, bbox=None, station_ids=None, db_connection=None):
+    """
+    Returns a read_parquet(...) expression over only the files select_indexed_files picks
+    (or the whole dataset glob when there is no index), for use in a FROM clause:
+
+        db.sql(f"SELECT count(*) FROM {read_parquet_sql(path, '2024-01-01', '2024-02-01')}")
+
+    If the index rules out every file, the expression reads no rows but keeps the dataset's
+    columns (from one indexed file's schema). The time/bbox/station filter still has to be
+    repeated in the query's WHERE clause; the index only chooses files.
+    """
+    files = select_indexed_files(dataset_path, start_time, end_time, bbox, station_ids, db_connection)
+    if files is None:
+        files = [f"{dataset_path.rstrip('/')}/**/*.parquet"]
+    empty = not files
+    if empty:
+        index_files = read_dataset_index(dataset_path, db_connection)['files']
+        if not index_files:
+            raise ValueError(f"{dataset_path}/{INDEX_FILE_NAME} lists no files")
+        files = [f"{dataset_path.rstrip('/')}/{index_files[0]['path']}"]
+    file_list = ", ".join("'" + path.replace("'", "''") + "'" for path in files)
+    source_sql = f"read_parquet([{file_list}], hive_partitioning = true, union_by_name = true)"
+    if empty:
+        return f"(SELECT * FROM {source_sql} WHERE false)"
+    return source_sql
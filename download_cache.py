@@ -0,0 +1,237 @@
+import os
+import hashlib
+import collections
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+CHUNK_SIZE = 1024 * 1024
+
+# Serialises metadata rewrites and eviction when several download workers share a cache
+_cache_lock = threading.Lock()
+# Archives fetch_cached_archive has handed out and that haven't been released yet, with the
+# number of holders. Eviction skips them, so a download worker can't delete an archive that
+# is still queued for extraction or being streamed.
+_pinned_archives = collections.Counter()
+
+def _cache_paths(url, cache_dir):
+    """
+    Returns the (archive, partial download, metadata) paths for a URL.
+    Entries are keyed by a hash of the full URL so different hosts can't collide.
+    """
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+    file_name = os.path.basename(urlparse(url).path) or "archive"
+    base_path = os.path.join(cache_dir, f"{key}-{file_name}")
+    return base_path, f"{base_path}.part", f"{base_path}.json"
+
+def _read_metadata(meta_path):
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_metadata(meta_path, metadata):
+    temp_path = f"{meta_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(temp_path, meta_path)
+
+def _touch(meta_path, metadata):
+    metadata['last_access'] = time.time()
+    with _cache_lock:
+        _write_metadata(meta_path, metadata)
+
+def _pin(data_path):
+    with _cache_lock:
+        _pinned_archives[data_path] += 1
+    return data_path
+
+def release_archive(data_path):
+    """
+    Marks an archive returned by fetch_cached_archive as no longer in use, so it can be evicted.
+    """
+    with _cache_lock:
+        _pinned_archives[data_path] -= 1
+        if _pinned_archives[data_path] <= 0:
+            del _pinned_archives[data_path]
+
+def _is_verified(data_path, metadata):
+    """
+    True if the cached archive matches its recorded sha256. The digest is only recomputed
+    when the file's size or mtime differ from the ones recorded when it was last verified.
+    """
+    stat = os.stat(data_path)
+    if stat.st_size != metadata.get('size'):
+        return False
+    if stat.st_mtime_ns == metadata.get('mtime_ns'):
+        return True
+    if sha256_file(data_path) != metadata.get('sha256'):
+        return False
+    metadata['mtime_ns'] = stat.st_mtime_ns
+    return True
+
+def sha256_file(path, hasher=None):
+    """
+    Returns the sha256 hex digest of a file, or feeds it into an existing hasher.
+    """
+    hasher = hasher or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def remote_validators(url, timeout=60):
+    """
+    Issues a HEAD request and returns the validators used to decide whether a cached copy
+    is still current: ETag, Content-Length, Last-Modified and Range support.
+    """
+    response = requests.head(url, allow_redirects=True, timeout=timeout)
+    response.raise_for_status()
+    content_length = response.headers.get('Content-Length')
+    return {
+        'etag': response.headers.get('ETag'),
+        'content_length': int(content_length) if content_length is not None else None,
+        'last_modified': response.headers.get('Last-Modified'),
+        'accept_ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes',
+    }
+
+def _validators_match(metadata, remote):
+    """
+    True if every validator the server sent agrees with the one recorded for the cached copy.
+    """
+    for key in ('etag', 'content_length', 'last_modified'):
+        if remote.get(key) is not None and metadata.get(key) != remote[key]:
+            return False
+    return True
+
+def fetch_cached_archive(url, cache_dir, max_cache_bytes=None, timeout=60):
+    """
+    Returns a local copy of url from the archive cache, downloading it only when the cache
+    has no copy or the server's ETag/Content-Length/Last-Modified no longer match.
+    Cached copies are verified against their recorded sha256 before reuse (re-hashed only
+    if their size or mtime changed). Interrupted downloads are resumed with an HTTP Range
+    request when the server supports it. If the server can't be reached, a complete cached
+    copy is used as-is. Returns (local_path, downloaded_bytes, download_seconds), where
+    downloaded_bytes only counts what came over the network. The archive is pinned (never
+    evicted) from before it is looked up until the caller passes local_path to release_archive.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    data_path = _pin(_cache_paths(url, cache_dir)[0])
+    try:
+        return _fetch_archive(url, cache_dir, max_cache_bytes, timeout)
+    except BaseException:
+        release_archive(data_path)
+        raise
+
+def _fetch_archive(url, cache_dir, max_cache_bytes=None, timeout=60):
+    data_path, part_path, meta_path = _cache_paths(url, cache_dir)
+    metadata = _read_metadata(meta_path)
+    has_complete_copy = metadata.get('complete') and os.path.exists(data_path)
+
+    try:
+        remote = remote_validators(url, timeout)
+    except requests.RequestException as e:
+        if has_complete_copy:
+            print(f"Could not reach {url} ({str(e)}). Using cached copy: {data_path}")
+            _touch(meta_path, metadata)
+            return data_path, 0, 0.0
+        raise
+
+    if has_complete_copy and _validators_match(metadata, remote):
+        if _is_verified(data_path, metadata):
+            print(f"Cache hit for {url}: {data_path}")
+            _touch(meta_path, metadata)
+            return data_path, 0, 0.0
+        print(f"Cached copy of {url} failed checksum validation. Downloading again.")
+
+    start_time = time.time()
+    resume_from = 0
+    if os.path.exists(part_path):
+        can_resume = (remote['accept_ranges']
+                      and (remote['etag'] or remote['last_modified'])
+                      and not metadata.get('complete')
+                      and _validators_match(metadata, remote))
+        if can_resume:
+            resume_from = os.path.getsize(part_path)
+        else:
+            os.remove(part_path)
+
+    # Record the validators before transferring so a crash leaves enough to resume from
+    metadata = {'url': url, 'complete': False, 'last_access': time.time(),
+                'etag': remote['etag'], 'content_length': remote['content_length'],
+                'last_modified': remote['last_modified']}
+    with _cache_lock:
+        _write_metadata(meta_path, metadata)
+
+    headers = {}
+    if resume_from:
+        headers['Range'] = f"bytes={resume_from}-"
+        headers['If-Range'] = remote['etag'] or remote['last_modified']
+
+    hasher = hashlib.sha256()
+    downloaded_bytes = 0
+    with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        if resume_from and response.status_code == 206:
+            print(f"Resuming download of {url} from byte {resume_from}")
+            sha256_file(part_path, hasher)
+            mode = 'ab'
+        else:
+            # The server sent the whole file (no range support or the file changed)
+            resume_from = 0
+            mode = 'wb'
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                f.write(chunk)
+                hasher.update(chunk)
+                downloaded_bytes += len(chunk)
+
+    size = os.path.getsize(part_path)
+    if remote['content_length'] is not None and size != remote['content_length']:
+        raise IOError(f"Incomplete download of {url}: got {size} of {remote['content_length']} bytes. "
+                      f"The partial file is kept for resuming.")
+
+    os.replace(part_path, data_path)
+    metadata.update({'complete': True, 'size': size, 'mtime_ns': os.stat(data_path).st_mtime_ns,
+                     'sha256': hasher.hexdigest(), 'last_access': time.time()})
+    with _cache_lock:
+        _write_metadata(meta_path, metadata)
+
+    if max_cache_bytes is not None:
+        evict_cache(cache_dir, max_cache_bytes)
+
+    return data_path, downloaded_bytes, time.time() - start_time
+
+def evict_cache(cache_dir, max_cache_bytes, keep=()):
+    """
+    Deletes the least recently used complete archives until the cache fits in max_cache_bytes.
+    Paths in keep and archives still pinned by fetch_cached_archive are never evicted.
+    """
+    with _cache_lock:
+        entries = []
+        for name in os.listdir(cache_dir):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(cache_dir, name)
+            data_path = meta_path[:-len('.json')]
+            metadata = _read_metadata(meta_path)
+            if metadata.get('complete') and os.path.exists(data_path):
+                entries.append((metadata.get('last_access', 0), data_path, meta_path, os.path.getsize(data_path)))
+
+        total_bytes = sum(entry[3] for entry in entries)
+        for last_access, data_path, meta_path, size in sorted(entries):
+            if total_bytes <= max_cache_bytes:
+                break
+            if data_path in keep or data_path in _pinned_archives:
+                continue
+            try:
+                os.remove(data_path)
+                os.remove(meta_path)
+                total_bytes -= size
+                print(f"Evicted cached archive: {data_path} ({size / (1024 * 1024):.1f} MB)")
+            except OSError as e:
+                print(f"Error evicting cached archive {data_path}: {str(e)}")
@@ -0,0 +1,64 @@
+# Layout of the exported trip datasets, shared by the ETL that writes them and by readers
+# (query_service) that shouldn't have to import the ETL to find their columns
+
+# Station dimension table, exported as <output dir>/stations.parquet; keyed trip tables
+# reference it by start_station_key/end_station_key
+STATIONS_TABLE = "stations"
+
+# Column roles for each schema family, keyed by the name of its combined export
+EXPORT_SCHEMAS = {
+    "old_schema_combined": {
+        "table_marker": "_old_schema",
+        "start_lng_col": "start_station_longitude", "start_lat_col": "start_station_latitude",
+        "end_lng_col": "end_station_longitude", "end_lat_col": "end_station_latitude",
+        "time_col": "starttime", "end_time_col": "stoptime",
+        "rider_type_sql": """CASE "usertype"::VARCHAR WHEN 'Subscriber' THEN 'member' WHEN 'Customer' THEN 'casual' END""",
+        "canonical_sql": {
+            "started_at": '"starttime"', "ended_at": '"stoptime"',
+            "start_lat": '"start_station_latitude"', "start_lng": '"start_station_longitude"',
+            "end_lat": '"end_station_latitude"', "end_lng": '"end_station_longitude"',
+            "member_casual": """CASE "usertype"::VARCHAR WHEN 'Subscriber' THEN 'member' WHEN 'Customer' THEN 'casual' END"""
+        }
+    },
+    "new_schema_combined": {
+        "table_marker": "_new_schema",
+        "start_lng_col": "start_lng", "start_lat_col": "start_lat",
+        "end_lng_col": "end_lng", "end_lat_col": "end_lat",
+        "time_col": "started_at", "end_time_col": "ended_at",
+        "rider_type_sql": '"member_casual"::VARCHAR',
+        "canonical_sql": {}
+    }
+}
+
+# Cross-era trip schema written by the canonical export. A column is read from the expression
+# in its schema's canonical_sql, else from the column of the same name, and is NULL when the
+# era doesn't have it (bikeid, gender, ride_id, ...). Station ids/names are replaced by the
+# station keys once the station dimension has been built.
+CANONICAL_DATASET = "trips_canonical"
+CANONICAL_TRIP_COLUMNS = [
+    ("ride_id", "VARCHAR"),
+    ("rideable_type", "VARCHAR"),
+    ("started_at", "TIMESTAMP"),
+    ("ended_at", "TIMESTAMP"),
+    ("start_station_id", "VARCHAR"),
+    ("start_station_name", "VARCHAR"),
+    ("end_station_id", "VARCHAR"),
+    ("end_station_name", "VARCHAR"),
+    ("start_station_key", "INTEGER"),
+    ("end_station_key", "INTEGER"),
+    ("start_lat", "DOUBLE"),
+    ("start_lng", "DOUBLE"),
+    ("end_lat", "DOUBLE"),
+    ("end_lng", "DOUBLE"),
+    ("member_casual", "VARCHAR"),
+    ("bikeid", "BIGINT"),
+    ("usertype", "VARCHAR"),
+    ("birth_year", "INTEGER"),
+    ("gender", "BIGINT"),
+]
+CANONICAL_DETAILS = {
+    "start_lng_col": "start_lng", "start_lat_col": "start_lat",
+    "end_lng_col": "end_lng", "end_lat_col": "end_lat",
+    "time_col": "started_at", "end_time_col": "ended_at",
+    "rider_type_sql": '"member_casual"::VARCHAR'
+}
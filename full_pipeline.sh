@@ -13,15 +13,17 @@ DB_FILE="citibike_data.db"
 TEMP_DIR="temp_citibike_data"
 PARQUET_DIR="final_parquet_folder"
 
-# Part 2: GDAL Conversion Script Configuration
-# NOTE: Make sure your GDAL script is named 'convert_to_geoparquet.sh' or change this value.
-GDAL_SCRIPT="convert_parquet.sh"
-
-# Part 3: Source Cooperative Upload Configuration
+# Part 2: Source Cooperative Upload Configuration
 # Set to 'default' as per your existing AWS CLI setup.
 SOURCE_COOP_PROFILE="default"
 # Set to the S3 path you provided.
 SOURCE_COOP_PATH="s3://zluo43/citibike/"
+SOURCE_COOP_ENDPOINT="https://data.source.coop"
+# Number of files/parts uploaded in parallel.
+UPLOAD_WORKERS="8"
+# Content hashes of the uploaded partitions and open multipart uploads. Kept outside
+# $PARQUET_DIR, which the ETL deletes and rewrites on every run.
+UPLOAD_MANIFEST="${PARQUET_DIR}.upload_manifest.json"
 
 
 # --- PIPELINE EXECUTION ---
@@ -33,7 +35,7 @@ echo "--- STARTING FULL DATA PIPELINE ---"
 echo "Start Year: $START_YEAR, End Year: $END_YEAR, End Month: $END_MONTH"
 echo "Final Output will be uploaded to: $SOURCE_COOP_PATH"
 
-# Step 1: Run the Python ETL script to create the initial Parquet files.
+# Step 1: Run the Python ETL script to create the GeoParquet files.
 echo
 echo "--> STEP 1: Running Python ETL script..."
 python3 "$PY_SCRIPT" \
@@ -46,22 +48,17 @@ python3 "$PY_SCRIPT" \
 echo "--> STEP 1: Python ETL complete."
 
 
-# Step 2: Run the GDAL shell script to convert Parquet to GeoParquet.
-echo
-echo "--> STEP 2: Running GDAL script to add CRS and BBox..."
-# First, ensure the GDAL script has execute permissions
-chmod +x "$GDAL_SCRIPT"
-# Now, run it
-./"$GDAL_SCRIPT"
-echo "--> STEP 2: GeoParquet conversion complete."
-
-
-# Step 3: Upload the final GeoParquet data to Source Cooperative.
-# This syncs ONLY the contents of your final output directory.
+# Step 2: Upload the final GeoParquet data to Source Cooperative.
+# Only partitions whose content changed since the last upload are sent (tracked in
+# $UPLOAD_MANIFEST), and interrupted multipart uploads are resumed.
 echo
-echo "--> STEP 3: Uploading final data from '$PARQUET_DIR' to Source Cooperative..."
-aws s3 sync "$PARQUET_DIR" "$SOURCE_COOP_PATH" --endpoint-url https://data.source.coop --profile "$SOURCE_COOP_PROFILE"
-echo "--> STEP 3: Upload complete."
+echo "--> STEP 2: Uploading final data from '$PARQUET_DIR' to Source Cooperative..."
+python3 upload.py "$PARQUET_DIR" "$SOURCE_COOP_PATH" \
+    --endpoint-url "$SOURCE_COOP_ENDPOINT" \
+    --profile "$SOURCE_COOP_PROFILE" \
+    --workers "$UPLOAD_WORKERS" \
+    --manifest "$UPLOAD_MANIFEST"
+echo "--> STEP 2: Upload complete."
 
 
 echo
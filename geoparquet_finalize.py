@@ -0,0 +1,146 @@
+import os
+import glob
+import json
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import duckdb
+
+# Geometry columns of the trip datasets; the first one present is the primary column
+GEOMETRY_COLUMNS = ("start_geom", "end_geom")
+GEOMETRY_TYPE = "GEOMETRY('EPSG:4326')"
+DEFAULT_DATASETS = (
+    "final_parquet_folder/new_schema_combined_with_geom.parquet",
+    "final_parquet_folder/old_schema_combined_with_geom.parquet",
+)
+
+def read_geo_metadata(db_connection, parquet_path):
+    """
+    Returns the parsed 'geo' key of a Parquet footer, or None if it is missing or not JSON.
+    """
+    rows = db_connection.execute(
+        "SELECT decode(value) FROM parquet_kv_metadata(?) WHERE decode(key) = 'geo'", [parquet_path]).fetchall()
+    if not rows:
+        return None
+    try:
+        return json.loads(rows[0][0])
+    except ValueError:
+        return None
+
+def has_valid_geo_metadata(geo_metadata, column_names):
+    """
+    True if geo_metadata is GeoParquet metadata whose primary column exists and whose
+    geometry columns all declare WKB encoding and a CRS, i.e. the file needs no rewrite.
+    """
+    if not isinstance(geo_metadata, dict) or not geo_metadata.get('version'):
+        return False
+    geometry_columns = geo_metadata.get('columns') or {}
+    if geo_metadata.get('primary_column') not in geometry_columns:
+        return False
+    for column_name, column in geometry_columns.items():
+        if column_name not in column_names or column.get('encoding') != 'WKB' or not column.get('crs'):
+            return False
+    return True
+
+def finalize_file(parquet_path, force=False):
+    """
+    Rewrites one Parquet file as GeoParquet with EPSG:4326 geometry columns (start_geom as
+    the primary column) unless its footer already carries valid geo metadata. The new file
+    is written next to the original and moved over it, so an interrupted run never leaves a
+    half-written file. Returns (parquet_path, status, seconds), status being 'skipped' or
+    'finalized'.
+    """
+    start_time = time.time()
+    db_connection = duckdb.connect()
+    temp_path = os.path.join(os.path.dirname(parquet_path), f".{os.path.basename(parquet_path)}.finalize.tmp")
+    try:
+        db_connection.install_extension("spatial")
+        db_connection.load_extension("spatial")
+        column_types = {name: column_type for name, column_type, *_ in
+                        db_connection.execute("DESCRIBE SELECT * FROM read_parquet(?)", [parquet_path]).fetchall()}
+        if not force and has_valid_geo_metadata(read_geo_metadata(db_connection, parquet_path), column_types):
+            return parquet_path, 'skipped', time.time() - start_time
+
+        geometry_columns = [name for name in GEOMETRY_COLUMNS if name in column_types]
+        if not geometry_columns:
+            raise ValueError(f"no geometry column ({', '.join(GEOMETRY_COLUMNS)}) in {parquet_path}")
+        geometry_sql = []
+        for name in geometry_columns:
+            # Files written without the spatial extension hold plain WKB blobs; geometries read
+            # with another (or the default OGC:CRS84) CRS go through WKB, as DuckDB won't cast between CRSs
+            wkb_sql = f'"{name}"' if column_types[name] == 'BLOB' else f'ST_AsWKB("{name}")'
+            geometry_sql.append(f'ST_GeomFromWKB({wkb_sql})::{GEOMETRY_TYPE} AS "{name}"')
+        excluded_columns = ", ".join(f'"{name}"' for name in geometry_columns)
+        db_connection.execute(f"""
+            COPY (
+                SELECT * EXCLUDE ({excluded_columns}), {", ".join(geometry_sql)}
+                FROM read_parquet('{parquet_path}')
+            ) TO '{temp_path}' (FORMAT PARQUET, COMPRESSION ZSTD)
+        """)
+        os.replace(temp_path, parquet_path)
+        return parquet_path, 'finalized', time.time() - start_time
+    finally:
+        db_connection.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def list_parquet_files(dataset_paths):
+    """
+    Returns every .parquet file under the given dataset directories (or files), sorted.
+    """
+    parquet_files = []
+    for dataset_path in dataset_paths:
+        if os.path.isfile(dataset_path):
+            parquet_files.append(dataset_path)
+        elif os.path.isdir(dataset_path):
+            parquet_files.extend(path for path in glob.glob(os.path.join(dataset_path, "**", "*.parquet"), recursive=True)
+                                 if os.path.isfile(path))
+        else:
+            print(f"--> Not found, skipping: {dataset_path}")
+    return sorted(parquet_files)
+
+def finalize_datasets(dataset_paths, workers=None, force=False):
+    """
+    Finalizes every Parquet file of the given datasets with a process pool of workers
+    (one DuckDB per file). Files that already have valid geo metadata are skipped, so
+    reruns only touch what failed or is new. Returns (finalized, skipped, failed) counts.
+    """
+    parquet_files = list_parquet_files(dataset_paths)
+    print(f"Found {len(parquet_files)} Parquet files to check")
+    finalized_count = skipped_count = failed_count = 0
+    run_start_time = time.time()
+    # spawn rather than fork: DuckDB isn't fork-safe once a connection has been used
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {executor.submit(finalize_file, parquet_path, force): parquet_path for parquet_path in parquet_files}
+        for future in as_completed(futures):
+            parquet_path = futures[future]
+            try:
+                _, status, seconds = future.result()
+                if status == 'skipped':
+                    skipped_count += 1
+                else:
+                    finalized_count += 1
+                    print(f"Finalized {parquet_path} in {seconds:.2f} seconds")
+            except Exception as e:
+                failed_count += 1
+                print(f"ERROR: could not finalize {parquet_path}: {str(e)}")
+    print(f"Finalized {finalized_count}, skipped {skipped_count} (already GeoParquet), failed {failed_count} "
+          f"in {time.time() - run_start_time:.2f} seconds")
+    return finalized_count, skipped_count, failed_count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Add GeoParquet metadata (EPSG:4326, start_geom primary) to exported Parquet files')
+    parser.add_argument('datasets', nargs='*', default=list(DEFAULT_DATASETS), help='Dataset directories or Parquet files')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of files rewritten in parallel')
+    parser.add_argument('--force', action='store_true', help='Rewrite files even if they already have valid geo metadata')
+    args = parser.parse_args()
+
+    DATASETS = args.datasets
+    WORKERS = args.workers
+    FORCE = args.force
+
+    _, _, failed = finalize_datasets(DATASETS, WORKERS, FORCE)
+    if failed:
+        raise SystemExit(1)
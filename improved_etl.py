@@ -1,17 +1,91 @@
 import os
-import pandas as pd
 import wget
 import zipfile
 from datetime import datetime, timedelta
 import re
 import requests
 import duckdb
+from data_quality import (clear_quality_records, export_quality_report, flagged_select_sql, is_quality_table,
+                          load_flagged_rows, register_staged_quality, stage_quality_records)
+from dataset_index import write_dataset_index
+from download_cache import fetch_cached_archive, release_archive, remote_validators, sha256_file
+from export_schemas import CANONICAL_DATASET, CANONICAL_DETAILS, CANONICAL_TRIP_COLUMNS, EXPORT_SCHEMAS, STATIONS_TABLE
+from schema_registry import STORAGE_PROFILES, detect_plan_timestamp_format, plan_for_header, plan_select_sql, sniff_csv
 import shutil
 import time
 import argparse
+import glob
+import itertools
+import json
+import metrics
+import multiprocessing
+import queue
 import ssl
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
 ssl._create_default_https_context = ssl._create_unverified_context
 
+# Marks the end of a stage's output in pipelined_csv_generator
+_PIPELINE_DONE = object()
+# View name an Arrow CSV stream is registered under while it is loaded
+_STREAM_VIEW_NAME = "csv_stream_source"
+# Table inside the DuckDB file that records what has been ingested
+MANIFEST_TABLE = "ingest_manifest"
+# (station id, name, month) -> station_key bridge of the station dimension (see STATIONS_TABLE)
+STATION_MONTHS_TABLE = "station_months"
+# Extent of the Citi Bike service area (lng/lat), used to scale Hilbert curve sort keys
+HILBERT_BOUNDS = "{'min_x': -74.3, 'min_y': 40.45, 'max_x': -73.65, 'max_y': 40.95}::BOX_2D"
+SPATIAL_SORT_OPTIONS = ('none', 'hilbert', 'h3')
+# Parquet layouts for the trip export. sort_keys are column roles ('time', 'station') that
+# order rows after year/month, so row-group min/max statistics prune time windows and station
+# lookups; copy_options are appended to the COPY. DuckDB writes a bloom filter for every
+# dictionary-encoded column, so the dictionary limit keeps station ids (a few thousand
+# distinct values) dictionary-encoded, and filtered, in every row group.
+EXPORT_PROFILES = {
+    "default": {"sort_keys": (), "copy_options": {}},
+    "remote": {
+        "sort_keys": ("time",),
+        "copy_options": {"ROW_GROUP_SIZE": 262144, "DICTIONARY_SIZE_LIMIT": 65536,
+                         "BLOOM_FILTER_FALSE_POSITIVE_RATIO": 0.01},
+    },
+    "remote-station": {
+        "sort_keys": ("station", "time"),
+        "copy_options": {"ROW_GROUP_SIZE": 262144, "DICTIONARY_SIZE_LIMIT": 65536,
+                         "BLOOM_FILTER_FALSE_POSITIVE_RATIO": 0.01},
+    },
+}
+# Geometry type written to Parquet; its CRS makes DuckDB emit GeoParquet metadata natively
+GEOMETRY_TYPE = "GEOMETRY('EPSG:4326')"
+# PROJJSON for EPSG:4326, used when the geo metadata is written by hand (bbox covering)
+EPSG_4326_PROJJSON = {
+    "$schema": "https://proj.org/schemas/v0.5/projjson.schema.json",
+    "type": "GeographicCRS",
+    "name": "WGS 84",
+    "datum": {
+        "type": "GeodeticReferenceFrame",
+        "name": "World Geodetic System 1984",
+        "ellipsoid": {"name": "WGS 84", "semi_major_axis": 6378137, "inverse_flattening": 298.257223563}
+    },
+    "coordinate_system": {
+        "subtype": "ellipsoidal",
+        "axis": [
+            {"name": "Geodetic latitude", "abbreviation": "Lat", "direction": "north", "unit": "degree"},
+            {"name": "Geodetic longitude", "abbreviation": "Lon", "direction": "east", "unit": "degree"}
+        ]
+    },
+    "id": {"authority": "EPSG", "code": 4326}
+}
+# Decimal places of the coordinate buckets that separate station versions (3 is ~110 m)
+STATION_COORD_PRECISION = 3
+
+# Pre-aggregated trip counts exported next to the trips. Each rollup groups a month's trips
+# by the start time truncated to time_grain, its dimensions and the rider type (member/casual)
+ROLLUPS = {
+    "rollup_station_hour": {"time_grain": "hour", "dimensions": {"start_station": "VARCHAR"}},
+    "rollup_station_pair_day": {"time_grain": "day", "dimensions": {"start_station": "VARCHAR", "end_station": "VARCHAR"}},
+    "rollup_h3_hour": {"time_grain": "hour", "dimensions": {"start_h3": "UBIGINT"}, "needs_h3": True},
+}
+
 def generate_file_names(start_year_param, end_year_param, end_month_for_final_year_param):
     """
     Generates a list of Citi Bike data file URLs based on specified year and month ranges
@@ -52,84 +126,306 @@ def generate_file_names(start_year_param, end_year_param, end_month_for_final_ye
     
     return local_file_list
 
-def download_and_extract_files_generator(url_list, destination_folder):
+def download_archive(url, destination_folder, show_progress=True, cache_dir=None, max_cache_bytes=None):
+    """
+    Downloads a single archive into destination_folder.
+    Returns the local path, the downloaded size in bytes and the download time in seconds.
+    With cache_dir set the archive comes from the persistent download cache instead, and
+    only missing or changed archives are fetched (see download_cache.fetch_cached_archive).
+    """
+    with metrics.span('download', url) as download_span:
+        if cache_dir:
+            downloaded_zip_path, downloaded_bytes, elapsed = fetch_cached_archive(url, cache_dir, max_cache_bytes)
+            download_span['cache_hit'] = downloaded_bytes == 0
+        else:
+            start_time = time.time()
+            downloaded_zip_path = wget.download(url, out=destination_folder, bar=wget.bar_adaptive if show_progress else None)
+            elapsed = time.time() - start_time
+            downloaded_bytes = os.path.getsize(downloaded_zip_path)
+        download_span['bytes'] = downloaded_bytes
+        return downloaded_zip_path, downloaded_bytes, elapsed
+
+def _print_download_stats(downloaded_zip_path, downloaded_bytes, download_seconds):
+    if not downloaded_bytes:
+        # Served from the download cache, which reports the hit itself
+        return
+    size_mb = downloaded_bytes / (1024 * 1024)
+    rate = size_mb / download_seconds if download_seconds > 0 else float('inf')
+    print(f"\nFile downloaded: {downloaded_zip_path} ({size_mb:.1f} MB) in {download_seconds:.2f} seconds ({rate:.2f} MB/s)")
+
+def remove_downloaded_archive(downloaded_zip_path, cache_dir=None):
+    """
+    Deletes a downloaded zip once it has been processed. An archive from the download cache
+    is kept and only released, so the cache may evict it again.
+    """
+    if cache_dir:
+        if downloaded_zip_path:
+            release_archive(downloaded_zip_path)
+        return
+    if not downloaded_zip_path or not os.path.exists(downloaded_zip_path):
+        return
+    try:
+        os.remove(downloaded_zip_path)
+        print(f"Deleted zip file: {downloaded_zip_path}")
+    except Exception as e:
+        print(f"Error deleting zip file {downloaded_zip_path}: {str(e)}")
+
+def iter_extract_csvs_from_zip(zip_path, destination_folder):
+    """
+    Extracts CSVs from a zip archive (including single-level nested zips) one member at a
+    time, yielding each CSV path as soon as it is on disk. Each archive gets its own
+    subdirectory of destination_folder, named after it without extensions, so archives extracted concurrently
+    can't overwrite each other's members.
+    """
+    destination_folder = os.path.join(destination_folder, os.path.basename(zip_path).split('.')[0])
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for member in zip_ref.namelist():
+            if member.startswith('__MACOSX/') or member.endswith('.DS_Store') or member.endswith('/'):
+                continue
+
+            # Extract file from zip
+            with metrics.span('extract', member, archive=os.path.basename(zip_path)) as extract_span:
+                zip_ref.extract(member, destination_folder)
+                extracted_path = os.path.join(destination_folder, member)
+                extract_span['bytes'] = os.path.getsize(extracted_path)
+
+            # Check if extracted file is a nested zip
+            if extracted_path.lower().endswith('.zip'):
+                print(f"Found nested zip: {extracted_path}")
+                try:
+                    with zipfile.ZipFile(extracted_path, 'r') as nested_zip:
+                        for nested_member in nested_zip.namelist():
+                            if nested_member.startswith('__MACOSX/') or nested_member.endswith('.DS_Store') or nested_member.endswith('/'):
+                                continue
+
+                            with metrics.span('extract', nested_member, archive=member) as extract_span:
+                                nested_zip.extract(nested_member, destination_folder)
+                                nested_extracted_path = os.path.join(destination_folder, nested_member)
+                                extract_span['bytes'] = os.path.getsize(nested_extracted_path)
+
+                            if nested_extracted_path.lower().endswith('.csv'):
+                                print(f"Extracted nested CSV: {nested_extracted_path}")
+                                yield nested_extracted_path
+
+                    # Delete the nested zip after extracting its contents
+                    os.remove(extracted_path)
+                    print(f"Deleted nested zip: {extracted_path}")
+                except zipfile.BadZipFile:
+                    print(f"Error: Nested file {extracted_path} is not a valid zip")
+                except Exception as e_nested:
+                    print(f"Error with nested zip {extracted_path}: {str(e_nested)}")
+
+            # Check if extracted file is a CSV
+            elif extracted_path.lower().endswith('.csv'):
+                print(f"Extracted CSV: {extracted_path}")
+                yield extracted_path
+
+def extract_csvs_from_zip(zip_path, destination_folder):
+    """
+    Extracts every CSV from a zip archive (including single-level nested zips) into the
+    archive's subdirectory of destination_folder and returns the list of extracted CSV paths.
+    """
+    return list(iter_extract_csvs_from_zip(zip_path, destination_folder))
+
+def _download_and_extract(url, destination_folder, show_progress, cache_dir=None, max_cache_bytes=None):
+    """
+    Worker for download_and_extract_files_generator: downloads one URL, extracts its CSVs
+    and removes the zip. Returns (csv_paths, downloaded_bytes, download_start, download_end).
+    """
+    downloaded_zip_path = None
+    try:
+        print(f"Downloading: {url}")
+        download_start = time.time()
+        downloaded_zip_path, downloaded_bytes, download_seconds = download_archive(
+            url, destination_folder, show_progress, cache_dir, max_cache_bytes)
+        _print_download_stats(downloaded_zip_path, downloaded_bytes, download_seconds)
+
+        extract_time = time.time()
+        csv_files = extract_csvs_from_zip(downloaded_zip_path, destination_folder)
+        print(f"Extraction completed in {time.time() - extract_time:.2f} seconds")
+        return csv_files, downloaded_bytes, download_start, download_start + download_seconds
+    except Exception as e:
+        print(f"Error processing URL: {url}")
+        print(f"Error message: {str(e)}")
+        return [], 0, None, None
+    finally:
+        # Clean up the downloaded zip file
+        remove_downloaded_archive(downloaded_zip_path, cache_dir)
+        print("-" * 50)  # Separator line
+
+def download_and_extract_files_generator(url_list, destination_folder, max_workers=1, cache_dir=None, max_cache_bytes=None):
     """
     Generator function to download, extract files (including nested zips), and yield CSV paths.
     Handles single-level nesting of zip files.
+    Up to max_workers archives are fetched concurrently by a thread pool; CSV paths are
+    yielded in completion order, so with max_workers > 1 they may not follow url_list order.
     """
     if not os.path.exists(destination_folder):
         os.makedirs(destination_folder)
         print(f"Created destination folder: {destination_folder}")
 
-    for url in url_list:
-        downloaded_zip_path = None
+    max_workers = max(1, max_workers)
+    # wget's progress bars interleave badly when several downloads run at once
+    show_progress = max_workers == 1
+    url_iter = iter(url_list)
+    total_bytes = 0
+    total_download_seconds = 0.0
+    archive_count = 0
+    first_download_start = None
+    last_download_end = None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Keep at most max_workers archives in flight so extracted CSVs can't pile up on disk
+        pending = {executor.submit(_download_and_extract, url, destination_folder, show_progress, cache_dir, max_cache_bytes)
+                   for url in itertools.islice(url_iter, max_workers)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                csv_files, downloaded_bytes, download_start, download_end = future.result()
+                if download_start is not None:
+                    archive_count += 1
+                    total_bytes += downloaded_bytes
+                    total_download_seconds += download_end - download_start
+                    first_download_start = min(first_download_start or download_start, download_start)
+                    last_download_end = max(last_download_end or download_end, download_end)
+
+                # Refill the pool before handing CSVs to the caller so downloads overlap with loading
+                next_url = next(url_iter, None)
+                if next_url is not None:
+                    pending.add(executor.submit(_download_and_extract, next_url, destination_folder, show_progress, cache_dir, max_cache_bytes))
+
+                # Yield each CSV file found
+                for csv_file in csv_files:
+                    yield csv_file
+
+    if archive_count:
+        total_mb = total_bytes / (1024 * 1024)
+        # Aggregate rate spans the first download start to the last download end, so it
+        # reflects how well the pool overlaps transfers rather than time spent loading CSVs
+        window_seconds = last_download_end - first_download_start
+        print(f"Downloaded {archive_count} archives ({total_mb:.1f} MB) with {max_workers} worker(s): "
+              f"{total_mb / total_download_seconds if total_download_seconds > 0 else 0:.2f} MB/s per file on average, "
+              f"{total_mb / window_seconds if window_seconds > 0 else 0:.2f} MB/s aggregate over {window_seconds:.2f} seconds")
+
+    # Clean up __MACOSX folder if it exists
+    macosx_folder = os.path.join(destination_folder, '__MACOSX')
+    if os.path.exists(macosx_folder) and os.path.isdir(macosx_folder):
         try:
-            start_time = time.time()
-            print(f"Downloading: {url}")
-            downloaded_zip_path = wget.download(url, out=destination_folder)
-            print(f"\nFile downloaded: {downloaded_zip_path} in {time.time() - start_time:.2f} seconds")
-            
-            extract_time = time.time()
-            # Track all CSV files from this zip (including those from nested zips)
-            csv_files_from_current_zip = []
-            
-            with zipfile.ZipFile(downloaded_zip_path, 'r') as zip_ref:
-                for member in zip_ref.namelist():
-                    if member.startswith('__MACOSX/') or member.endswith('.DS_Store') or member.endswith('/'):
-                        continue
-                    
-                    # Extract file from zip
-                    zip_ref.extract(member, destination_folder)
-                    extracted_path = os.path.join(destination_folder, member)
-                    
-                    # Check if extracted file is a nested zip
-                    if extracted_path.lower().endswith('.zip'):
-                        print(f"Found nested zip: {extracted_path}")
-                        try:
-                            with zipfile.ZipFile(extracted_path, 'r') as nested_zip:
-                                for nested_member in nested_zip.namelist():
-                                    if nested_member.startswith('__MACOSX/') or nested_member.endswith('.DS_Store') or nested_member.endswith('/'):
-                                        continue
-                                    
-                                    nested_zip.extract(nested_member, destination_folder)
-                                    nested_extracted_path = os.path.join(destination_folder, nested_member)
-                                    
-                                    if nested_extracted_path.lower().endswith('.csv'):
-                                        csv_files_from_current_zip.append(nested_extracted_path)
-                                        print(f"Extracted nested CSV: {nested_extracted_path}")
-                            
-                            # Delete the nested zip after extracting its contents
-                            os.remove(extracted_path)
-                            print(f"Deleted nested zip: {extracted_path}")
-                        except zipfile.BadZipFile:
-                            print(f"Error: Nested file {extracted_path} is not a valid zip")
-                        except Exception as e_nested:
-                            print(f"Error with nested zip {extracted_path}: {str(e_nested)}")
-                    
-                    # Check if extracted file is a CSV
-                    elif extracted_path.lower().endswith('.csv'):
-                        csv_files_from_current_zip.append(extracted_path)
-                        print(f"Extracted CSV: {extracted_path}")
-            
-            print(f"Extraction completed in {time.time() - extract_time:.2f} seconds")
-            
-            # Yield each CSV file found
-            for csv_file in csv_files_from_current_zip:
-                yield csv_file
-                
+            shutil.rmtree(macosx_folder)
+            print(f"Removed __MACOSX folder: {macosx_folder}")
         except Exception as e:
-            print(f"Error processing URL: {url}")
-            print(f"Error message: {str(e)}")
-        finally:
-            # Clean up the downloaded zip file
-            if downloaded_zip_path and os.path.exists(downloaded_zip_path):
-                try:
-                    os.remove(downloaded_zip_path)
-                    print(f"Deleted zip file: {downloaded_zip_path}")
-                except Exception as e:
-                    print(f"Error deleting zip file {downloaded_zip_path}: {str(e)}")
-            print("-" * 50)  # Separator line
-    
+            print(f"Error removing __MACOSX folder: {str(e)}")
+
+def _put_until_stopped(stage_queue, item, stop_event):
+    """
+    Puts item on a bounded stage queue, blocking while it is full.
+    Returns False if the pipeline was stopped before the item could be queued.
+    """
+    while not stop_event.is_set():
+        try:
+            stage_queue.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def pipelined_csv_generator(url_list, destination_folder, download_workers=1, queue_size=2, cache_dir=None, max_cache_bytes=None):
+    """
+    Generator that overlaps downloading, extracting and loading.
+    Download threads feed a bounded queue of zip paths, an extraction thread feeds a bounded
+    queue of CSV paths, and the caller loads each yielded CSV. A full queue blocks the stage
+    upstream of it, so at most queue_size archives and queue_size extracted CSVs (plus the
+    ones being worked on) sit in destination_folder at any time. The caller is expected to
+    delete each CSV once it has been loaded.
+    """
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+        print(f"Created destination folder: {destination_folder}")
+
+    download_workers = max(1, download_workers)
+    url_queue = queue.Queue()
+    for url in url_list:
+        url_queue.put(url)
+    zip_queue = queue.Queue(maxsize=max(1, queue_size))
+    csv_queue = queue.Queue(maxsize=max(1, queue_size))
+    stop_event = threading.Event()
+    stage_seconds = {'download': 0.0, 'extract': 0.0, 'load': 0.0}
+    stage_lock = threading.Lock()
+
+    def download_stage():
+        while not stop_event.is_set():
+            try:
+                url = url_queue.get_nowait()
+            except queue.Empty:
+                break
+            downloaded_zip_path = None
+            try:
+                print(f"Downloading: {url}")
+                downloaded_zip_path, downloaded_bytes, download_seconds = download_archive(
+                    url, destination_folder, download_workers == 1, cache_dir, max_cache_bytes)
+                with stage_lock:
+                    stage_seconds['download'] += download_seconds
+                _print_download_stats(downloaded_zip_path, downloaded_bytes, download_seconds)
+            except Exception as e:
+                print(f"Error processing URL: {url}")
+                print(f"Error message: {str(e)}")
+                continue
+            if not _put_until_stopped(zip_queue, downloaded_zip_path, stop_event):
+                remove_downloaded_archive(downloaded_zip_path, cache_dir)
+        _put_until_stopped(zip_queue, _PIPELINE_DONE, stop_event)
+
+    def extract_stage():
+        finished_downloaders = 0
+        while finished_downloaders < download_workers and not stop_event.is_set():
+            try:
+                downloaded_zip_path = zip_queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if downloaded_zip_path is _PIPELINE_DONE:
+                finished_downloaders += 1
+                continue
+            try:
+                extract_time = time.time()
+                csv_iter = iter_extract_csvs_from_zip(downloaded_zip_path, destination_folder)
+                while True:
+                    member_start = time.time()
+                    csv_file = next(csv_iter, None)
+                    with stage_lock:
+                        stage_seconds['extract'] += time.time() - member_start
+                    if csv_file is None or not _put_until_stopped(csv_queue, csv_file, stop_event):
+                        break
+                print(f"Extraction of {downloaded_zip_path} completed in {time.time() - extract_time:.2f} seconds")
+            except Exception as e:
+                print(f"Error extracting {downloaded_zip_path}: {str(e)}")
+            finally:
+                remove_downloaded_archive(downloaded_zip_path, cache_dir)
+        _put_until_stopped(csv_queue, _PIPELINE_DONE, stop_event)
+
+    threads = [threading.Thread(target=download_stage, name=f"download-{i}", daemon=True)
+               for i in range(download_workers)]
+    threads.append(threading.Thread(target=extract_stage, name="extract", daemon=True))
+    for thread in threads:
+        thread.start()
+
+    run_start_time = time.time()
+    try:
+        while True:
+            csv_file = csv_queue.get()
+            if csv_file is _PIPELINE_DONE:
+                break
+            # Time spent outside the generator is the caller's load stage
+            load_start = time.time()
+            yield csv_file
+            stage_seconds['load'] += time.time() - load_start
+    finally:
+        stop_event.set()
+        for thread in threads:
+            thread.join()
+
+    print(f"Pipeline finished in {time.time() - run_start_time:.2f} seconds "
+          f"(busy time - download: {stage_seconds['download']:.2f}s across {download_workers} worker(s), "
+          f"extract: {stage_seconds['extract']:.2f}s, load: {stage_seconds['load']:.2f}s)")
+
     # Clean up __MACOSX folder if it exists
     macosx_folder = os.path.join(destination_folder, '__MACOSX')
     if os.path.exists(macosx_folder) and os.path.isdir(macosx_folder):
@@ -139,221 +435,934 @@ def download_and_extract_files_generator(url_list, destination_folder):
         except Exception as e:
             print(f"Error removing __MACOSX folder: {str(e)}")
 
-def process_csv_to_duckdb(csv_file_path, db_connection):
+def iter_zip_csv_streams(zip_path):
+    """
+    Generator over the CSV members of a zip archive (including single-level nested zips)
+    that yields (member_name, binary_stream) without writing anything to disk.
+    Each stream is only valid until the generator is advanced.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for member in zip_ref.namelist():
+            if member.startswith('__MACOSX/') or member.endswith('.DS_Store') or member.endswith('/'):
+                continue
+
+            if member.lower().endswith('.zip'):
+                print(f"Found nested zip: {member}")
+                try:
+                    # ZipExtFile is seekable, so the nested archive is read in place
+                    with zip_ref.open(member) as nested_file, zipfile.ZipFile(nested_file, 'r') as nested_zip:
+                        for nested_member in nested_zip.namelist():
+                            if nested_member.startswith('__MACOSX/') or nested_member.endswith('.DS_Store') or nested_member.endswith('/'):
+                                continue
+                            if nested_member.lower().endswith('.csv'):
+                                print(f"Streaming nested CSV: {nested_member}")
+                                with nested_zip.open(nested_member) as csv_stream:
+                                    yield nested_member, csv_stream
+                except zipfile.BadZipFile:
+                    print(f"Error: Nested file {member} is not a valid zip")
+
+            elif member.lower().endswith('.csv'):
+                print(f"Streaming CSV: {member}")
+                with zip_ref.open(member) as csv_stream:
+                    yield member, csv_stream
+
+def download_and_stream_csvs_generator(url_list, destination_folder, max_workers=1, cache_dir=None, max_cache_bytes=None):
+    """
+    Generator that downloads archives (up to max_workers at a time) and yields
+    (member_name, binary_stream) for every CSV inside them, nested zips included.
+    Nothing is extracted, so peak disk use is the compressed archives in flight.
+    Each stream must be consumed before the generator is advanced.
+    """
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+        print(f"Created destination folder: {destination_folder}")
+
+    max_workers = max(1, max_workers)
+    show_progress = max_workers == 1
+    url_iter = iter(url_list)
+
+    def submit(executor, url):
+        print(f"Downloading: {url}")
+        future = executor.submit(download_archive, url, destination_folder, show_progress, cache_dir, max_cache_bytes)
+        future_urls[future] = url
+        return future
+
+    future_urls = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {submit(executor, url) for url in itertools.islice(url_iter, max_workers)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = future_urls.pop(future)
+                next_url = next(url_iter, None)
+                if next_url is not None:
+                    pending.add(submit(executor, next_url))
+
+                downloaded_zip_path = None
+                try:
+                    downloaded_zip_path, downloaded_bytes, download_seconds = future.result()
+                    _print_download_stats(downloaded_zip_path, downloaded_bytes, download_seconds)
+                    yield from iter_zip_csv_streams(downloaded_zip_path)
+                except Exception as e:
+                    print(f"Error processing URL: {url}")
+                    print(f"Error message: {str(e)}")
+                finally:
+                    remove_downloaded_archive(downloaded_zip_path, cache_dir)
+                    print("-" * 50)  # Separator line
+
+def open_arrow_csv_stream(csv_stream, columns):
+    """
+    Returns a pyarrow RecordBatchReader over the data rows of a binary CSV stream whose
+    header (columns) has already been read, with every column typed as string and empty
+    fields as NULL, mirroring read_csv(all_varchar=true, ignore_errors=true).
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    arrow_reader = pa_csv.open_csv(
+        csv_stream,
+        read_options=pa_csv.ReadOptions(column_names=list(columns)),
+        parse_options=pa_csv.ParseOptions(invalid_row_handler=lambda row: 'skip'),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={name: pa.string() for name in columns},
+            strings_can_be_null=True,
+            null_values=[''],
+        ),
+    )
+    return arrow_reader
+
+def table_suffix_for_file(filename):
+    """
+    Returns the monthly table suffix (YYYY_MM) for a CSV file name, or an unknown_date_ suffix
+    built from the file name when it carries no YYYYMM date.
+    """
+    # Extract year and month from filename using regex - simple pattern matching YYYYMM
+    date_match = re.search(r'(20\d{2})(\d{2})', os.path.basename(filename))
+
+    if date_match:
+        year_str, month_str = date_match.groups()
+        return f"{year_str}_{month_str}"
+    # Generic fallback if no date match found
+    generic_name = re.sub(r'[^a-zA-Z0-9_]', '_', os.path.splitext(os.path.basename(filename))[0])
+    return f"unknown_date_{generic_name}"
+
+def process_csv_to_duckdb(csv_file_path, db_connection, csv_stream=None, storage_profile="standard"):
     """
     Processes a single CSV file, standardizes its schema, and loads it into DuckDB.
     Handles multiple files for the same month by checking if a table already exists.
     Uses the original schema handling logic from bike_etl.py.
+    If csv_stream is given (a binary file object, e.g. an open zip member), rows are read
+    from it through an Arrow CSV reader and csv_file_path is only used for naming.
+    storage_profile selects the column types (see schema_registry.STORAGE_PROFILES).
+    Returns (table_name, loaded_rows, quarantined_rows), or None if the file was skipped.
     """
     filename = os.path.basename(csv_file_path)
     process_start_time = time.time()
     print(f"Processing CSV: {filename}")
 
-    # Extract year and month from filename using regex - simple pattern matching YYYYMM
-    date_match = re.search(r'(20\d{2})(\d{2})', filename)
-    
-    if date_match:
-        year_str, month_str = date_match.groups()
-        table_name_suffix = f"{year_str}_{month_str}"
-    else:
-        # Generic fallback if no date match found
-        generic_name = re.sub(r'[^a-zA-Z0-9_]', '_', os.path.splitext(filename)[0])
-        table_name_suffix = f"unknown_date_{generic_name}"
+    table_name_suffix = table_suffix_for_file(filename)
+    if table_name_suffix.startswith("unknown_date_"):
         print(f"Could not extract year/month from filename: {filename}. Using suffix: {table_name_suffix}")
 
-    try:
-        # Sample query to determine schema
-        sample_query = f"SELECT * FROM read_csv_auto('{csv_file_path}', header=true, sample_size=100, ignore_errors=true) LIMIT 1"
-        sample_df = db_connection.execute(sample_query).fetchdf()
-    except Exception as e:
-        print(f"Error reading sample from {filename}: {str(e)}. Skipping file.")
-        return
+    if csv_stream is not None:
+        try:
+            columns, sample_rows, data_stream = sniff_csv(csv_stream)
+            arrow_reader = open_arrow_csv_stream(data_stream, columns)
+        except Exception as e:
+            print(f"Error reading header from {filename}: {str(e)}. Skipping file.")
+            return
+        # Every column arrives as VARCHAR; the casts below do the typing
+        db_connection.register(_STREAM_VIEW_NAME, arrow_reader)
+        new_schema_source = f'"{_STREAM_VIEW_NAME}"'
+        old_schema_source = f'"{_STREAM_VIEW_NAME}"'
+    else:
+        try:
+            # Only the header and a small sample are read here; the load below is the single full read
+            with open(csv_file_path, 'rb') as f:
+                columns, sample_rows, _ = sniff_csv(f)
+        except Exception as e:
+            print(f"Error reading header from {filename}: {str(e)}. Skipping file.")
+            return
+        new_schema_source = f"read_csv('{csv_file_path}', header=true, types={{'start_station_id': 'VARCHAR', 'end_station_id': 'VARCHAR'}})"
+        old_schema_source = f"""read_csv('{csv_file_path}',
+                    header=true,
+                    all_varchar=true,
+                    ignore_errors=true)"""
 
-    if sample_df.empty:
-        print(f"Sample from {filename} is empty or could not be read. Skipping file.")
+    with metrics.span('csv_load', filename) as load_span:
+        if csv_stream is None:
+            load_span['bytes'] = os.path.getsize(csv_file_path)
+        try:
+            load_result = _load_standardized_csv(filename, table_name_suffix, columns, sample_rows,
+                                                 new_schema_source, old_schema_source, db_connection, storage_profile)
+        finally:
+            if csv_stream is not None:
+                db_connection.unregister(_STREAM_VIEW_NAME)
+        if load_result is not None:
+            load_span['table'], load_span['rows'], load_span['quarantined'] = load_result
+
+    print(f"Total processing time for {filename}: {time.time() - process_start_time:.2f} seconds")
+    return load_result
+
+def _load_standardized_csv(filename, table_name_suffix, columns, sample_rows, new_schema_source, old_schema_source, db_connection,
+                           storage_profile="standard"):
+    """
+    Looks up the compiled schema_registry plan for the CSV header, runs its SELECT over the
+    matching CSV source and creates or appends to the monthly table. Timestamps are parsed
+    with the format detected from sample_rows, falling back per row only where it fails.
+    The same SELECT computes each row's dq_flags (see data_quality), and flagged rows go to
+    the quarantine table instead. Returns (table_name, loaded_rows, quarantined_rows), or
+    None on failure.
+    """
+    plan = plan_for_header(columns, storage_profile)
+    if plan is None:
+        print(f"Unknown schema for file: {filename} (header columns: {list(columns)}). Skipping.")
         return
 
+    final_table_name = f"citibike_data_{table_name_suffix}_{plan['schema']}"
+    source = new_schema_source if plan['schema'] == 'new_schema' else old_schema_source
+    timestamp_format = detect_plan_timestamp_format(plan, columns, sample_rows)
+    if plan['timestamp_columns']:
+        print(f"Detected timestamp format for {filename}: {timestamp_format or 'none (using fallbacks)'}")
+    query_logic = flagged_select_sql(plan_select_sql(plan, source, timestamp_format), EXPORT_SCHEMAS[f"{plan['schema']}_combined"])
+
     # Check if a table for this month already exists
     table_exists_query = "SELECT count(*) FROM information_schema.tables WHERE table_name LIKE ?"
-    
-    # Using your original schema detection and handling logic
-    if 'member_casual' in sample_df.columns:
-        # Schema for newer files
-        final_table_name = f"citibike_data_{table_name_suffix}_new_schema"
-        
-        # Check if table exists
-        table_exists = db_connection.execute(table_exists_query, [final_table_name]).fetchone()[0] > 0
-        
-        if table_exists:
-            # Append to existing table
-            print(f"Table {final_table_name} already exists. Appending data from {filename}.")
-            insert_query = f"""
-            INSERT INTO "{final_table_name}"
-            SELECT
-                COALESCE("ride_id") AS ride_id,
-                COALESCE("rideable_type") AS rideable_type,
-                COALESCE("started_at")::TIMESTAMP AS started_at,
-                COALESCE("ended_at")::TIMESTAMP AS ended_at,
-                COALESCE("start_station_name") AS start_station_name,
-                COALESCE("start_station_id")::VARCHAR AS start_station_id,
-                COALESCE("end_station_name") AS end_station_name,
-                COALESCE("end_station_id")::VARCHAR AS end_station_id,
-                COALESCE("start_lat")::DOUBLE AS start_lat,
-                COALESCE("start_lng")::DOUBLE AS start_lng,
-                COALESCE("end_lat")::DOUBLE AS end_lat,
-                COALESCE("end_lng")::DOUBLE AS end_lng,
-                COALESCE("member_casual") AS member_casual
-            FROM read_csv('{csv_file_path}', header=true, types={{'start_station_id': 'VARCHAR', 'end_station_id': 'VARCHAR'}})
-            """
-        else:
-            # Create new table - original logic
-            insert_query = f"""
-            CREATE TABLE "{final_table_name}" AS
-            SELECT
-                COALESCE("ride_id") AS ride_id,
-                COALESCE("rideable_type") AS rideable_type,
-                COALESCE("started_at")::TIMESTAMP AS started_at,
-                COALESCE("ended_at")::TIMESTAMP AS ended_at,
-                COALESCE("start_station_name") AS start_station_name,
-                COALESCE("start_station_id")::VARCHAR AS start_station_id,
-                COALESCE("end_station_name") AS end_station_name,
-                COALESCE("end_station_id")::VARCHAR AS end_station_id,
-                COALESCE("start_lat")::DOUBLE AS start_lat,
-                COALESCE("start_lng")::DOUBLE AS start_lng,
-                COALESCE("end_lat")::DOUBLE AS end_lat,
-                COALESCE("end_lng")::DOUBLE AS end_lng,
-                COALESCE("member_casual") AS member_casual
-            FROM read_csv('{csv_file_path}', header=true, types={{'start_station_id': 'VARCHAR', 'end_station_id': 'VARCHAR'}})
-            """
-    elif 'gender' in sample_df.columns or 'Gender' in sample_df.columns:
-        # Schema for older files - using your original logic
-        final_table_name = f"citibike_data_{table_name_suffix}_old_schema"
-        
-        # Check if table exists
-        table_exists = db_connection.execute(table_exists_query, [final_table_name]).fetchone()[0] > 0
-        
-        # Use your original column naming approach
-        start_time_col = 'starttime' if 'starttime' in sample_df.columns else 'Start Time'
-        stop_time_col = 'stoptime' if 'stoptime' in sample_df.columns else 'Stop Time'
-        start_station_id_col = 'start station id' if 'start station id' in sample_df.columns else 'Start Station ID'
-        start_station_name_col = 'start station name' if 'start station name' in sample_df.columns else 'Start Station Name'
-        start_station_lat_col = 'start station latitude' if 'start station latitude' in sample_df.columns else 'Start Station Latitude'
-        start_station_lng_col = 'start station longitude' if 'start station longitude' in sample_df.columns else 'Start Station Longitude'
-        end_station_id_col = 'end station id' if 'end station id' in sample_df.columns else 'End Station ID'
-        end_station_name_col = 'end station name' if 'end station name' in sample_df.columns else 'End Station Name'
-        end_station_lat_col = 'end station latitude' if 'end station latitude' in sample_df.columns else 'End Station Latitude'
-        end_station_lng_col = 'end station longitude' if 'end station longitude' in sample_df.columns else 'End Station Longitude'
-        bikeid_col = 'bikeid' if 'bikeid' in sample_df.columns else 'Bike ID'
-        usertype_col = 'usertype' if 'usertype' in sample_df.columns else 'User Type'
-        birth_year_col = 'birth year' if 'birth year' in sample_df.columns else 'Birth Year'
-        gender_col = 'gender' if 'gender' in sample_df.columns else 'Gender'
-        
-        #Old schema contains bad datetime format
-
-        query_logic = f"""
-        SELECT
-            CASE
-                WHEN "{start_time_col}" LIKE '%-%-%' THEN strptime(NULLIF(TRIM("{start_time_col}"), ''), '%Y-%m-%d %H:%M:%S')
-                WHEN "{start_time_col}" LIKE '%/%/%' THEN strptime(NULLIF(TRIM("{start_time_col}"), ''), '%m/%d/%Y %H:%M:%S')
-                ELSE NULL
-            END AS starttime,
-            CASE
-                WHEN "{stop_time_col}" LIKE '%-%-%' THEN strptime(NULLIF(TRIM("{stop_time_col}"), ''), '%Y-%m-%d %H:%M:%S')
-                WHEN "{stop_time_col}" LIKE '%/%/%' THEN strptime(NULLIF(TRIM("{stop_time_col}"), ''), '%m/%d/%Y %H:%M:%S')
-                ELSE NULL
-            END AS stoptime,
-            "{start_station_id_col}"::VARCHAR AS start_station_id,
-            "{start_station_name_col}" AS start_station_name,
-            "{start_station_lat_col}"::DOUBLE AS start_station_latitude,
-            "{start_station_lng_col}"::DOUBLE AS start_station_longitude,
-            "{end_station_id_col}"::VARCHAR AS end_station_id,
-            "{end_station_name_col}" AS end_station_name,
-            "{end_station_lat_col}"::DOUBLE AS end_station_latitude,
-            "{end_station_lng_col}"::DOUBLE AS end_station_longitude,
-            "{bikeid_col}"::BIGINT AS bikeid,
-            "{usertype_col}" AS usertype,
-            TRY_CAST(LEFT(CAST("{birth_year_col}" as VARCHAR), 4) AS INTEGER) AS birth_year,
-            TRY_CAST("{gender_col}" AS BIGINT) AS gender
-        FROM read_csv('{csv_file_path}',
-                    header=true,
-                    all_varchar=true,
-                    ignore_errors=true)
-        """
-        
-        if table_exists:
-            insert_query = f'INSERT INTO "{final_table_name}" ({query_logic})'
-        else:
-            insert_query = f'CREATE TABLE "{final_table_name}" AS ({query_logic})'  
-    else:
-        print(f"Unknown schema for file: {filename} (sample columns: {sample_df.columns.tolist()}). Skipping.")
-        return
+    table_exists = db_connection.execute(table_exists_query, [final_table_name]).fetchone()[0] > 0
+    if table_exists:
+        print(f"Table {final_table_name} already exists. Appending data from {filename}.")
 
     # Execute query
     try:
         query_start_time = time.time()
-        db_connection.execute(insert_query)
+        check_counts = load_flagged_rows(db_connection, query_logic, final_table_name, plan['schema'], filename,
+                                         append=table_exists, partition=_table_partition(final_table_name))
         operation_type = "appended to" if table_exists else "created"
-        print(f"Successfully {operation_type} {final_table_name} from {filename} in {time.time() - query_start_time:.2f} seconds")
+        print(f"Successfully {operation_type} {final_table_name} from {filename} using header variant "
+              f"{plan['variant']} (v{plan['version']}) in {time.time() - query_start_time:.2f} seconds")
     except Exception as e:
         print(f"Error executing query for {final_table_name} from {filename}: {str(e)}")
-    
-    print(f"Total processing time for {filename}: {time.time() - process_start_time:.2f} seconds")
+        return None
+
+    loaded_rows, quarantined_rows = check_counts['loaded'], check_counts['quarantined']
+    if quarantined_rows:
+        failed_checks = ", ".join(f"{name}: {count}" for name, count in check_counts.items()
+                                  if count and name not in ('loaded', 'quarantined'))
+        print(f"Loaded {loaded_rows} rows from {filename}; quarantined {quarantined_rows} ({failed_checks})")
+    return final_table_name, loaded_rows, quarantined_rows
 
-def convert_parquet(db_connection, output_parquet_dir):
+def transform_csv_to_staging(csv_file_path, staging_dir, threads=None, memory_limit=None, storage_profile="standard"):
     """
-    Combines tables in DuckDB by schema type, adds geometry, and exports to partitioned Parquet.
+    Worker for parallel_ingest: standardizes one CSV in a private in-memory DuckDB and writes
+    the result to a staging Parquet file. Returns (table_name, staging_path, loaded_rows,
+    quarantined_rows, column_types, staged_quality), or None if the file was skipped. column_types lists
+    (name, type) so the coordinator can restore types Parquet doesn't keep, such as ENUMs;
+    staged_quality holds the file's quarantined rows and quality counts.
     """
-    if not os.path.exists(output_parquet_dir):
-        os.makedirs(output_parquet_dir)
-        print(f"Created Parquet output directory: {output_parquet_dir}")
+    config = {}
+    if threads:
+        config['threads'] = threads
+    if memory_limit:
+        config['memory_limit'] = memory_limit
+    worker_connection = duckdb.connect(database=':memory:', config=config)
+    try:
+        load_result = process_csv_to_duckdb(csv_file_path, worker_connection, storage_profile=storage_profile)
+        if load_result is None:
+            return None
+        table_name, loaded_rows, quarantined_rows = load_result
+        column_types = [(name, column_type) for name, column_type, *_ in
+                        worker_connection.execute(f'DESCRIBE "{table_name}"').fetchall()]
+        table_staging_dir = os.path.join(staging_dir, table_name)
+        os.makedirs(table_staging_dir, exist_ok=True)
+        staging_path = os.path.join(table_staging_dir, f"{os.path.splitext(os.path.basename(csv_file_path))[0]}.parquet")
+        worker_connection.execute(f"""COPY "{table_name}" TO '{staging_path}' (FORMAT PARQUET, COMPRESSION ZSTD)""")
+        staged_quality = stage_quality_records(worker_connection, table_staging_dir, os.path.splitext(os.path.basename(staging_path))[0])
+        return table_name, staging_path, loaded_rows, quarantined_rows, column_types, staged_quality
+    finally:
+        worker_connection.close()
+
+def register_staged_table(db_connection, table_name, staging_path, column_types):
+    """
+    Appends a staging Parquet file produced by transform_csv_to_staging to its monthly table,
+    creating the table on first use with the worker's column_types, then deletes the staging file.
+    """
+    staged_columns = ", ".join(f'"{name}"::{column_type} AS "{name}"' for name, column_type in column_types)
+    table_exists_query = "SELECT count(*) FROM information_schema.tables WHERE table_name = ?"
+    table_exists = db_connection.execute(table_exists_query, [table_name]).fetchone()[0] > 0
+    if table_exists:
+        db_connection.execute(f"""INSERT INTO "{table_name}" SELECT {staged_columns} FROM read_parquet('{staging_path}')""")
+    else:
+        db_connection.execute(f"""CREATE TABLE "{table_name}" AS SELECT {staged_columns} FROM read_parquet('{staging_path}')""")
+    os.remove(staging_path)
+
+def parallel_ingest(csv_paths, db_connection, staging_dir, workers, threads=None, memory_limit=None, storage_profile="standard"):
+    """
+    Loads CSVs with a process pool: each worker transforms a CSV into a staging Parquet file
+    using its own DuckDB (threads/memory_limit apply per worker), and this process, as the
+    single writer, registers the results in db_connection in completion order.
+    csv_paths may be a generator; at most 2 * workers CSVs are pulled ahead of the loaders,
+    and each CSV is deleted once it has been transformed. Returns the number of CSVs loaded.
+    """
+    os.makedirs(staging_dir, exist_ok=True)
+    csv_iter = iter(csv_paths)
+    loaded_count = 0
+    ingest_start_time = time.time()
+
+    # spawn rather than fork: the parent holds a DuckDB connection and may run download threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        def submit(csv_file_path):
+            print(f"\nQueued CSV for parallel load: {csv_file_path}")
+            future = executor.submit(transform_csv_to_staging, csv_file_path, staging_dir, threads, memory_limit, storage_profile)
+            future_paths[future] = csv_file_path
+            return future
+
+        future_paths = {}
+        pending = {submit(csv_file_path) for csv_file_path in itertools.islice(csv_iter, 2 * workers)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                csv_file_path = future_paths.pop(future)
+                next_csv = next(csv_iter, None)
+                if next_csv is not None:
+                    pending.add(submit(next_csv))
+
+                try:
+                    staged = future.result()
+                    if staged is not None:
+                        table_name, staging_path, loaded_rows, quarantined_rows, column_types, staged_quality = staged
+                        register_start_time = time.time()
+                        with metrics.span('csv_register', os.path.basename(csv_file_path), table=table_name) as register_span:
+                            register_span['rows'], register_span['quarantined'] = loaded_rows, quarantined_rows
+                            register_staged_table(db_connection, table_name, staging_path, column_types)
+                            register_staged_quality(db_connection, staged_quality)
+                        loaded_count += 1
+                        print(f"Registered {loaded_rows} rows ({quarantined_rows} quarantined) from {os.path.basename(csv_file_path)} "
+                              f"into {table_name} in {time.time() - register_start_time:.2f} seconds")
+                except Exception as e:
+                    print(f"Error loading CSV {csv_file_path} in parallel: {str(e)}")
+                finally:
+                    try:
+                        os.remove(csv_file_path)
+                        print(f"Deleted processed CSV: {csv_file_path}")
+                    except Exception as e:
+                        print(f"Error deleting CSV {csv_file_path}: {str(e)}")
+
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    print(f"Parallel ingest of {loaded_count} CSV files with {workers} workers finished in {time.time() - ingest_start_time:.2f} seconds")
+    return loaded_count
+
+def ensure_manifest_table(db_connection):
+    """
+    Creates the ingestion manifest if it doesn't exist yet. It holds one row per CSV member
+    loaded from a source archive: the archive's validators and checksum, the member's
+    CRC-32 and size, and the table/partition and row count it produced.
+    """
+    db_connection.execute(f"""
+    CREATE TABLE IF NOT EXISTS "{MANIFEST_TABLE}" (
+        source_url VARCHAR,
+        archive_etag VARCHAR,
+        archive_last_modified VARCHAR,
+        archive_size BIGINT,
+        archive_sha256 VARCHAR,
+        member VARCHAR,
+        member_crc32 BIGINT,
+        member_size BIGINT,
+        table_name VARCHAR,
+        year INTEGER,
+        month INTEGER,
+        row_count BIGINT,
+        loaded_at TIMESTAMP,
+        PRIMARY KEY (source_url, member)
+    )
+    """)
+
+def list_zip_csv_members(zip_path):
+    """
+    Returns {member_name: (crc32, file_size)} for every CSV in a zip archive, nested zips
+    included, read from the central directories only. Names match iter_zip_csv_streams.
+    """
+    members = {}
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            member = info.filename
+            if member.startswith('__MACOSX/') or member.endswith('.DS_Store') or member.endswith('/'):
+                continue
+            if member.lower().endswith('.zip'):
+                try:
+                    with zip_ref.open(member) as nested_file, zipfile.ZipFile(nested_file, 'r') as nested_zip:
+                        for nested_info in nested_zip.infolist():
+                            if nested_info.filename.startswith('__MACOSX/') or not nested_info.filename.lower().endswith('.csv'):
+                                continue
+                            members[nested_info.filename] = (nested_info.CRC, nested_info.file_size)
+                except zipfile.BadZipFile:
+                    print(f"Error: Nested file {member} is not a valid zip")
+            elif member.lower().endswith('.csv'):
+                members[member] = (info.CRC, info.file_size)
+    return members
+
+def incremental_ingest(url_list, destination_folder, db_connection, cache_dir=None, max_cache_bytes=None,
+                       storage_profile="standard"):
+    """
+    Loads only what is new or changed since the last run, according to the ingestion manifest.
+    An archive whose ETag/Last-Modified/Content-Length still match the manifest is not
+    downloaded at all. Otherwise members are compared by CRC-32 and size, and every monthly
+    table fed by a new or changed member is dropped and reloaded from the archive (members
+    are streamed, not extracted). Each month is assumed to come from a single archive.
+    Returns the set of monthly tables that were (re)loaded.
+    """
+    ensure_manifest_table(db_connection)
+    if not os.path.exists(destination_folder):
+        os.makedirs(destination_folder)
+        print(f"Created destination folder: {destination_folder}")
 
+    changed_tables = set()
+    for url in url_list:
+        recorded = db_connection.execute(
+            f'SELECT member, member_crc32, member_size, archive_etag, archive_last_modified, archive_size, archive_sha256 '
+            f'FROM "{MANIFEST_TABLE}" WHERE source_url = ?', [url]).fetchall()
+        try:
+            remote = remote_validators(url)
+        except requests.RequestException as e:
+            print(f"Could not check {url} for changes: {str(e)}. Skipping.")
+            continue
+
+        if recorded and (remote['etag'], remote['last_modified'], remote['content_length']) == tuple(recorded[0][3:6]):
+            print(f"Unchanged since last load, skipping: {url}")
+            continue
+
+        downloaded_zip_path = None
+        try:
+            print(f"Downloading: {url}")
+            downloaded_zip_path, downloaded_bytes, download_seconds = download_archive(
+                url, destination_folder, True, cache_dir, max_cache_bytes)
+            _print_download_stats(downloaded_zip_path, downloaded_bytes, download_seconds)
+            changed_tables |= _ingest_changed_members(url, downloaded_zip_path, remote, recorded, db_connection,
+                                                      storage_profile)
+        except Exception as e:
+            print(f"Error processing URL: {url}")
+            print(f"Error message: {str(e)}")
+        finally:
+            remove_downloaded_archive(downloaded_zip_path, cache_dir)
+            print("-" * 50)  # Separator line
+
+    return changed_tables
+
+def _ingest_changed_members(url, zip_path, remote, recorded, db_connection, storage_profile="standard"):
+    """
+    Reloads the monthly tables of url's archive whose members differ from the manifest and
+    records the new members. Returns the set of tables that were loaded.
+    """
+    archive_sha256 = sha256_file(zip_path)
+    archive_values = [remote['etag'], remote['last_modified'], remote['content_length'], archive_sha256]
+    update_archive_query = (f'UPDATE "{MANIFEST_TABLE}" SET archive_etag = ?, archive_last_modified = ?, '
+                            f'archive_size = ?, archive_sha256 = ? WHERE source_url = ?')
+
+    if recorded and recorded[0][6] == archive_sha256:
+        print(f"Archive content unchanged, only refreshing its validators: {url}")
+        db_connection.execute(update_archive_query, archive_values + [url])
+        return set()
+
+    members = list_zip_csv_members(zip_path)
+    known_members = {member: (crc, size) for member, crc, size, *_ in recorded}
+    changed_suffixes = {table_suffix_for_file(member) for member, checksum in members.items()
+                        if known_members.get(member) != checksum}
+    changed_suffixes |= {table_suffix_for_file(member) for member in known_members if member not in members}
+    if not changed_suffixes:
+        print(f"All CSV members unchanged: {url}")
+        db_connection.execute(update_archive_query, archive_values + [url])
+        return set()
+
+    print(f"Reloading {len(changed_suffixes)} month(s) from {url}: {sorted(changed_suffixes)}")
+    for suffix in changed_suffixes:
+        for schema in ('old_schema', 'new_schema'):
+            db_connection.execute(f'DROP TABLE IF EXISTS "citibike_data_{suffix}_{schema}"')
+            clear_quality_records(db_connection, f"citibike_data_{suffix}_{schema}")
+    for member in known_members:
+        if table_suffix_for_file(member) in changed_suffixes:
+            db_connection.execute(f'DELETE FROM "{MANIFEST_TABLE}" WHERE source_url = ? AND member = ?', [url, member])
+
+    loaded_tables = set()
+    for member_name, csv_stream in iter_zip_csv_streams(zip_path):
+        if table_suffix_for_file(member_name) not in changed_suffixes:
+            continue
+        load_result = process_csv_to_duckdb(member_name, db_connection, csv_stream=csv_stream,
+                                            storage_profile=storage_profile)
+        if load_result is None:
+            continue
+        table_name, loaded_rows, _ = load_result
+        year, month = _table_partition(table_name) or (None, None)
+        crc, size = members[member_name]
+        db_connection.execute(
+            f'INSERT INTO "{MANIFEST_TABLE}" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, current_timestamp)',
+            [url] + archive_values + [member_name, crc, size, table_name, year, month, loaded_rows])
+        loaded_tables.add(table_name)
+
+    db_connection.execute(update_archive_query, archive_values + [url])
+    return loaded_tables
+
+def _table_partition(table_name):
+    """
+    Returns the (year, month) a citibike_data_YYYY_MM_* table belongs to, or None.
+    """
+    match = re.match(r'citibike_data_(\d{4})_(\d{2})_', table_name)
+    if not match:
+        return None
+    return int(match.group(1)), int(match.group(2))
+
+def _partition_filter_sql(time_col, partitions):
+    """
+    Returns an AND clause restricting rows to the given (year, month) partitions, or '' for all rows.
+    The months are written as timestamp ranges so DuckDB can push them into the table scans
+    and skip row groups (and whole monthly tables) by their min/max statistics.
+    """
+    if partitions is None:
+        return ""
+    month_ranges = []
+    for year, month in partitions:
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        month_ranges.append(f"""("{time_col}" >= TIMESTAMP '{year}-{month:02d}-01' AND "{time_col}" < TIMESTAMP '{next_year}-{next_month:02d}-01')""")
+    return f"AND ({' OR '.join(month_ranges)})"
+
+def _load_spatial_extension(db_connection):
     try:
         db_connection.install_extension("spatial")
         db_connection.load_extension("spatial")
     except Exception as e:
         print(f"Error loading spatial extension: {e}. Geospatial operations might fail.")
 
-    base_tables_query = "SELECT table_name FROM information_schema.tables WHERE table_type = 'BASE TABLE'"
-    actual_tables_df = db_connection.execute(base_tables_query).fetchdf()
+def _load_h3_extension(db_connection):
+    """
+    Loads the h3 community extension. Returns False (and the export goes on without H3
+    columns) if it can't be installed.
+    """
+    try:
+        db_connection.execute("INSTALL h3 FROM community")
+        db_connection.load_extension("h3")
+        return True
+    except Exception as e:
+        print(f"Error loading h3 extension: {e}. Exporting without H3 columns.")
+        return False
+
+def list_trip_tables(db_connection, tables=None):
+    """
+    Returns {combined_name: [monthly table names]} for each schema family in EXPORT_SCHEMAS,
+    optionally restricted to the given table names. Data quality tables (quarantine, counts)
+    are never included.
+    """
+    base_tables_query = "SELECT table_name FROM information_schema.tables WHERE table_type = 'BASE TABLE' ORDER BY table_name"
+    actual_tables = [row[0] for row in db_connection.execute(base_tables_query).fetchall() if not is_quality_table(row[0])]
+    if tables is not None:
+        actual_tables = [name for name in actual_tables if name in tables]
+    return {combined_name: [name for name in actual_tables if details["table_marker"] in name]
+            for combined_name, details in EXPORT_SCHEMAS.items()}
+
+def ensure_station_tables(db_connection):
+    """
+    Creates the station dimension and its monthly bridge if they don't exist yet.
+    A station version is one (station_id, station_name, coordinate bucket); a rename or a
+    move to another bucket gets a new station_key, valid over the months it was seen in.
+    """
+    db_connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS "{STATIONS_TABLE}" (
+            station_key INTEGER PRIMARY KEY,
+            station_id VARCHAR,
+            station_name VARCHAR,
+            lat_bucket DOUBLE,
+            lng_bucket DOUBLE,
+            latitude DOUBLE,
+            longitude DOUBLE,
+            valid_from DATE,
+            valid_to DATE
+        )
+    """)
+    db_connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS "{STATION_MONTHS_TABLE}" (
+            station_id VARCHAR,
+            station_name VARCHAR,
+            year INTEGER,
+            month INTEGER,
+            latitude DOUBLE,
+            longitude DOUBLE,
+            trip_count BIGINT,
+            station_key INTEGER
+        )
+    """)
+
+def _table_columns(db_connection, table_name):
+    query = "SELECT column_name FROM information_schema.columns WHERE table_name = ?"
+    return {row[0] for row in db_connection.execute(query, [table_name]).fetchall()}
+
+def build_station_dimension(db_connection, tables=None):
+    """
+    Builds or extends the stations dimension from the monthly trip tables, then rewrites
+    each table to reference stations by start_station_key/end_station_key instead of the
+    id and name strings (trip coordinates are kept). Existing keys never change, so only
+    new or reloaded tables (tables, if given) are processed. A <table>_wide view restores
+    the original id/name columns. Returns the list of tables that were keyed.
+    """
+    ensure_station_tables(db_connection)
+    tables_to_key = []
+    for combined_name, table_names in list_trip_tables(db_connection, tables).items():
+        for table_name in table_names:
+            if "start_station_key" in _table_columns(db_connection, table_name):
+                continue
+            if _table_partition(table_name) is None:
+                print(f"Table {table_name} has no year/month in its name; leaving its station columns as they are.")
+                continue
+            tables_to_key.append((table_name, EXPORT_SCHEMAS[combined_name]))
+    if not tables_to_key:
+        print("No new trip tables for the station dimension.")
+        return []
+
+    stage_start_time = time.time()
+    observation_parts = []
+    for table_name, details in tables_to_key:
+        year, month = _table_partition(table_name)
+        for end in ("start", "end"):
+            observation_parts.append(f"""
+                SELECT "{end}_station_id" AS station_id, "{end}_station_name" AS station_name,
+                       {year} AS year, {month} AS month,
+                       "{details[f"{end}_lat_col"]}"::DOUBLE AS latitude, "{details[f"{end}_lng_col"]}"::DOUBLE AS longitude
+                FROM "{table_name}"
+                WHERE "{end}_station_id" IS NOT NULL OR "{end}_station_name" IS NOT NULL
+            """)
+    partitions = sorted({_table_partition(table_name) for table_name, _ in tables_to_key})
+    partition_filter = " OR ".join(f"(year = {year} AND month = {month})" for year, month in partitions)
+
+    # Reloaded months replace their observations; median coordinates absorb per-trip GPS noise
+    db_connection.execute(f'DELETE FROM "{STATION_MONTHS_TABLE}" WHERE {partition_filter}')
+    db_connection.execute(f"""
+        INSERT INTO "{STATION_MONTHS_TABLE}"
+        SELECT station_id, station_name, year, month, median(latitude), median(longitude), count(*), NULL
+        FROM ({" UNION ALL ".join(observation_parts)})
+        GROUP BY station_id, station_name, year, month
+    """)
+
+    version_match = f"""s.station_id IS NOT DISTINCT FROM m.station_id
+                  AND s.station_name IS NOT DISTINCT FROM m.station_name
+                  AND s.lat_bucket IS NOT DISTINCT FROM round(m.latitude, {STATION_COORD_PRECISION})
+                  AND s.lng_bucket IS NOT DISTINCT FROM round(m.longitude, {STATION_COORD_PRECISION})"""
+    new_station_count = db_connection.execute(f"""
+        INSERT INTO "{STATIONS_TABLE}" (station_key, station_id, station_name, lat_bucket, lng_bucket)
+        SELECT (SELECT COALESCE(MAX(station_key), 0) FROM "{STATIONS_TABLE}")
+                   + row_number() OVER (ORDER BY station_id, station_name, lat_bucket, lng_bucket),
+               station_id, station_name, lat_bucket, lng_bucket
+        FROM (
+            SELECT DISTINCT m.station_id, m.station_name,
+                   round(m.latitude, {STATION_COORD_PRECISION}) AS lat_bucket,
+                   round(m.longitude, {STATION_COORD_PRECISION}) AS lng_bucket
+            FROM "{STATION_MONTHS_TABLE}" m
+            WHERE m.station_key IS NULL
+              AND NOT EXISTS (SELECT 1 FROM "{STATIONS_TABLE}" s WHERE {version_match})
+        )
+    """).fetchone()[0]
+    db_connection.execute(f"""
+        UPDATE "{STATION_MONTHS_TABLE}" m SET station_key = s.station_key
+        FROM "{STATIONS_TABLE}" s
+        WHERE m.station_key IS NULL AND {version_match}
+    """)
+    db_connection.execute(f"""
+        UPDATE "{STATIONS_TABLE}" s
+        SET latitude = v.latitude, longitude = v.longitude, valid_from = v.valid_from, valid_to = v.valid_to
+        FROM (
+            SELECT station_key, median(latitude) AS latitude, median(longitude) AS longitude,
+                   MIN(make_date(year, month, 1)) AS valid_from, last_day(MAX(make_date(year, month, 1))) AS valid_to
+            FROM "{STATION_MONTHS_TABLE}"
+            GROUP BY station_key
+        ) v
+        WHERE s.station_key = v.station_key
+    """)
+    print(f"Station dimension: {new_station_count} new station versions "
+          f"({time.time() - stage_start_time:.2f} seconds)")
+
+    keyed_tables = []
+    for table_name, details in tables_to_key:
+        year, month = _table_partition(table_name)
+        try:
+            bridge_joins = []
+            for end in ("start", "end"):
+                bridge_joins.append(f"""
+                LEFT JOIN "{STATION_MONTHS_TABLE}" {end}_bridge
+                  ON {end}_bridge.year = {year} AND {end}_bridge.month = {month}
+                 AND {end}_bridge.station_id IS NOT DISTINCT FROM t."{end}_station_id"
+                 AND {end}_bridge.station_name IS NOT DISTINCT FROM t."{end}_station_name"
+                """)
+            db_connection.execute(f"""
+                CREATE OR REPLACE TABLE "{table_name}" AS
+                SELECT t.* EXCLUDE (start_station_id, start_station_name, end_station_id, end_station_name),
+                       start_bridge.station_key AS start_station_key,
+                       end_bridge.station_key AS end_station_key
+                FROM "{table_name}" t
+                {"".join(bridge_joins)}
+            """)
+            db_connection.execute(f"""
+                CREATE OR REPLACE VIEW "{table_name}_wide" AS
+                SELECT t.* EXCLUDE (start_station_key, end_station_key),
+                       start_station.station_id AS start_station_id, start_station.station_name AS start_station_name,
+                       end_station.station_id AS end_station_id, end_station.station_name AS end_station_name
+                FROM "{table_name}" t
+                LEFT JOIN "{STATIONS_TABLE}" start_station ON start_station.station_key = t.start_station_key
+                LEFT JOIN "{STATIONS_TABLE}" end_station ON end_station.station_key = t.end_station_key
+            """)
+            keyed_tables.append(table_name)
+            print(f"Replaced station ids/names with station keys in {table_name}")
+        except Exception as e:
+            print(f"Error adding station keys to {table_name}: {str(e)}")
+    return keyed_tables
+
+def export_station_dimension(db_connection, output_parquet_dir):
+    """
+    Writes the stations dimension to <output_parquet_dir>/stations.parquet so the keyed trip
+    Parquet files can be joined back to station ids and names.
+    """
+    output_path = os.path.join(output_parquet_dir, f"{STATIONS_TABLE}.parquet")
+    db_connection.execute(f"""COPY (SELECT * FROM "{STATIONS_TABLE}" ORDER BY station_key) TO '{output_path}' (FORMAT PARQUET, COMPRESSION ZSTD)""")
+    print(f"Exported station dimension to {output_path}")
+
+def _geom_select_sql(source_name, details, partitions=None, h3_resolution=None, bbox_covering=False):
+    """
+    Returns the SELECT that adds start/end geometry and year/month partition columns to
+    source_name (without its dq_flags column). Rows without a time or coordinates were
+    already quarantined at load; the NULL checks only guard tables loaded before that.
+    start_geom comes first so it is the GeoParquet primary column. With h3_resolution,
+    start_h3/end_h3 cell ids at that resolution are added too (needs the h3 extension);
+    with bbox_covering, start_bbox/end_bbox structs for the GeoParquet bbox covering.
+    """
+    bbox_columns = ""
+    if bbox_covering:
+        bbox_columns = "".join(f"""
+               {{'xmin': "{details[f"{end}_lng_col"]}"::DOUBLE, 'ymin': "{details[f"{end}_lat_col"]}"::DOUBLE,
+                 'xmax': "{details[f"{end}_lng_col"]}"::DOUBLE, 'ymax': "{details[f"{end}_lat_col"]}"::DOUBLE}} AS {end}_bbox,"""
+                               for end in ("start", "end"))
+    h3_columns = ""
+    if h3_resolution is not None:
+        h3_columns = f"""
+               h3_latlng_to_cell("{details["start_lat_col"]}", "{details["start_lng_col"]}", {h3_resolution}) AS start_h3,
+               h3_latlng_to_cell("{details["end_lat_col"]}", "{details["end_lng_col"]}", {h3_resolution}) AS end_h3,"""
+    return f"""
+        SELECT COLUMNS(c -> c <> 'dq_flags'),{h3_columns}
+               st_point("{details["start_lng_col"]}", "{details["start_lat_col"]}")::{GEOMETRY_TYPE} AS start_geom,
+               st_point("{details["end_lng_col"]}", "{details["end_lat_col"]}")::{GEOMETRY_TYPE} AS end_geom,{bbox_columns}
+               YEAR("{details["time_col"]}") AS year,
+               MONTH("{details["time_col"]}") AS month
+        FROM "{source_name}"
+        WHERE "{details["time_col"]}" IS NOT NULL
+          AND "{details["start_lng_col"]}" IS NOT NULL AND "{details["start_lat_col"]}" IS NOT NULL
+          AND "{details["end_lng_col"]}" IS NOT NULL AND "{details["end_lat_col"]}" IS NOT NULL
+          {_partition_filter_sql(details["time_col"], partitions)}
+        """
+
+def _export_order_sql(db_connection, source_name, details, spatial_sort='none', export_profile='default'):
+    """
+    Returns the ORDER BY applied within each year/month partition, so row-group min/max
+    statistics let readers skip row groups. The export profile's sort keys come first
+    ('station' is start_station_key when source_name has the station dimension, otherwise
+    start_station_id); spatial_sort then clusters rows on a Hilbert curve over the start
+    point ('hilbert') or on the start H3 cell ('h3').
+    """
+    order_columns = []
+    for sort_key in EXPORT_PROFILES[export_profile]["sort_keys"]:
+        if sort_key == "time":
+            order_columns.append(f'"{details["time_col"]}"')
+        elif sort_key == "station":
+            station_col = "start_station_key" if "start_station_key" in _table_columns(db_connection, source_name) else "start_station_id"
+            order_columns.append(f'"{station_col}"')
+    if spatial_sort == 'hilbert':
+        order_columns.append(f'ST_Hilbert("{details["start_lng_col"]}", "{details["start_lat_col"]}", {HILBERT_BOUNDS})')
+    elif spatial_sort == 'h3':
+        order_columns.append("start_h3")
+    if not order_columns:
+        return ""
+    return f"ORDER BY year, month, {', '.join(order_columns)}"
+
+def _copy_options_sql(export_profile):
+    """
+    Returns the export profile's COPY options as a ', OPTION value' suffix.
+    """
+    return "".join(f", {option} {value}" for option, value in EXPORT_PROFILES[export_profile]["copy_options"].items())
+
+def _geoparquet_metadata(bboxes):
+    """
+    Returns the GeoParquet 1.1 'geo' metadata JSON for a file whose start/end geometry
+    bboxes are given as {'start': [xmin, ymin, xmax, ymax], 'end': [...]}, declaring the
+    start_bbox/end_bbox columns as bbox coverings.
+    """
+    columns = {}
+    for end in ("start", "end"):
+        columns[f"{end}_geom"] = {
+            "encoding": "WKB",
+            "geometry_types": ["Point"],
+            "crs": EPSG_4326_PROJJSON,
+            "bbox": bboxes[end],
+            "covering": {"bbox": {bound: [f"{end}_bbox", bound] for bound in ("xmin", "ymin", "xmax", "ymax")}},
+        }
+    return json.dumps({"version": "1.1.0", "primary_column": "start_geom", "columns": columns})
+
+def _copy_geoparquet(db_connection, select_sql, details, parquet_file_path, order_sql="",
+                     bbox_covering=False, filename_stem=None, export_profile='default', partition=None):
+    """
+    Writes the rows of select_sql (a _geom_select_sql query) as GeoParquet under
+    year=/month= partitions of parquet_file_path, in order_sql order and with the export
+    profile's COPY options, named {filename_stem}_{i}.parquet (data_{i} by default).
+    DuckDB writes the geo metadata itself (EPSG:4326, per-file bbox).
+    With bbox_covering each partition file is written with its own COPY so the metadata,
+    which DuckDB can't generate for coverings, carries that file's bbox. partition, the
+    (year, month) select_sql is restricted to if any, only labels the export span.
+    Returns the number of rows written.
+    """
+    copy_options = _copy_options_sql(export_profile)
+    if not bbox_covering:
+        filename_option = f", FILENAME_PATTERN '{filename_stem}_{{i}}'" if filename_stem else ""
+        span_name = os.path.basename(parquet_file_path)
+        if partition:
+            span_name += f"/year={partition[0]}/month={partition[1]}"
+        with metrics.span('export', span_name, table=filename_stem) as export_span:
+            export_span['rows'] = db_connection.execute(f"""
+            COPY (
+                SELECT * FROM ({select_sql}) WHERE year IS NOT NULL AND month IS NOT NULL
+                {order_sql}
+            ) TO '{parquet_file_path}'
+            (FORMAT PARQUET, PARTITION_BY (year, month){filename_option}, OVERWRITE_OR_IGNORE TRUE, COMPRESSION ZSTD{copy_options})
+            """).fetchone()[0]
+            metrics.record_duckdb_profile(db_connection)
+        return export_span['rows']
+
+    bounds_sql = ", ".join(f'MIN("{details[f"{end}_lng_col"]}"), MIN("{details[f"{end}_lat_col"]}"), '
+                           f'MAX("{details[f"{end}_lng_col"]}"), MAX("{details[f"{end}_lat_col"]}")'
+                           for end in ("start", "end"))
+    partition_bounds = db_connection.execute(f"""
+        SELECT year, month, {bounds_sql} FROM ({select_sql})
+        WHERE year IS NOT NULL AND month IS NOT NULL
+        GROUP BY year, month ORDER BY year, month
+    """).fetchall()
+    written_rows = 0
+    for year, month, *bounds in partition_bounds:
+        partition_dir = os.path.join(parquet_file_path, f"year={year}", f"month={month}")
+        os.makedirs(partition_dir, exist_ok=True)
+        file_path = os.path.join(partition_dir, f"{filename_stem or 'data'}_0.parquet")
+        geo_metadata = _geoparquet_metadata({"start": [float(b) for b in bounds[:4]], "end": [float(b) for b in bounds[4:]]})
+        with metrics.span('export', os.path.relpath(file_path, os.path.dirname(parquet_file_path)), table=filename_stem) as export_span:
+            export_span['rows'] = db_connection.execute(f"""
+            COPY (
+                SELECT * EXCLUDE (year, month) FROM ({select_sql}) WHERE year = {year} AND month = {month}
+                {order_sql}
+            ) TO '{file_path}'
+            (FORMAT PARQUET, GEOPARQUET_VERSION 'NONE', KV_METADATA {{geo: '{geo_metadata.replace("'", "''")}'}}, COMPRESSION ZSTD{copy_options})
+            """).fetchone()[0]
+            metrics.record_duckdb_profile(db_connection)
+            export_span['bytes'] = os.path.getsize(file_path)
+        written_rows += export_span['rows']
+    return written_rows
+
+def _index_dataset(db_connection, parquet_file_path, details):
+    """
+    Refreshes the dataset's _index.json after an export (see dataset_index.write_dataset_index).
+    A failure only costs readers the index, so it is reported and the export carries on.
+    """
+    if not os.path.isdir(parquet_file_path):
+        return
+    try:
+        write_dataset_index(db_connection, parquet_file_path, details)
+    except Exception as e:
+        print(f"Error writing the index of {parquet_file_path}: {str(e)}")
+
+def _drop_other_relation_kind(db_connection, name, kind):
+    """
+    Drops name if it exists as the other kind of relation than kind ('TABLE' or 'VIEW'), so
+    CREATE OR REPLACE <kind> can follow. DuckDB's DROP <kind> IF EXISTS raises rather than
+    skipping when name is the other kind.
+    """
+    row = db_connection.execute("SELECT table_type FROM information_schema.tables WHERE table_name = ?", [name]).fetchone()
+    if row is None:
+        return
+    existing_kind = 'VIEW' if row[0] == 'VIEW' else 'TABLE'
+    if existing_kind != kind:
+        db_connection.execute(f'DROP {existing_kind} "{name}"')
 
-    if actual_tables_df.empty:
+def convert_parquet(db_connection, output_parquet_dir, tables=None, per_table=False, h3_resolution=None, spatial_sort='none',
+                    bbox_covering=False, export_profile='default', canonical=False, chunked=False):
+    """
+    Combines tables in DuckDB by schema type, adds geometry, and exports to partitioned Parquet.
+    If tables is given, only those monthly tables are exported: their year/month partitions
+    are replaced and every other partition is left untouched. Monthly tables are assumed to
+    hold the trips that start in their month; rows outside it are not exported in this mode.
+    With per_table=True the combined tables are skipped entirely (see export_tables_per_partition).
+    h3_resolution adds start_h3/end_h3 columns and spatial_sort ('none', 'hilbert' or 'h3')
+    orders the rows inside each partition. The output is GeoParquet (see _copy_geoparquet);
+    bbox_covering adds start_bbox/end_bbox covering columns. export_profile picks the sort
+    keys and row-group/bloom filter settings from EXPORT_PROFILES. With canonical=True both
+    eras are written to a single dataset instead (see export_canonical_trips). chunked=True
+    replaces the combined tables with views and exports one month at a time (see
+    _export_months), so memory use doesn't grow with the size of the dataset.
+    Every exported dataset gets a sidecar _index.json of its files (see _index_dataset).
+    """
+    if not os.path.exists(output_parquet_dir):
+        os.makedirs(output_parquet_dir)
+        print(f"Created Parquet output directory: {output_parquet_dir}")
+
+    _load_spatial_extension(db_connection)
+    if h3_resolution is not None and not _load_h3_extension(db_connection):
+        h3_resolution = None
+    if spatial_sort == 'h3' and h3_resolution is None:
+        print("Sorting by H3 needs H3 columns; sorting on the Hilbert curve instead.")
+        spatial_sort = 'hilbert'
+
+    tables_by_schema = list_trip_tables(db_connection, tables)
+    if not any(tables_by_schema.values()):
         print("No base tables found in the database to convert to Parquet.")
         return
 
-    actual_tables = actual_tables_df['table_name'].tolist()
-
-    old_schema_tables = [name for name in actual_tables if '_old_schema' in name]
-    new_schema_tables = [name for name in actual_tables if '_new_schema' in name]
-
-    schema_map = {
-        "old_schema_combined": {
-            "tables": old_schema_tables,
-            "start_lng_col": "start_station_longitude", "start_lat_col": "start_station_latitude",
-            "end_lng_col": "end_station_longitude", "end_lat_col": "end_station_latitude",
-            "time_col": "starttime"
-        },
-        "new_schema_combined": {
-            "tables": new_schema_tables,
-            "start_lng_col": "start_lng", "start_lat_col": "start_lat",
-            "end_lng_col": "end_lng", "end_lat_col": "end_lat",
-            "time_col": "started_at"
-        }
-    }
+    if per_table:
+        export_tables_per_partition(db_connection, output_parquet_dir, tables_by_schema, h3_resolution, spatial_sort,
+                                    bbox_covering, export_profile)
+        return
 
-    for combined_name, details in schema_map.items():
-        if not details["tables"]:
+    partitions = None
+    if tables is not None:
+        selected_tables = [name for names in tables_by_schema.values() for name in names]
+        partitions = sorted({_table_partition(name) for name in selected_tables} - {None})
+        skipped_tables = [name for name in selected_tables if _table_partition(name) is None]
+        if skipped_tables:
+            print(f"Tables without a year/month in their name can't be exported incrementally: {skipped_tables}")
+        if not partitions:
+            print("No partitions to re-export.")
+            return
+
+    if canonical:
+        export_canonical_trips(db_connection, output_parquet_dir, tables_by_schema, partitions, h3_resolution,
+                               spatial_sort, bbox_covering, export_profile, chunked)
+        return
+
+    for combined_name, details in EXPORT_SCHEMAS.items():
+        schema_tables = tables_by_schema[combined_name]
+        if not schema_tables:
             print(f"No tables found for schema {combined_name}. Skipping Parquet conversion for this schema.")
             continue
 
         print(f"Combining tables for {combined_name}...")
-        union_parts = [f'SELECT * FROM "{table_name}"' for table_name in details["tables"]]
+        # dq_flags is always 0 once flagged rows are quarantined, and tables loaded before it existed lack it
+        union_parts = [f'SELECT COLUMNS(c -> c <> \'dq_flags\') FROM "{table_name}"' for table_name in schema_tables]
         
         if not union_parts:
             print(f"No tables to union for {combined_name}.")
             continue
 
+        if chunked:
+            parquet_file_path = os.path.join(output_parquet_dir, f'{combined_name}_with_geom.parquet')
+            try:
+                _drop_other_relation_kind(db_connection, combined_name, 'VIEW')
+                db_connection.execute(f'CREATE OR REPLACE VIEW "{combined_name}" AS { " UNION ALL ".join(union_parts) }')
+                exported_rows = _export_months(db_connection, combined_name, details, parquet_file_path, partitions,
+                                               h3_resolution, spatial_sort, bbox_covering, export_profile)
+                print(f"Exported {exported_rows} rows of {combined_name} to Parquet at {parquet_file_path}")
+            except Exception as e:
+                print(f"Error exporting {combined_name} to Parquet: {str(e)}")
+            _index_dataset(db_connection, parquet_file_path, details)
+            continue
+
         combine_query = f'CREATE OR REPLACE TABLE "{combined_name}" AS { " UNION ALL ".join(union_parts) }'
         try:
+            _drop_other_relation_kind(db_connection, combined_name, 'TABLE')
             db_connection.execute(combine_query)
             print(f"Created combined table: {combined_name}")
         except Exception as e:
@@ -368,19 +1377,8 @@ def convert_parquet(db_connection, output_parquet_dir):
 
         add_geom_query = f"""
         CREATE OR REPLACE TABLE "{table_with_geom_name}" AS
-        SELECT *,
-               st_point("{details["end_lng_col"]}", "{details["end_lat_col"]}") AS end_geom,
-               st_point("{details["start_lng_col"]}", "{details["start_lat_col"]}") AS start_geom,
-               YEAR("{details["time_col"]}") AS year,
-               MONTH("{details["time_col"]}") AS month
-        FROM "{combined_name}"
-        WHERE "{details["time_col"]}" IS NOT NULL
-          AND "{details["start_lng_col"]}" IS NOT NULL AND "{details["start_lat_col"]}" IS NOT NULL
-          AND "{details["end_lng_col"]}" IS NOT NULL AND "{details["end_lat_col"]}" IS NOT NULL
-          AND typeof("{details["start_lng_col"]}") NOT IN ('VARCHAR', 'NULL') 
-          AND typeof("{details["start_lat_col"]}") NOT IN ('VARCHAR', 'NULL')
-          AND typeof("{details["end_lng_col"]}") NOT IN ('VARCHAR', 'NULL')
-          AND typeof("{details["end_lat_col"]}") NOT IN ('VARCHAR', 'NULL');
+        {_geom_select_sql(combined_name, details, partitions, h3_resolution, bbox_covering)}
+        {"ORDER BY year, month" if bbox_covering else ""};
         """
         try:
             db_connection.execute(add_geom_query)
@@ -395,17 +1393,294 @@ def convert_parquet(db_connection, output_parquet_dir):
             continue
 
         parquet_file_path = os.path.join(output_parquet_dir, f'{table_with_geom_name}.parquet')
-        export_query = f"""
-        COPY (
-            SELECT * FROM "{table_with_geom_name}" WHERE year IS NOT NULL AND month IS NOT NULL
-        ) TO '{parquet_file_path}'
-        (FORMAT PARQUET, PARTITION_BY (year, month), OVERWRITE_OR_IGNORE TRUE, COMPRESSION ZSTD)
-        """
+        for year, month in partitions or []:
+            # Drop the old partition first so files from an earlier, larger export can't linger
+            partition_dir = os.path.join(parquet_file_path, f"year={year}", f"month={month}")
+            if os.path.isdir(partition_dir):
+                shutil.rmtree(partition_dir)
         try:
-            db_connection.execute(export_query)
+            order_sql = _export_order_sql(db_connection, table_with_geom_name, details, spatial_sort, export_profile)
+            _copy_geoparquet(db_connection, f'SELECT * FROM "{table_with_geom_name}"', details, parquet_file_path,
+                             order_sql, bbox_covering, export_profile=export_profile)
             print(f"Exported {table_with_geom_name} to Parquet at {parquet_file_path}")
         except Exception as e:
             print(f"Error exporting {table_with_geom_name} to Parquet: {str(e)}")
+        _index_dataset(db_connection, parquet_file_path, details)
+
+def _export_months(db_connection, source_name, details, parquet_file_path, partitions=None, h3_resolution=None,
+                   spatial_sort='none', bbox_covering=False, export_profile='default'):
+    """
+    Exports source_name to GeoParquet one year/month partition at a time, replacing each
+    partition's directory. Every COPY reads, sorts and writes a single month, so peak memory
+    is set by the largest month (and spills to temp_directory past memory_limit) rather than
+    by the whole dataset. partitions defaults to every month present in source_name.
+    Returns the number of rows written.
+    """
+    if partitions is None:
+        partitions = db_connection.execute(f"""
+            SELECT DISTINCT YEAR("{details["time_col"]}"), MONTH("{details["time_col"]}") FROM "{source_name}"
+            WHERE "{details["time_col"]}" IS NOT NULL ORDER BY 1, 2
+        """).fetchall()
+    order_sql = _export_order_sql(db_connection, source_name, details, spatial_sort, export_profile)
+    written_rows = 0
+    for year, month in partitions:
+        chunk_start_time = time.time()
+        partition_dir = os.path.join(parquet_file_path, f"year={year}", f"month={month}")
+        if os.path.isdir(partition_dir):
+            shutil.rmtree(partition_dir)
+        chunk_rows = _copy_geoparquet(
+            db_connection, _geom_select_sql(source_name, details, [(year, month)], h3_resolution, bbox_covering),
+            details, parquet_file_path, order_sql, bbox_covering, export_profile=export_profile, partition=(year, month))
+        written_rows += chunk_rows
+        print(f"Exported {chunk_rows} rows of {source_name} for {year}-{month:02d} in {time.time() - chunk_start_time:.2f} seconds")
+    return written_rows
+
+def configure_memory_budget(db_connection, memory_limit=None, temp_directory=None):
+    """
+    Caps DuckDB's memory at memory_limit (e.g. '12GB') and lets it spill to temp_directory.
+    Insertion order isn't preserved (exports that need an order sort explicitly), which
+    lets DuckDB stream large inserts and COPYs instead of buffering them.
+    """
+    if memory_limit:
+        db_connection.execute(f"SET memory_limit = '{memory_limit}'")
+    if temp_directory:
+        os.makedirs(temp_directory, exist_ok=True)
+        db_connection.execute(f"SET temp_directory = '{temp_directory}'")
+    db_connection.execute("SET preserve_insertion_order = false")
+    print(f"DuckDB memory_limit: {db_connection.execute('SELECT current_setting(?)', ['memory_limit']).fetchone()[0]}, "
+          f"temp_directory: {db_connection.execute('SELECT current_setting(?)', ['temp_directory']).fetchone()[0]}")
+
+def _canonical_select_sql(db_connection, table_name, combined_name, station_keys=False):
+    """
+    Returns the SELECT mapping one monthly table of the combined_name era onto
+    CANONICAL_TRIP_COLUMNS, plus an era column ('old_schema' or 'new_schema').
+    """
+    table_columns = _table_columns(db_connection, table_name)
+    canonical_sql = EXPORT_SCHEMAS[combined_name]["canonical_sql"]
+    select_items = []
+    for column, sql_type in CANONICAL_TRIP_COLUMNS:
+        if "_station_" in column and column.endswith("_key") != station_keys:
+            continue
+        expression = canonical_sql.get(column, f'"{column}"')
+        if not set(re.findall(r'"([^"]+)"', expression)) <= table_columns:
+            expression = "NULL"
+        select_items.append(f"({expression})::{sql_type} AS {column}")
+    era = combined_name[:-len("_combined")]
+    select_items.append(f"'{era}' AS era")
+    return f'SELECT {", ".join(select_items)} FROM "{table_name}"'
+
+def export_canonical_trips(db_connection, output_parquet_dir, tables_by_schema, partitions=None, h3_resolution=None,
+                           spatial_sort='none', bbox_covering=False, export_profile='default', chunked=False):
+    """
+    Exports the trips of both eras as one dataset, <output_parquet_dir>/trips_canonical_with_geom.parquet,
+    in the CANONICAL_TRIP_COLUMNS schema, so multi-year queries are a single partition-pruned
+    scan. The eras are unioned through the trips_canonical view rather than copied into a
+    combined table. With partitions, only those year/month partitions are replaced; chunked
+    exports one month at a time (see _export_months).
+    """
+    table_names = [(table_name, combined_name) for combined_name, names in tables_by_schema.items() for table_name in names]
+    station_keys = any("start_station_key" in _table_columns(db_connection, table_name) for table_name, _ in table_names)
+    union_parts = [_canonical_select_sql(db_connection, table_name, combined_name, station_keys)
+                   for table_name, combined_name in table_names]
+    db_connection.execute(f'CREATE OR REPLACE VIEW "{CANONICAL_DATASET}" AS {" UNION ALL ".join(union_parts)}')
+    print(f"Created canonical view {CANONICAL_DATASET} over {len(union_parts)} tables")
+
+    parquet_file_path = os.path.join(output_parquet_dir, f"{CANONICAL_DATASET}_with_geom.parquet")
+    if chunked:
+        try:
+            exported_rows = _export_months(db_connection, CANONICAL_DATASET, CANONICAL_DETAILS, parquet_file_path, partitions,
+                                           h3_resolution, spatial_sort, bbox_covering, export_profile)
+            print(f"Exported {exported_rows} canonical trips to {parquet_file_path}")
+        except Exception as e:
+            print(f"Error exporting {CANONICAL_DATASET} to Parquet: {str(e)}")
+        _index_dataset(db_connection, parquet_file_path, CANONICAL_DETAILS)
+        return
+
+    for year, month in partitions or []:
+        partition_dir = os.path.join(parquet_file_path, f"year={year}", f"month={month}")
+        if os.path.isdir(partition_dir):
+            shutil.rmtree(partition_dir)
+    export_start_time = time.time()
+    try:
+        exported_rows = _copy_geoparquet(
+            db_connection,
+            _geom_select_sql(CANONICAL_DATASET, CANONICAL_DETAILS, partitions, h3_resolution, bbox_covering),
+            CANONICAL_DETAILS, parquet_file_path,
+            _export_order_sql(db_connection, CANONICAL_DATASET, CANONICAL_DETAILS, spatial_sort, export_profile),
+            bbox_covering, export_profile=export_profile)
+        print(f"Exported {exported_rows} canonical trips to {parquet_file_path} in {time.time() - export_start_time:.2f} seconds")
+    except Exception as e:
+        print(f"Error exporting {CANONICAL_DATASET} to Parquet: {str(e)}")
+    _index_dataset(db_connection, parquet_file_path, CANONICAL_DETAILS)
+
+def export_tables_per_partition(db_connection, output_parquet_dir, tables_by_schema, h3_resolution=None, spatial_sort='none',
+                                bbox_covering=False, export_profile='default'):
+    """
+    Exports each monthly table straight into the year=/month= partitions of its schema's
+    *_with_geom.parquet dataset with one streaming COPY, without building the combined
+    tables. A table's files are named after it ({table}_0.parquet, ...), so re-exporting
+    a table replaces only its own files and leaves every other table's files alone.
+    """
+    for combined_name, schema_tables in tables_by_schema.items():
+        details = EXPORT_SCHEMAS[combined_name]
+        parquet_file_path = os.path.join(output_parquet_dir, f'{combined_name}_with_geom.parquet')
+        for table_name in schema_tables:
+            export_start_time = time.time()
+            removed_files = _remove_table_partition_files(parquet_file_path, table_name)
+            try:
+                exported_rows = _copy_geoparquet(
+                    db_connection, _geom_select_sql(table_name, details, h3_resolution=h3_resolution, bbox_covering=bbox_covering),
+                    details, parquet_file_path, _export_order_sql(db_connection, table_name, details, spatial_sort, export_profile),
+                    bbox_covering, filename_stem=table_name, export_profile=export_profile)
+                print(f"Exported {exported_rows} rows of {table_name} to {parquet_file_path} "
+                      f"(replaced {removed_files} file(s)) in {time.time() - export_start_time:.2f} seconds")
+            except Exception as e:
+                print(f"Error exporting {table_name} to Parquet: {str(e)}")
+        if schema_tables:
+            _index_dataset(db_connection, parquet_file_path, details)
+
+def _remove_table_partition_files(parquet_file_path, table_name):
+    """
+    Deletes the partition files a previous per-table export wrote for table_name, plus any
+    data_*.parquet left by a combined export in the partition of the table's month.
+    Returns the number of files removed.
+    """
+    stale_files = glob.glob(os.path.join(parquet_file_path, "year=*", "month=*", f"{table_name}_*.parquet"))
+    partition = _table_partition(table_name)
+    if partition:
+        year, month = partition
+        stale_files += glob.glob(os.path.join(parquet_file_path, f"year={year}", f"month={month}", "data_*.parquet"))
+    for stale_file in stale_files:
+        os.remove(stale_file)
+    return len(stale_files)
+
+def ensure_rollup_tables(db_connection, rollup_names):
+    """
+    Creates the given rollup tables if they don't exist yet.
+    """
+    for rollup_name in rollup_names:
+        dimension_columns = "".join(f"{dimension} {sql_type},\n            "
+                                    for dimension, sql_type in ROLLUPS[rollup_name]["dimensions"].items())
+        db_connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS "{rollup_name}" (
+            year INTEGER,
+            month INTEGER,
+            period_start TIMESTAMP,
+            {dimension_columns}rider_type VARCHAR,
+            trip_count BIGINT,
+            total_duration_s DOUBLE,
+            avg_duration_s DOUBLE,
+            median_duration_s DOUBLE,
+            p90_duration_s DOUBLE
+        )
+        """)
+
+def _rollup_dimension_sql(db_connection, table_name, details, dimension, h3_resolution=None):
+    """
+    Returns the expression for a rollup dimension over table_name. start_station/end_station
+    are the station key when the table has been keyed by the station dimension and the
+    station id otherwise; start_h3 is the start point's cell at h3_resolution.
+    """
+    if dimension == "start_h3":
+        return f'h3_latlng_to_cell("{details["start_lat_col"]}", "{details["start_lng_col"]}", {h3_resolution})'
+    end = dimension.split("_")[0]
+    if f"{end}_station_key" in _table_columns(db_connection, table_name):
+        return f'"{end}_station_key"::VARCHAR'
+    return f'"{end}_station_id"::VARCHAR'
+
+def build_rollups(db_connection, tables=None, h3_resolution=None):
+    """
+    Recomputes the rollups for every month of the given monthly tables (all of them if None)
+    from all trip tables of that month, replacing the month's previous rollup rows, so an
+    incremental run only re-aggregates new or reloaded months. Trips count in the month they
+    start in; duration stats skip trips that end before they start. rollup_h3_hour is only
+    built with an h3_resolution and the h3 extension.
+    Returns (rollup names, sorted list of rebuilt (year, month) partitions).
+    """
+    if h3_resolution is not None and _load_h3_extension(db_connection):
+        rollup_names = list(ROLLUPS)
+    else:
+        rollup_names = [name for name, rollup in ROLLUPS.items() if not rollup.get("needs_h3")]
+    ensure_rollup_tables(db_connection, rollup_names)
+
+    selected_tables = [name for names in list_trip_tables(db_connection, tables).values() for name in names]
+    partitions = sorted({_table_partition(name) for name in selected_tables} - {None})
+    month_tables = {}
+    for combined_name, table_names in list_trip_tables(db_connection).items():
+        for table_name in table_names:
+            if _table_partition(table_name) in partitions:
+                month_tables.setdefault(_table_partition(table_name), []).append((table_name, EXPORT_SCHEMAS[combined_name]))
+
+    for year, month in partitions:
+        rollup_start_time = time.time()
+        for rollup_name in rollup_names:
+            rollup = ROLLUPS[rollup_name]
+            dimensions = list(rollup["dimensions"])
+            union_parts = []
+            for table_name, details in month_tables[(year, month)]:
+                dimension_sql = ", ".join(
+                    f"{_rollup_dimension_sql(db_connection, table_name, details, dimension, h3_resolution)} AS {dimension}"
+                    for dimension in dimensions)
+                coordinate_filter = ""
+                if rollup.get("needs_h3"):
+                    coordinate_filter = f"""AND "{details["start_lat_col"]}" IS NOT NULL AND "{details["start_lng_col"]}" IS NOT NULL"""
+                union_parts.append(f"""
+                SELECT date_trunc('{rollup["time_grain"]}', "{details["time_col"]}") AS period_start, {dimension_sql},
+                       {details["rider_type_sql"]} AS rider_type,
+                       epoch("{details["end_time_col"]}" - "{details["time_col"]}") AS duration_s
+                FROM "{table_name}"
+                WHERE "{details["time_col"]}" IS NOT NULL {coordinate_filter}
+                {_partition_filter_sql(details["time_col"], [(year, month)])}
+                """)
+            group_columns = ", ".join(["period_start"] + dimensions + ["rider_type"])
+            try:
+                db_connection.execute(f'DELETE FROM "{rollup_name}" WHERE year = {year} AND month = {month}')
+                with metrics.span('rollup', f"{rollup_name} {year}-{month:02d}") as rollup_span:
+                    rollup_span['rows'] = db_connection.execute(f"""
+                    INSERT INTO "{rollup_name}" BY NAME
+                    SELECT {year} AS year, {month} AS month, {group_columns},
+                           COUNT(*) AS trip_count,
+                           SUM(duration_s) FILTER (WHERE duration_s >= 0) AS total_duration_s,
+                           AVG(duration_s) FILTER (WHERE duration_s >= 0) AS avg_duration_s,
+                           MEDIAN(duration_s) FILTER (WHERE duration_s >= 0) AS median_duration_s,
+                           quantile_cont(duration_s, 0.9) FILTER (WHERE duration_s >= 0) AS p90_duration_s
+                    FROM ({" UNION ALL ".join(union_parts)})
+                    GROUP BY {group_columns}
+                    """).fetchone()[0]
+                    metrics.record_duckdb_profile(db_connection)
+            except Exception as e:
+                print(f"Error building {rollup_name} for {year}-{month:02d}: {str(e)}")
+        print(f"Built rollups for {year}-{month:02d} in {time.time() - rollup_start_time:.2f} seconds")
+    return rollup_names, partitions
+
+def export_rollups(db_connection, output_parquet_dir, rollup_names, partitions):
+    """
+    Writes the given (year, month) partitions of each rollup to
+    <output_parquet_dir>/<rollup>.parquet/year=/month=, replacing only those partitions.
+    """
+    if not partitions:
+        print("No rollup partitions to export.")
+        return
+    partition_list = ", ".join(f"({year}, {month})" for year, month in partitions)
+    for rollup_name in rollup_names:
+        parquet_file_path = os.path.join(output_parquet_dir, f"{rollup_name}.parquet")
+        for year, month in partitions:
+            partition_dir = os.path.join(parquet_file_path, f"year={year}", f"month={month}")
+            if os.path.isdir(partition_dir):
+                shutil.rmtree(partition_dir)
+        order_columns = ", ".join(["year", "month", "period_start"] + list(ROLLUPS[rollup_name]["dimensions"]))
+        try:
+            with metrics.span('export', os.path.basename(parquet_file_path)) as export_span:
+                export_span['rows'] = db_connection.execute(f"""
+                COPY (
+                    SELECT * FROM "{rollup_name}" WHERE (year, month) IN ({partition_list}) ORDER BY {order_columns}
+                ) TO '{parquet_file_path}'
+                (FORMAT PARQUET, PARTITION_BY (year, month), OVERWRITE_OR_IGNORE TRUE, COMPRESSION ZSTD)
+                """).fetchone()[0]
+                metrics.record_duckdb_profile(db_connection)
+            print(f"Exported {export_span['rows']} rows of {rollup_name} to {parquet_file_path}")
+        except Exception as e:
+            print(f"Error exporting {rollup_name} to Parquet: {str(e)}")
 
 # Example usage
 if __name__ == "__main__":
@@ -417,6 +1692,45 @@ if __name__ == "__main__":
     parser.add_argument('--temp-dir', type=str, default="temp_citibike_data", help='Temp directory for downloads')
     parser.add_argument('--db-file', type=str, default="citibike_data.db", help='DuckDB database file')
     parser.add_argument('--output-dir', type=str, default="final_parquet_output", help='Output directory for Parquet files')
+    parser.add_argument('--download-workers', type=int, default=1, help='Number of archives to download concurrently')
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument('--pipeline', action='store_true', help='Overlap download, extraction and loading in separate stages')
+    mode_group.add_argument('--incremental', action='store_true', help='Keep the database and output; only load and re-export new or changed months')
+    mode_group.add_argument('--stream-zip', action='store_true', help='Load CSVs straight from the downloaded zips without extracting them')
+    parser.add_argument('--cache-dir', type=str, default=None, help='Persistent archive cache directory (kept between runs)')
+    parser.add_argument('--cache-max-gb', type=float, default=None, help='Size cap for the archive cache; least recently used archives are evicted')
+    export_group = parser.add_mutually_exclusive_group()
+    export_group.add_argument('--per-table-export', action='store_true', help='Export each monthly table straight to its Parquet partition instead of building combined tables')
+    parser.add_argument('--ingest-workers', type=int, default=1, help='Number of processes transforming CSVs in parallel (1 loads in-process)')
+    parser.add_argument('--worker-threads', type=int, default=None, help='DuckDB threads per ingest worker')
+    parser.add_argument('--worker-memory-limit', type=str, default=None, help="DuckDB memory_limit per ingest worker, e.g. '2GB'")
+    parser.add_argument('--storage-profile', choices=sorted(STORAGE_PROFILES), default='standard',
+                        help='Column types for the trip tables and Parquet output; compact uses ENUMs, small integers and FLOAT coordinates')
+    parser.add_argument('--station-dimension', action='store_true',
+                        help='Build a stations dimension and store station keys instead of ids/names in trip tables and Parquet')
+    parser.add_argument('--h3-resolution', type=int, default=None, choices=range(0, 16), metavar='{0..15}',
+                        help='Add start_h3/end_h3 cell columns at this resolution to the Parquet output (h3 extension)')
+    parser.add_argument('--spatial-sort', choices=SPATIAL_SORT_OPTIONS, default='none',
+                        help='Order rows within each year/month partition by a Hilbert curve or H3 cell of the start point')
+    parser.add_argument('--bbox-covering', action='store_true',
+                        help='Add start_bbox/end_bbox columns declared as GeoParquet 1.1 bbox coverings')
+    parser.add_argument('--export-profile', choices=sorted(EXPORT_PROFILES), default='default',
+                        help="'remote' sorts each partition by start time and sizes row groups and bloom filters for range reads; 'remote-station' sorts by start station first")
+    parser.add_argument('--rollups', action='store_true',
+                        help='Build and export station x hour, station pair x day and (with --h3-resolution) H3 x hour trip counts per month')
+    export_group.add_argument('--canonical-export', action='store_true',
+                              help='Write both schema eras to one trips_canonical_with_geom.parquet dataset with a single cross-era schema')
+    parser.add_argument('--memory-limit', type=str, default=None,
+                        help="DuckDB memory_limit for the main connection, e.g. '12GB'; also exports one month at a time")
+    parser.add_argument('--spill-dir', type=str, default=None,
+                        help='Directory DuckDB spills to when it exceeds its memory limit; also exports one month at a time')
+    parser.add_argument('--metrics-jsonl', type=str, default=None,
+                        help='Append a JSON line per timed span (download, extract, csv_load, export, ...) to this file')
+    parser.add_argument('--metrics-prometheus', type=str, default=None,
+                        help='Write per-stage totals in Prometheus text format to this file at the end of the run')
+    parser.add_argument('--duckdb-profiling', action='store_true',
+                        help='Attach DuckDB query profiles (latency, CPU, rows scanned, bytes, peak memory) to the spans')
+    parser.add_argument('--queue-size', type=int, default=2, help='Max archives/CSVs waiting between pipeline stages')
     
     args = parser.parse_args()
     
@@ -427,14 +1741,40 @@ if __name__ == "__main__":
     TEMP_DOWNLOAD_DIR = args.temp_dir
     DB_FILE = args.db_file
     PARQUET_OUTPUT_DIR = args.output_dir
+    DOWNLOAD_WORKERS = args.download_workers
+    USE_PIPELINE = args.pipeline
+    STREAM_ZIP = args.stream_zip
+    INCREMENTAL = args.incremental
+    PER_TABLE_EXPORT = args.per_table_export
+    INGEST_WORKERS = args.ingest_workers
+    WORKER_THREADS = args.worker_threads
+    WORKER_MEMORY_LIMIT = args.worker_memory_limit
+    STORAGE_PROFILE = args.storage_profile
+    STATION_DIMENSION = args.station_dimension
+    H3_RESOLUTION = args.h3_resolution
+    SPATIAL_SORT = args.spatial_sort
+    BBOX_COVERING = args.bbox_covering
+    EXPORT_PROFILE = args.export_profile
+    ROLLUPS_ENABLED = args.rollups
+    CANONICAL_EXPORT = args.canonical_export
+    MEMORY_LIMIT = args.memory_limit
+    SPILL_DIR = args.spill_dir
+    METRICS_JSONL = args.metrics_jsonl
+    METRICS_PROMETHEUS = args.metrics_prometheus
+    DUCKDB_PROFILING = args.duckdb_profiling
+    CACHE_DIR = args.cache_dir
+    CACHE_MAX_BYTES = int(args.cache_max_gb * 1024 ** 3) if args.cache_max_gb else None
+    QUEUE_SIZE = args.queue_size
     
     # Clean up existing files/directories
     if os.path.exists(TEMP_DOWNLOAD_DIR):
         shutil.rmtree(TEMP_DOWNLOAD_DIR)
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
-    if os.path.exists(PARQUET_OUTPUT_DIR):
-        shutil.rmtree(PARQUET_OUTPUT_DIR)
+    # Incremental runs keep the database (and its manifest) and the exported partitions
+    if not INCREMENTAL:
+        if os.path.exists(DB_FILE):
+            os.remove(DB_FILE)
+        if os.path.exists(PARQUET_OUTPUT_DIR):
+            shutil.rmtree(PARQUET_OUTPUT_DIR)
     
     os.makedirs(TEMP_DOWNLOAD_DIR, exist_ok=True)
     os.makedirs(PARQUET_OUTPUT_DIR, exist_ok=True)
@@ -443,6 +1783,13 @@ if __name__ == "__main__":
     db_con = duckdb.connect(database=DB_FILE, read_only=False)
     print(f"DuckDB connection established to {DB_FILE}.")
     print(f"DuckDB version: {db_con.execute('SELECT version()').fetchone()[0]}")
+    # Any memory budget option bounds the export too: one month at a time instead of whole combined tables
+    MEMORY_BUDGET = MEMORY_LIMIT is not None or SPILL_DIR is not None
+    if MEMORY_BUDGET:
+        configure_memory_budget(db_con, MEMORY_LIMIT, SPILL_DIR)
+    metrics.configure(METRICS_JSONL, METRICS_PROMETHEUS)
+    if DUCKDB_PROFILING:
+        metrics.enable_duckdb_profiling(db_con)
     
     try:
         # Generate file list
@@ -453,25 +1800,63 @@ if __name__ == "__main__":
         # Download, extract, and process files
         print("\nStarting download, extraction, and processing...")
         processed_count = 0
+        changed_tables = None
         
-        for csv_file_path in download_and_extract_files_generator(files_to_download, TEMP_DOWNLOAD_DIR):
-            print(f"\nProcessing extracted CSV: {csv_file_path}")
-            process_csv_to_duckdb(csv_file_path, db_con)
-            processed_count += 1
-            
-            # Optionally delete the CSV after processing to save space
-            try:
-                os.remove(csv_file_path)
-                print(f"Deleted processed CSV: {csv_file_path}")
-            except Exception as e:
-                print(f"Error deleting CSV {csv_file_path}: {str(e)}")
+        if INCREMENTAL:
+            changed_tables = incremental_ingest(files_to_download, TEMP_DOWNLOAD_DIR, db_con, CACHE_DIR, CACHE_MAX_BYTES,
+                                                STORAGE_PROFILE)
+            processed_count = len(changed_tables)
+            print(f"\nNew or changed monthly tables: {sorted(changed_tables)}")
+        elif STREAM_ZIP:
+            for member_name, csv_stream in download_and_stream_csvs_generator(
+                    files_to_download, TEMP_DOWNLOAD_DIR, DOWNLOAD_WORKERS, CACHE_DIR, CACHE_MAX_BYTES):
+                print(f"\nProcessing streamed CSV: {member_name}")
+                process_csv_to_duckdb(member_name, db_con, csv_stream=csv_stream, storage_profile=STORAGE_PROFILE)
+                processed_count += 1
+        else:
+            if USE_PIPELINE:
+                csv_generator = pipelined_csv_generator(
+                    files_to_download, TEMP_DOWNLOAD_DIR, DOWNLOAD_WORKERS, QUEUE_SIZE, CACHE_DIR, CACHE_MAX_BYTES)
+            else:
+                csv_generator = download_and_extract_files_generator(
+                    files_to_download, TEMP_DOWNLOAD_DIR, DOWNLOAD_WORKERS, CACHE_DIR, CACHE_MAX_BYTES)
+
+            if INGEST_WORKERS > 1:
+                processed_count = parallel_ingest(csv_generator, db_con, os.path.join(TEMP_DOWNLOAD_DIR, "staging"),
+                                                  INGEST_WORKERS, WORKER_THREADS, WORKER_MEMORY_LIMIT, STORAGE_PROFILE)
+            else:
+                for csv_file_path in csv_generator:
+                    print(f"\nProcessing extracted CSV: {csv_file_path}")
+                    process_csv_to_duckdb(csv_file_path, db_con, storage_profile=STORAGE_PROFILE)
+                    processed_count += 1
+
+                    # Optionally delete the CSV after processing to save space
+                    try:
+                        os.remove(csv_file_path)
+                        print(f"Deleted processed CSV: {csv_file_path}")
+                    except Exception as e:
+                        print(f"Error deleting CSV {csv_file_path}: {str(e)}")
         
         print(f"\nFinished processing {processed_count} CSV files")
         
         # Convert to Parquet if any files were processed
+        if STATION_DIMENSION:
+            print("\nBuilding station dimension...")
+            build_station_dimension(db_con, changed_tables)
+
         if processed_count > 0:
             print("\nStarting Parquet conversion...")
-            convert_parquet(db_con, PARQUET_OUTPUT_DIR)
+            convert_parquet(db_con, PARQUET_OUTPUT_DIR, tables=changed_tables, per_table=PER_TABLE_EXPORT,
+                            h3_resolution=H3_RESOLUTION, spatial_sort=SPATIAL_SORT, bbox_covering=BBOX_COVERING,
+                            export_profile=EXPORT_PROFILE, canonical=CANONICAL_EXPORT,
+                            chunked=MEMORY_BUDGET)
+            if STATION_DIMENSION:
+                export_station_dimension(db_con, PARQUET_OUTPUT_DIR)
+            if ROLLUPS_ENABLED:
+                print("\nBuilding rollups...")
+                rollup_names, rollup_partitions = build_rollups(db_con, changed_tables, H3_RESOLUTION)
+                export_rollups(db_con, PARQUET_OUTPUT_DIR, rollup_names, rollup_partitions)
+            export_quality_report(db_con, PARQUET_OUTPUT_DIR)
             print("Parquet conversion complete")
         else:
             print("No CSVs were processed, skipping Parquet conversion.")
@@ -484,4 +1869,7 @@ if __name__ == "__main__":
         if 'db_con' in locals() and db_con:
             db_con.close()
             print("DuckDB connection closed")
+        if METRICS_JSONL or METRICS_PROMETHEUS or DUCKDB_PROFILING:
+            metrics.print_summary()
+            metrics.write_prometheus()
         print("Script execution finished.") 
\ No newline at end of file
@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import itertools
+
+# Finished spans, in completion order
+_spans = []
+_span_ids = itertools.count(1)
+# Serialises span bookkeeping and JSON-lines writes across download/pipeline threads
+_metrics_lock = threading.Lock()
+# Stack of open spans per thread, so nested spans know their parent
+_local = threading.local()
+_settings = {'jsonl_path': None, 'prometheus_path': None, 'duckdb_profiling': False}
+
+# DuckDB profiling metrics kept per span; peaks are maxed, everything else is summed
+DUCKDB_SUM_METRICS = ('latency', 'cpu_time', 'cumulative_rows_scanned', 'total_bytes_read', 'total_bytes_written')
+DUCKDB_MAX_METRICS = ('system_peak_buffer_memory', 'system_peak_temp_dir_size')
+PROMETHEUS_PREFIX = "citibike_etl"
+
+def configure(jsonl_path=None, prometheus_path=None):
+    """
+    Sets where spans are written: each finished span is appended to jsonl_path as one JSON
+    line, and write_prometheus() renders per-kind totals to prometheus_path.
+    """
+    _settings['jsonl_path'] = jsonl_path
+    _settings['prometheus_path'] = prometheus_path
+    if jsonl_path:
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+
+def enable_duckdb_profiling(db_connection):
+    """
+    Turns on DuckDB query profiling (without printing it) so record_duckdb_profile can attach
+    each query's latency, CPU time, rows scanned, bytes and peak memory to the open span.
+    """
+    try:
+        db_connection.execute("SET enable_profiling = 'no_output'")
+        db_connection.execute("SET profiling_mode = 'standard'")
+        _settings['duckdb_profiling'] = True
+    except Exception as e:
+        print(f"Error enabling DuckDB profiling: {str(e)}")
+
+def _open_spans():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+def current_span():
+    """
+    Returns the innermost open span of this thread, or None.
+    """
+    stack = _open_spans()
+    return stack[-1] if stack else None
+
+@contextlib.contextmanager
+def span(kind, name, **attributes):
+    """
+    Times a unit of work (kind is 'download', 'extract', 'csv_load', 'export', ...) and yields
+    its record, a dict the caller can fill in with 'rows' and 'bytes'. The span is recorded
+    when the block exits, with an 'error' if it raised.
+    """
+    stack = _open_spans()
+    record = {
+        'id': next(_span_ids),
+        'parent': stack[-1]['id'] if stack else None,
+        'kind': kind,
+        'name': name,
+        'start': time.time(),
+        'rows': None,
+        'bytes': None,
+    }
+    record.update(attributes)
+    stack.append(record)
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = str(e)
+        raise
+    finally:
+        stack.pop()
+        record['end'] = time.time()
+        record['seconds'] = record['end'] - record['start']
+        _finish_span(record)
+
+def _finish_span(record):
+    with _metrics_lock:
+        _spans.append(record)
+        if _settings['jsonl_path']:
+            with open(_settings['jsonl_path'], 'a') as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+def record_duckdb_profile(db_connection, record=None):
+    """
+    Adds the profile of the last query run on db_connection to record (the current span by
+    default). Does nothing unless enable_duckdb_profiling was called.
+    """
+    record = record or current_span()
+    if record is None or not _settings['duckdb_profiling']:
+        return
+    try:
+        profile = json.loads(db_connection.get_profiling_information(format='json'))
+    except Exception:
+        # Older DuckDB releases have no get_profiling_information
+        return
+    duckdb_metrics = record.setdefault('duckdb', {'queries': 0})
+    duckdb_metrics['queries'] += 1
+    for metric in DUCKDB_SUM_METRICS:
+        if metric in profile:
+            duckdb_metrics[metric] = duckdb_metrics.get(metric, 0) + profile[metric]
+    for metric in DUCKDB_MAX_METRICS:
+        if metric in profile:
+            duckdb_metrics[metric] = max(duckdb_metrics.get(metric, 0), profile[metric])
+
+def summarize():
+    """
+    Returns per-kind totals of the finished spans: {kind: {'count', 'seconds', 'max_seconds',
+    'rows', 'bytes', 'errors'}}.
+    """
+    with _metrics_lock:
+        spans = list(_spans)
+    totals = {}
+    for record in spans:
+        kind_totals = totals.setdefault(record['kind'], {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                         'rows': 0, 'bytes': 0, 'errors': 0})
+        kind_totals['count'] += 1
+        kind_totals['seconds'] += record['seconds']
+        kind_totals['max_seconds'] = max(kind_totals['max_seconds'], record['seconds'])
+        kind_totals['rows'] += record['rows'] or 0
+        kind_totals['bytes'] += record['bytes'] or 0
+        kind_totals['errors'] += 1 if record.get('error') else 0
+    return totals
+
+def print_summary(slowest=5):
+    """
+    Prints a table of time, rows and bytes per span kind, followed by the slowest spans.
+    Kinds can nest (a csv_load inside an archive), so their times don't add up to wall time.
+    """
+    totals = summarize()
+    if not totals:
+        return
+    with _metrics_lock:
+        spans = list(_spans)
+    wall_seconds = max(record['end'] for record in spans) - min(record['start'] for record in spans)
+    print(f"\n{'stage':<12}{'spans':>7}{'seconds':>10}{'% wall':>8}{'max s':>9}{'rows':>13}{'MB':>10}{'rows/s':>12}{'MB/s':>9}{'errors':>8}")
+    for kind, kind_totals in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        seconds = kind_totals['seconds']
+        megabytes = kind_totals['bytes'] / (1024 * 1024)
+        rows_per_second = f"{kind_totals['rows'] / seconds:.0f}" if seconds > 0 and kind_totals['rows'] else "-"
+        mb_per_second = f"{megabytes / seconds:.1f}" if seconds > 0 and kind_totals['bytes'] else "-"
+        wall_share = 100 * seconds / wall_seconds if wall_seconds > 0 else 0
+        print(f"{kind:<12}{kind_totals['count']:>7}{seconds:>10.2f}{wall_share:>8.1f}{kind_totals['max_seconds']:>9.2f}"
+              f"{kind_totals['rows']:>13}{megabytes:>10.1f}{rows_per_second:>12}{mb_per_second:>9}{kind_totals['errors']:>8}")
+    print(f"Wall time covered by spans: {wall_seconds:.2f} seconds")
+    print("\nSlowest spans:")
+    for record in sorted(spans, key=lambda record: -record['seconds'])[:slowest]:
+        print(f"  {record['seconds']:>9.2f}s  {record['kind']:<10} {record['name']}")
+
+def _prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def write_prometheus(path=None):
+    """
+    Writes per-kind span totals in the Prometheus text exposition format (e.g. for the
+    node_exporter textfile collector) to path, or to the configured prometheus_path.
+    """
+    path = path or _settings['prometheus_path']
+    if not path:
+        return
+    metric_values = [
+        ('span_seconds_total', 'counter', 'Total seconds spent in spans of this kind', 'seconds'),
+        ('span_seconds_max', 'gauge', 'Longest single span of this kind in seconds', 'max_seconds'),
+        ('spans_total', 'counter', 'Number of finished spans of this kind', 'count'),
+        ('rows_total', 'counter', 'Rows processed by spans of this kind', 'rows'),
+        ('bytes_total', 'counter', 'Bytes processed by spans of this kind', 'bytes'),
+        ('span_errors_total', 'counter', 'Spans of this kind that raised', 'errors'),
+    ]
+    totals = summarize()
+    lines = []
+    for metric_name, metric_type, help_text, key in metric_values:
+        lines.append(f"# HELP {PROMETHEUS_PREFIX}_{metric_name} {help_text}")
+        lines.append(f"# TYPE {PROMETHEUS_PREFIX}_{metric_name} {metric_type}")
+        for kind, kind_totals in sorted(totals.items()):
+            lines.append(f'{PROMETHEUS_PREFIX}_{metric_name}{{kind="{_prometheus_label(kind)}"}} {kind_totals[key]}')
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(temp_path, path)
+    print(f"Wrote Prometheus metrics to {path}")
@@ -0,0 +1,387 @@
+import os
+import glob
+import json
+import time
+import queue
+import argparse
+import datetime
+import threading
+import collections
+import http.server
+from urllib.parse import urlparse, parse_qs
+
+import duckdb
+
+from dataset_index import select_indexed_files, station_id_sql
+from export_schemas import CANONICAL_DATASET, CANONICAL_DETAILS, EXPORT_SCHEMAS, STATIONS_TABLE
+
+# Columns every endpoint returns, whatever the schema era of the partition they come from
+TRIP_COLUMNS = ("started_at", "ended_at", "start_station_id", "end_station_id",
+                "start_lat", "start_lng", "end_lat", "end_lng", "member_casual")
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 100000
+# Trip datasets the service reads, by directory name. A --canonical-export run holds both eras
+# in one dataset, so when it is present the per-era datasets next to it are not read.
+ERA_DATASETS = {f"{schema_name}_with_geom.parquet": details for schema_name, details in EXPORT_SCHEMAS.items()}
+CANONICAL_DATASETS = {f"{CANONICAL_DATASET}_with_geom.parquet": CANONICAL_DETAILS}
+
+class QueryError(ValueError):
+    """
+    A request the service can't answer (missing or malformed parameter); reported as HTTP 400.
+    """
+
+class ConnectionPool:
+    """
+    Fixed set of in-memory DuckDB connections handed out one request at a time. The service
+    only runs its own parameterised SELECTs over Parquet on them, and their configuration is
+    locked once threads and memory are set.
+    """
+    def __init__(self, size, threads_per_connection=None, memory_limit=None):
+        self._connections = queue.Queue()
+        for _ in range(size):
+            db_connection = duckdb.connect()
+            if threads_per_connection:
+                db_connection.execute(f"SET threads = {int(threads_per_connection)}")
+            if memory_limit:
+                db_connection.execute(f"SET memory_limit = '{memory_limit}'")
+            db_connection.execute("SET lock_configuration = true")
+            self._connections.put(db_connection)
+
+    def execute(self, sql, parameters):
+        db_connection = self._connections.get()
+        try:
+            result = db_connection.execute(sql, parameters)
+            return [column[0] for column in result.description], result.fetchall()
+        finally:
+            self._connections.put(db_connection)
+
+class LRUCache:
+    """
+    Thread-safe least-recently-used cache of query results.
+    """
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+def parse_time(value, name):
+    """
+    Parses an ISO date or timestamp query parameter ('2024-01-31' or '2024-01-31T08:00').
+    """
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise QueryError(f"'{name}' must be an ISO date or timestamp, got {value!r}")
+
+def _parse_float(params, name):
+    try:
+        return float(params[name])
+    except KeyError:
+        raise QueryError(f"missing parameter '{name}'")
+    except ValueError:
+        raise QueryError(f"'{name}' must be a number, got {params[name]!r}")
+
+def months_between(start_time, end_time):
+    """
+    Returns the (year, month) partitions overlapping [start_time, end_time).
+    """
+    months = []
+    year, month = start_time.year, start_time.month
+    last_month = (end_time.year, end_time.month)
+    if end_time == datetime.datetime(end_time.year, end_time.month, 1):
+        # The window ends where that month begins
+        last_month = (end_time.year - 1, 12) if end_time.month == 1 else (end_time.year, end_time.month - 1)
+    while (year, month) <= last_month:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+def trip_datasets(data_dir):
+    """
+    Returns {dataset directory name: column roles} of the trip datasets to read in data_dir.
+    """
+    if any(os.path.isdir(os.path.join(data_dir, dataset_name)) for dataset_name in CANONICAL_DATASETS):
+        return CANONICAL_DATASETS
+    return ERA_DATASETS
+
+def partition_files(data_dir, start_time, end_time):
+    """
+    Prunes the exported trip datasets to the files that can hold trips in the date range,
+    from the dataset's _index.json (per-file min/max time) when it has one, otherwise from
+    the year=/month= partitions. An index listing a file that is gone (a partition removed
+    since it was written) is ignored in favour of the partitions. Returns {dataset name:
+    [parquet files]} for the datasets that have data in the range.
+    """
+    files_by_dataset = {}
+    for dataset_name in trip_datasets(data_dir):
+        dataset_dir = os.path.join(data_dir, dataset_name)
+        files = select_indexed_files(dataset_dir, start_time, end_time)
+        if files is not None and not all(os.path.exists(path) for path in files):
+            files = None
+        if files is None:
+            files = []
+            for year, month in months_between(start_time, end_time):
+                files.extend(sorted(glob.glob(os.path.join(dataset_dir, f"year={year}", f"month={month}", "*.parquet"))))
+        if files:
+            files_by_dataset[dataset_name] = files
+    return files_by_dataset
+
+def _files_version(paths):
+    """
+    Size and mtime of every file a query reads, so a cached result is dropped once the
+    partitions behind it are re-exported. Returns None if a file has disappeared, so the
+    query isn't cached.
+    """
+    version = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version.append((path, stat.st_size, stat.st_mtime_ns))
+    return tuple(version)
+
+def _sql_file_list(paths):
+    return ", ".join("'" + path.replace("'", "''") + "'" for path in paths)
+
+def _trips_sql(files_by_dataset, columns_by_dataset, stations_path):
+    """
+    UNION ALL of the pruned partitions of each dataset, mapped onto TRIP_COLUMNS and
+    restricted to $start_time <= start < $end_time so row groups outside the window are skipped.
+    Datasets keyed by station_key are joined to the station dimension at stations_path.
+    """
+    datasets = dict(ERA_DATASETS, **CANONICAL_DATASETS)
+    selects = []
+    for dataset_name, files in files_by_dataset.items():
+        details = datasets[dataset_name]
+        columns = columns_by_dataset[dataset_name]
+        station_joins = ""
+        if {"start_station_key", "end_station_key"} & columns:
+            if not os.path.exists(stations_path):
+                raise RuntimeError(f"{dataset_name} references stations by key but {stations_path} is missing")
+            station_joins = "".join(f"""
+            LEFT JOIN read_parquet('{stations_path.replace("'", "''")}') {end}_station ON {end}_station.station_key = t.{end}_station_key"""
+                                    for end in ("start", "end") if f"{end}_station_key" in columns)
+        selects.append(f"""
+            SELECT t."{details['time_col']}" AS started_at, t."{details['end_time_col']}" AS ended_at,
+                   {station_id_sql('start', columns)} AS start_station_id, {station_id_sql('end', columns)} AS end_station_id,
+                   t."{details['start_lat_col']}" AS start_lat, t."{details['start_lng_col']}" AS start_lng,
+                   t."{details['end_lat_col']}" AS end_lat, t."{details['end_lng_col']}" AS end_lng,
+                   {details['rider_type_sql']} AS member_casual
+            FROM read_parquet([{_sql_file_list(files)}], hive_partitioning = true, union_by_name = true) t{station_joins}
+            WHERE t."{details['time_col']}" >= $start_time AND t."{details['time_col']}" < $end_time
+        """)
+    return " UNION ALL ".join(selects)
+
+def _limit(params):
+    try:
+        limit = int(params.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        raise QueryError(f"'limit' must be an integer, got {params['limit']!r}")
+    return max(1, min(limit, MAX_LIMIT))
+
+def trips_query(params):
+    """
+    /trips?station=<id>&start=<time>&end=<time>[&role=start|end|any][&limit=N]
+    Trips starting and/or ending at a station in the time window.
+    """
+    if 'station' not in params:
+        raise QueryError("missing parameter 'station'")
+    role = params.get('role', 'any')
+    station_filters = {
+        'start': "start_station_id = $station",
+        'end': "end_station_id = $station",
+        'any': "(start_station_id = $station OR end_station_id = $station)",
+    }
+    if role not in station_filters:
+        raise QueryError(f"'role' must be one of {', '.join(station_filters)}, got {role!r}")
+    return (f"SELECT * FROM ({{trips}}) WHERE {station_filters[role]} ORDER BY started_at LIMIT {_limit(params)}",
+            {'station': params['station'], 'role': role, 'limit': _limit(params)})
+
+def od_query(params):
+    """
+    /od?start=<time>&end=<time>[&limit=N]
+    Trip counts per (start station, end station) pair, busiest first.
+    """
+    return (f"""
+        SELECT start_station_id, end_station_id, count(*) AS trips
+        FROM ({{trips}})
+        GROUP BY ALL
+        ORDER BY trips DESC, start_station_id, end_station_id
+        LIMIT {_limit(params)}
+    """, {'limit': _limit(params)})
+
+def bbox_query(params):
+    """
+    /bbox?min_lng=..&min_lat=..&max_lng=..&max_lat=..&start=<time>&end=<time>[&limit=N]
+    Trips starting inside the bounding box. Coordinates are filtered directly so the
+    lat/lng min/max statistics of each row group prune the scan.
+    """
+    bounds = {name: _parse_float(params, name) for name in ('min_lng', 'min_lat', 'max_lng', 'max_lat')}
+    return (f"""
+        SELECT * FROM ({{trips}})
+        WHERE start_lng BETWEEN $min_lng AND $max_lng AND start_lat BETWEEN $min_lat AND $max_lat
+        ORDER BY started_at
+        LIMIT {_limit(params)}
+    """, dict(bounds, limit=_limit(params)))
+
+# Endpoint path -> function returning (SQL with a {trips} placeholder, normalised parameters)
+ENDPOINTS = {
+    "/trips": trips_query,
+    "/od": od_query,
+    "/bbox": bbox_query,
+}
+
+class QueryService:
+    """
+    Answers endpoint requests over the exported *_with_geom.parquet trees in data_dir,
+    reading only the partitions of the requested date range and caching results by the
+    normalised query.
+    """
+    def __init__(self, data_dir, pool_size=4, cache_entries=256, threads_per_connection=None, memory_limit=None):
+        self.data_dir = data_dir
+        self.pool = ConnectionPool(pool_size, threads_per_connection, memory_limit)
+        self.cache = LRUCache(cache_entries)
+        # (path, size, mtime) -> column names, so each file's schema is read once
+        self._file_columns = {}
+
+    def _read_columns(self, paths):
+        _, rows = self.pool.execute(f"SELECT DISTINCT file_name, name FROM parquet_schema([{_sql_file_list(paths)}])", {})
+        columns_by_path = {path: set() for path in paths}
+        for file_name, name in rows:
+            columns_by_path.setdefault(file_name, set()).add(name)
+        return columns_by_path
+
+    def _columns(self, files):
+        """
+        Returns the union of the column names of files, reading only the schemas of files
+        not seen at their current size and mtime.
+        """
+        versions = _files_version(files)
+        if versions is None:
+            return set().union(*self._read_columns(files).values())
+        unseen = {version[0]: version for version in versions if version not in self._file_columns}
+        if unseen:
+            columns_by_path = self._read_columns(list(unseen))
+            for path, version in unseen.items():
+                self._file_columns[version] = columns_by_path[path]
+        return set().union(*(self._file_columns[version] for version in versions))
+
+    def query(self, path, params):
+        """
+        Runs the endpoint at path with the request parameters (a dict of strings). Returns a
+        dict with the result columns, rows, the number of files read and whether it was cached.
+        """
+        if path not in ENDPOINTS:
+            raise QueryError(f"unknown endpoint {path!r}; available: {', '.join(ENDPOINTS)}")
+        if 'start' not in params or 'end' not in params:
+            raise QueryError("'start' and 'end' are required to choose the partitions to read")
+        start_time = parse_time(params['start'], 'start')
+        end_time = parse_time(params['end'], 'end')
+        if end_time <= start_time:
+            raise QueryError("'end' must be after 'start'")
+
+        sql_template, query_params = ENDPOINTS[path](params)
+        query_params.update({'start_time': start_time, 'end_time': end_time})
+        files_by_dataset = partition_files(self.data_dir, start_time, end_time)
+        stations_path = os.path.join(self.data_dir, f"{STATIONS_TABLE}.parquet")
+        read_paths = [path for files in files_by_dataset.values() for path in files]
+        files_version = _files_version(read_paths + ([stations_path] if os.path.exists(stations_path) else []))
+        cache_key = None
+        if files_version is not None:
+            cache_key = (path, tuple(sorted((name, str(value)) for name, value in query_params.items())), files_version)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return dict(cached, cached=True)
+
+        if files_by_dataset:
+            columns_by_dataset = {dataset_name: self._columns(files)
+                                  for dataset_name, files in files_by_dataset.items()}
+            sql = sql_template.format(trips=_trips_sql(files_by_dataset, columns_by_dataset, stations_path))
+            # Only pass the parameters the endpoint's SQL references
+            sql_params = {name: value for name, value in query_params.items() if f"${name}" in sql}
+            columns, rows = self.pool.execute(sql, sql_params)
+        else:
+            columns, rows = [], []
+        result = {'columns': columns, 'rows': rows, 'files': len(read_paths)}
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        return dict(result, cached=False)
+
+def make_handler(service):
+    class QueryHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            start_time = time.time()
+            try:
+                if url.path == "/health":
+                    body = {'status': 'ok', 'cache_hits': service.cache.hits, 'cache_misses': service.cache.misses}
+                else:
+                    body = service.query(url.path, params)
+                status = 200
+            except QueryError as e:
+                status, body = 400, {'error': str(e)}
+            except Exception as e:
+                print(f"Error answering {self.path}: {str(e)}")
+                status, body = 500, {'error': str(e)}
+            body['seconds'] = round(time.time() - start_time, 4)
+            payload = json.dumps(body, default=str).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            print(f"{self.address_string()} {format % args}")
+    return QueryHandler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve trip queries over the exported GeoParquet partitions')
+    parser.add_argument('--data-dir', type=str, default='final_parquet_folder', help='Directory holding the *_with_geom.parquet datasets')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('--pool-size', type=int, default=4, help='Number of pooled DuckDB connections (concurrent queries)')
+    parser.add_argument('--threads-per-connection', type=int, default=None, help='DuckDB threads per pooled connection')
+    parser.add_argument('--memory-limit', type=str, default=None, help="DuckDB memory limit per pooled connection, e.g. '2GB'")
+    parser.add_argument('--cache-entries', type=int, default=256, help='Number of query results kept in the LRU cache (0 disables it)')
+    args = parser.parse_args()
+
+    DATA_DIR = args.data_dir
+    HOST = args.host
+    PORT = args.port
+    POOL_SIZE = args.pool_size
+    THREADS_PER_CONNECTION = args.threads_per_connection
+    MEMORY_LIMIT = args.memory_limit
+    CACHE_ENTRIES = args.cache_entries
+
+    service = QueryService(DATA_DIR, POOL_SIZE, CACHE_ENTRIES, THREADS_PER_CONNECTION, MEMORY_LIMIT)
+    server = http.server.ThreadingHTTPServer((HOST, PORT), make_handler(service))
+    print(f"Serving {', '.join(ENDPOINTS)} over {DATA_DIR} on http://{HOST}:{PORT}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down")
+    finally:
+        server.server_close()
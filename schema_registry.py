@@ -0,0 +1,355 @@
+import csv
+import hashlib
+import io
+import itertools
+import re
+from datetime import datetime
+
+# Data rows read after the header to detect per-file formats
+SAMPLE_ROWS = 1000
+
+# Timestamp layouts seen in the old-schema files. The format detected for a file is parsed
+# in one pass; only rows it doesn't fit fall back to trying the whole list.
+TIMESTAMP_FORMATS = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f', '%m/%d/%Y %H:%M:%S', '%m/%d/%Y %H:%M']
+
+TIMESTAMP_PARSE_SQL = ("COALESCE(try_strptime(\"{col}\", '{timestamp_format}'), "
+                       "try_strptime(TRIM(\"{col}\"), [" + ", ".join(f"'{fmt}'" for fmt in TIMESTAMP_FORMATS) + "]))")
+
+# Canonical projection of each schema family: (output column, SQL expression over the
+# source column "{col}", SQL type, required). Optional columns missing from a header are
+# projected as typed NULLs. Coordinates are TRY_CAST so text in a coordinate field loads
+# as NULL and is flagged (see COORDINATE_COLUMNS) instead of failing the whole file.
+CANONICAL_PROJECTIONS = {
+    'new_schema': [
+        ('ride_id', 'COALESCE("{col}")', 'VARCHAR', True),
+        ('rideable_type', 'COALESCE("{col}")', 'VARCHAR', True),
+        ('started_at', 'COALESCE("{col}")::TIMESTAMP', 'TIMESTAMP', True),
+        ('ended_at', 'COALESCE("{col}")::TIMESTAMP', 'TIMESTAMP', True),
+        ('start_station_name', 'COALESCE("{col}")', 'VARCHAR', True),
+        ('start_station_id', 'COALESCE("{col}")::VARCHAR', 'VARCHAR', True),
+        ('end_station_name', 'COALESCE("{col}")', 'VARCHAR', True),
+        ('end_station_id', 'COALESCE("{col}")::VARCHAR', 'VARCHAR', True),
+        ('start_lat', 'TRY_CAST(COALESCE("{col}") AS DOUBLE)', 'DOUBLE', True),
+        ('start_lng', 'TRY_CAST(COALESCE("{col}") AS DOUBLE)', 'DOUBLE', True),
+        ('end_lat', 'TRY_CAST(COALESCE("{col}") AS DOUBLE)', 'DOUBLE', True),
+        ('end_lng', 'TRY_CAST(COALESCE("{col}") AS DOUBLE)', 'DOUBLE', True),
+        ('member_casual', 'COALESCE("{col}")', 'VARCHAR', True),
+    ],
+    # Old schema contains bad datetime format, detected per file (see detect_timestamp_format)
+    'old_schema': [
+        ('starttime', TIMESTAMP_PARSE_SQL, 'TIMESTAMP', True),
+        ('stoptime', TIMESTAMP_PARSE_SQL, 'TIMESTAMP', True),
+        ('start_station_id', '"{col}"::VARCHAR', 'VARCHAR', True),
+        ('start_station_name', '"{col}"', 'VARCHAR', True),
+        ('start_station_latitude', 'TRY_CAST("{col}" AS DOUBLE)', 'DOUBLE', True),
+        ('start_station_longitude', 'TRY_CAST("{col}" AS DOUBLE)', 'DOUBLE', True),
+        ('end_station_id', '"{col}"::VARCHAR', 'VARCHAR', True),
+        ('end_station_name', '"{col}"', 'VARCHAR', True),
+        ('end_station_latitude', 'TRY_CAST("{col}" AS DOUBLE)', 'DOUBLE', True),
+        ('end_station_longitude', 'TRY_CAST("{col}" AS DOUBLE)', 'DOUBLE', True),
+        ('bikeid', '"{col}"::BIGINT', 'BIGINT', True),
+        ('usertype', '"{col}"', 'VARCHAR', True),
+        ('birth_year', 'TRY_CAST(LEFT(CAST("{col}" as VARCHAR), 4) AS INTEGER)', 'INTEGER', False),
+        ('gender', 'TRY_CAST("{col}" AS BIGINT)', 'BIGINT', True),
+    ],
+}
+
+# Coordinate columns of both families. Plans add a dq_invalid_coordinates column, true where
+# one of them holds text that isn't a number, for data_quality to fold into dq_flags.
+COORDINATE_COLUMNS = ('start_lat', 'start_lng', 'end_lat', 'end_lng', 'start_station_latitude',
+                      'start_station_longitude', 'end_station_latitude', 'end_station_longitude')
+
+# Column types applied on top of the canonical projection by each storage profile; columns
+# not listed keep their projection type. Plans add a dq_outside_profile_type column, true
+# where a value doesn't fit its profile type (a category outside an ENUM, a gender outside
+# TINYINT), so those rows are quarantined rather than loaded with a NULL; a new category
+# (e.g. a new rideable_type) has to be added here. Station ids stay VARCHAR since
+# the new schema uses ids like '5329.03'. FLOAT keeps coordinates to about a metre.
+STORAGE_PROFILES = {
+    'standard': {},
+    'compact': {
+        'rideable_type': "ENUM('classic_bike', 'electric_bike', 'docked_bike')",
+        'member_casual': "ENUM('member', 'casual')",
+        'usertype': "ENUM('Subscriber', 'Customer')",
+        'gender': 'TINYINT',
+        'birth_year': 'SMALLINT',
+        'bikeid': 'INTEGER',
+        'start_lat': 'FLOAT',
+        'start_lng': 'FLOAT',
+        'end_lat': 'FLOAT',
+        'end_lng': 'FLOAT',
+        'start_station_latitude': 'FLOAT',
+        'start_station_longitude': 'FLOAT',
+        'end_station_latitude': 'FLOAT',
+        'end_station_longitude': 'FLOAT',
+    },
+}
+
+# Every header layout published so far. Each entry maps the canonical columns of its
+# schema family to the names used in that header; canonical columns not listed use their
+# own name. To support a new layout, add an entry here (bumping version for a changed
+# layout of the same name) - the loaders need no changes.
+HEADER_VARIANTS = [
+    {
+        'name': 'lowercase_2013',
+        'version': 1,
+        'schema': 'old_schema',
+        'header': ('tripduration', 'starttime', 'stoptime', 'start station id', 'start station name',
+                   'start station latitude', 'start station longitude', 'end station id',
+                   'end station name', 'end station latitude', 'end station longitude',
+                   'bikeid', 'usertype', 'birth year', 'gender'),
+        'columns': {
+            'start_station_id': 'start station id',
+            'start_station_name': 'start station name',
+            'start_station_latitude': 'start station latitude',
+            'start_station_longitude': 'start station longitude',
+            'end_station_id': 'end station id',
+            'end_station_name': 'end station name',
+            'end_station_latitude': 'end station latitude',
+            'end_station_longitude': 'end station longitude',
+            'birth_year': 'birth year',
+        },
+    },
+    {
+        'name': 'title_case_2016',
+        'version': 1,
+        'schema': 'old_schema',
+        'header': ('Trip Duration', 'Start Time', 'Stop Time', 'Start Station ID', 'Start Station Name',
+                   'Start Station Latitude', 'Start Station Longitude', 'End Station ID',
+                   'End Station Name', 'End Station Latitude', 'End Station Longitude',
+                   'Bike ID', 'User Type', 'Birth Year', 'Gender'),
+        'columns': {
+            'starttime': 'Start Time',
+            'stoptime': 'Stop Time',
+            'start_station_id': 'Start Station ID',
+            'start_station_name': 'Start Station Name',
+            'start_station_latitude': 'Start Station Latitude',
+            'start_station_longitude': 'Start Station Longitude',
+            'end_station_id': 'End Station ID',
+            'end_station_name': 'End Station Name',
+            'end_station_latitude': 'End Station Latitude',
+            'end_station_longitude': 'End Station Longitude',
+            'bikeid': 'Bike ID',
+            'usertype': 'User Type',
+            'birth_year': 'Birth Year',
+            'gender': 'Gender',
+        },
+    },
+    {
+        'name': 'mixed_case_2017',
+        'version': 1,
+        'schema': 'old_schema',
+        'header': ('tripduration', 'starttime', 'stoptime', 'Start Station ID', 'Start Station Name',
+                   'Start Station Latitude', 'Start Station Longitude', 'End Station ID',
+                   'End Station Name', 'End Station Latitude', 'End Station Longitude',
+                   'Bike ID', 'User Type', 'Birth Year', 'Gender'),
+        'columns': {
+            'start_station_id': 'Start Station ID',
+            'start_station_name': 'Start Station Name',
+            'start_station_latitude': 'Start Station Latitude',
+            'start_station_longitude': 'Start Station Longitude',
+            'end_station_id': 'End Station ID',
+            'end_station_name': 'End Station Name',
+            'end_station_latitude': 'End Station Latitude',
+            'end_station_longitude': 'End Station Longitude',
+            'bikeid': 'Bike ID',
+            'usertype': 'User Type',
+            'birth_year': 'Birth Year',
+            'gender': 'Gender',
+        },
+    },
+    {
+        'name': 'member_casual_2020',
+        'version': 1,
+        'schema': 'new_schema',
+        'header': ('ride_id', 'rideable_type', 'started_at', 'ended_at', 'start_station_name',
+                   'start_station_id', 'end_station_name', 'end_station_id', 'start_lat',
+                   'start_lng', 'end_lat', 'end_lng', 'member_casual'),
+        'columns': {},
+    },
+]
+
+# Compiled plans keyed by (header hash, storage profile); unknown headers are cached as None
+_plans_by_header_hash = {}
+
+def header_hash(columns):
+    """
+    Returns a stable hash of a CSV header (sequence of column names), used as the plan key.
+    """
+    return hashlib.sha1('\x1f'.join(columns).encode('utf-8')).hexdigest()[:16]
+
+def _normalize(name):
+    return re.sub(r'[\s_]', '', name).lower()
+
+def compile_plan(name, version, schema_name, column_map, storage_profile='standard'):
+    """
+    Compiles a header variant into a plan: a dict with the variant name and version, its
+    schema family, the canonical->source column map, the source columns holding
+    format-detected timestamps and select_sql, a SELECT template over "{source}" and
+    "{timestamp_format}" placeholders (fill them in with plan_select_sql). Columns retyped by
+    the storage profile are narrowed with TRY_CAST, and values that don't fit flagged in
+    dq_outside_profile_type.
+    """
+    profile_types = STORAGE_PROFILES[storage_profile]
+    select_items = []
+    timestamp_columns = []
+    invalid_coordinate_checks = []
+    profile_type_checks = []
+    for output_col, expression, sql_type, required in CANONICAL_PROJECTIONS[schema_name]:
+        source_col = column_map.get(output_col)
+        if source_col is None:
+            if required:
+                raise ValueError(f"Header variant {name} has no column for {output_col}")
+            select_items.append(f"NULL::{profile_types.get(output_col, sql_type)} AS {output_col}")
+            continue
+        column_sql = expression.replace('{col}', source_col)
+        if output_col in COORDINATE_COLUMNS:
+            invalid_coordinate_checks.append(f'("{source_col}" IS NOT NULL AND {column_sql} IS NULL)')
+        if output_col in profile_types:
+            profile_type_checks.append(f"({column_sql} IS NOT NULL AND TRY_CAST({column_sql} AS {profile_types[output_col]}) IS NULL)")
+            column_sql = f"TRY_CAST({column_sql} AS {profile_types[output_col]})"
+        select_items.append(f"{column_sql} AS {output_col}")
+        if '{timestamp_format}' in expression:
+            timestamp_columns.append(source_col)
+    select_items.append(f"({' OR '.join(invalid_coordinate_checks) or 'false'}) AS dq_invalid_coordinates")
+    select_items.append(f"({' OR '.join(profile_type_checks) or 'false'}) AS dq_outside_profile_type")
+    select_sql = "SELECT\n            " + ",\n            ".join(select_items) + "\n        FROM {source}"
+    return {'variant': name, 'version': version, 'schema': schema_name, 'storage_profile': storage_profile,
+            'columns': dict(column_map), 'timestamp_columns': timestamp_columns, 'select_sql': select_sql}
+
+def timestamp_parse_sql(column, timestamp_format=None):
+    """
+    Returns the SQL expression parsing a VARCHAR column with timestamp_format first and the
+    other TIMESTAMP_FORMATS only for rows it doesn't fit.
+    """
+    return (TIMESTAMP_PARSE_SQL
+            .replace('{timestamp_format}', timestamp_format or TIMESTAMP_FORMATS[0])
+            .replace('{col}', column))
+
+def plan_select_sql(plan, source, timestamp_format=None):
+    """
+    Returns the plan's SELECT over source, parsing its timestamp columns with timestamp_format
+    first (the first TIMESTAMP_FORMATS entry if none was detected).
+    """
+    return (plan['select_sql']
+            .replace('{timestamp_format}', timestamp_format or TIMESTAMP_FORMATS[0])
+            .replace('{source}', source))
+
+def _register_plans(header, name, version, schema_name, column_map):
+    key = header_hash(header)
+    for storage_profile in STORAGE_PROFILES:
+        _plans_by_header_hash[(key, storage_profile)] = compile_plan(name, version, schema_name, column_map, storage_profile)
+
+def register_variant(variant):
+    """
+    Compiles a HEADER_VARIANTS entry for every storage profile and registers the plans
+    under the hash of its header.
+    """
+    column_map = {output_col: variant['columns'].get(output_col, output_col)
+                  for output_col, _, _, _ in CANONICAL_PROJECTIONS[variant['schema']]}
+    column_map = {output_col: source_col for output_col, source_col in column_map.items()
+                  if source_col in variant['header']}
+    _register_plans(variant['header'], variant['name'], variant['version'], variant['schema'], column_map)
+
+def _derive_column_map(columns):
+    """
+    Matches the names of a header that isn't registered to canonical columns case-, space-
+    and underscore-insensitively. Returns (schema_name, column_map), or None if no schema
+    family fits.
+    """
+    by_normalized_name = {_normalize(col): col for col in columns}
+    for schema_name, projection in CANONICAL_PROJECTIONS.items():
+        column_map = {output_col: by_normalized_name[_normalize(output_col)]
+                      for output_col, _, _, _ in projection if _normalize(output_col) in by_normalized_name}
+        if all(output_col in column_map for output_col, _, _, required in projection if required):
+            return schema_name, column_map
+    return None
+
+class _ChainedStream(io.RawIOBase):
+    """
+    Read-only binary stream returning the bytes of head, then the rest of tail.
+    """
+    def __init__(self, head, tail):
+        self._head = io.BytesIO(head)
+        self._tail = tail
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = self._head.readinto(buffer)
+        if size:
+            return size
+        data = self._tail.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def sniff_csv(csv_stream, sample_rows=SAMPLE_ROWS):
+    """
+    Reads the header of a binary CSV stream and up to sample_rows data rows. Returns
+    (columns, rows, data_stream): data_stream yields the data rows from the first one on,
+    the sampled bytes chained in front of the rest of csv_stream, so nothing is seeked or
+    read twice (seeking back on a zip member decompresses it again from the start).
+    """
+    header_line = csv_stream.readline().decode('utf-8-sig')
+    if not header_line.strip():
+        raise ValueError("file has no header line")
+    columns = tuple(name.strip() for name in next(csv.reader([header_line])))
+
+    sampled_lines = list(itertools.islice(csv_stream, sample_rows)) if sample_rows else []
+    rows = list(csv.reader([line.decode('utf-8', errors='replace') for line in sampled_lines]))
+    data_stream = io.BufferedReader(_ChainedStream(b''.join(sampled_lines), csv_stream))
+    return columns, rows, data_stream
+
+def detect_timestamp_format(values):
+    """
+    Returns the TIMESTAMP_FORMATS entry that parses the most sample values, or None if
+    none of them parse.
+    """
+    values = [value.strip() for value in values if value and value.strip()]
+    best_format, best_count = None, 0
+    for fmt in TIMESTAMP_FORMATS:
+        parsed_count = 0
+        for value in values:
+            try:
+                datetime.strptime(value, fmt)
+                parsed_count += 1
+            except ValueError:
+                pass
+        if parsed_count > best_count:
+            best_format, best_count = fmt, parsed_count
+        if best_count == len(values):
+            break
+    return best_format
+
+def detect_plan_timestamp_format(plan, columns, rows):
+    """
+    Detects the timestamp format of a file from its sample rows, looking only at the
+    columns the plan parses as timestamps. Returns None if there is nothing to detect.
+    """
+    indexes = [columns.index(col) for col in plan['timestamp_columns'] if col in columns]
+    if not indexes or not rows:
+        return None
+    return detect_timestamp_format([row[i] for row in rows for i in indexes if i < len(row)])
+
+def plan_for_header(columns, storage_profile='standard'):
+    """
+    Returns the compiled plan for a CSV header and storage profile, or None if the header
+    matches no schema family. Registered variants are a single dict lookup; other headers
+    are derived once and cached.
+    """
+    columns = tuple(columns)
+    key = header_hash(columns)
+    if (key, storage_profile) not in _plans_by_header_hash:
+        derived = _derive_column_map(columns)
+        if derived is None:
+            for profile in STORAGE_PROFILES:
+                _plans_by_header_hash[(key, profile)] = None
+        else:
+            schema_name, column_map = derived
+            print(f"Header is not a registered variant; derived a plan for {schema_name} from: {list(columns)}")
+            _register_plans(columns, f"derived_{key}", 0, schema_name, column_map)
+    return _plans_by_header_hash[(key, storage_profile)]
+
+for _variant in HEADER_VARIANTS:
+    register_variant(_variant)
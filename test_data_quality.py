@@ -0,0 +1,108 @@
+import duckdb
+import pytest
+
+from data_quality import DQ_CHECKS, QUALITY_COUNTS_TABLE, flagged_select_sql, load_flagged_rows, quarantine_table_name
+from export_schemas import EXPORT_SCHEMAS
+from schema_registry import HEADER_VARIANTS, plan_for_header, plan_select_sql
+
+NEW_SCHEMA = EXPORT_SCHEMAS["new_schema_combined"]
+BITS = {name: bit for name, bit, _ in DQ_CHECKS}
+
+# (start, end, start_lat, start_lng, end_lat, end_lng, coordinate text that isn't a number)
+CLEAN_TRIP = ("2024-01-01 08:00:00", "2024-01-01 08:20:00", 40.75, -73.99, 40.76, -73.98, False)
+
+def _rows_sql(rows):
+    values = ", ".join(
+        f"({f'TIMESTAMP {start!r}' if start else 'NULL'}, {f'TIMESTAMP {end!r}' if end else 'NULL'}, "
+        f"{'NULL' if start_lat is None else start_lat}::DOUBLE, {'NULL' if start_lng is None else start_lng}::DOUBLE, "
+        f"{'NULL' if end_lat is None else end_lat}::DOUBLE, {'NULL' if end_lng is None else end_lng}::DOUBLE, {invalid}, false)"
+        for start, end, start_lat, start_lng, end_lat, end_lng, invalid in rows)
+    return (f"SELECT * FROM (VALUES {values}) "
+            f"t(started_at, ended_at, start_lat, start_lng, end_lat, end_lng, dq_invalid_coordinates, dq_outside_profile_type)")
+
+def _flags(rows):
+    db = duckdb.connect()
+    return [row[0] for row in db.execute(f"SELECT dq_flags FROM ({flagged_select_sql(_rows_sql(rows), NEW_SCHEMA)})").fetchall()]
+
+def test_check_bits_are_distinct_powers_of_two():
+    bits = [bit for _, bit, _ in DQ_CHECKS]
+    assert len(set(bits)) == len(bits)
+    assert all(bit & (bit - 1) == 0 for bit in bits)
+    assert sum(bits) <= 255
+
+@pytest.mark.parametrize("row, expected_checks", [
+    (CLEAN_TRIP, []),
+    ((None, "2024-01-01 08:20:00", 40.75, -73.99, 40.76, -73.98, False), ["missing_time"]),
+    # A NULL coordinate is only reported as empty (or invalid, if it held text), not as outside NYC
+    (("2024-01-01 08:00:00", "2024-01-01 08:20:00", None, -73.99, 40.76, -73.98, False), ["null_coordinates"]),
+    (("2024-01-01 08:00:00", "2024-01-01 08:20:00", None, -73.99, 40.76, -73.98, True), ["invalid_coordinates"]),
+    (("2024-01-01 08:20:00", "2024-01-01 08:00:00", 40.75, -73.99, 40.76, -73.98, False), ["negative_duration"]),
+    (("2024-01-01 08:00:00", "2024-01-01 08:20:00", 41.5, -73.99, 40.76, -73.98, False), ["outside_nyc", "impossible_speed"]),
+    # About 10 km in one minute
+    (("2024-01-01 08:00:00", "2024-01-01 08:01:00", 40.70, -74.01, 40.79, -73.97, False), ["impossible_speed"]),
+])
+def test_dq_flags_sets_one_bit_per_failed_check(row, expected_checks):
+    assert _flags([row]) == [sum(BITS[name] for name in expected_checks)]
+
+def test_load_flagged_rows_splits_clean_and_flagged_rows():
+    db = duckdb.connect()
+    rows = [CLEAN_TRIP, CLEAN_TRIP, ("2024-01-01 08:20:00", "2024-01-01 08:00:00", 40.75, -73.99, 40.76, -73.98, False)]
+    flagged_sql = flagged_select_sql(_rows_sql(rows), NEW_SCHEMA)
+
+    counts = load_flagged_rows(db, flagged_sql, "trips_2024_01_new_schema", "new_schema", "a.csv", partition=(2024, 1))
+    assert counts['loaded'] == 2
+    assert counts['quarantined'] == 1
+    assert counts['negative_duration'] == 1
+    assert counts['missing_time'] == 0
+    counts = load_flagged_rows(db, flagged_sql, "trips_2024_01_new_schema", "new_schema", "b.csv", append=True, partition=(2024, 1))
+    assert counts['loaded'] == 2
+
+    assert db.execute('SELECT count(*), max(dq_flags) FROM "trips_2024_01_new_schema"').fetchone() == (4, 0)
+    assert db.execute(f'SELECT source_table, source_file, dq_flags FROM "{quarantine_table_name("new_schema")}" ORDER BY source_file').fetchall() == [
+        ("trips_2024_01_new_schema", "a.csv", BITS["negative_duration"]),
+        ("trips_2024_01_new_schema", "b.csv", BITS["negative_duration"]),
+    ]
+    assert db.execute(f'SELECT source_file, year, month, rows_loaded, quarantined FROM "{QUALITY_COUNTS_TABLE}" ORDER BY source_file').fetchall() == [
+        ("a.csv", 2024, 1, 2, 1),
+        ("b.csv", 2024, 1, 2, 1),
+    ]
+
+def test_failed_load_leaves_table_and_counts_unchanged():
+    db = duckdb.connect()
+    load_flagged_rows(db, flagged_select_sql(_rows_sql([CLEAN_TRIP]), NEW_SCHEMA), "trips_2024_01_new_schema", "new_schema", "a.csv")
+    # The cast fails part way through the scan, after rows have been inserted
+    failing_sql = flagged_select_sql(f"SELECT * REPLACE (CASE WHEN i < 90000 THEN started_at ELSE i::VARCHAR::TIMESTAMP END AS started_at) "
+                                     f"FROM ({_rows_sql([CLEAN_TRIP])}), range(100000) r(i)", NEW_SCHEMA)
+    with pytest.raises(duckdb.ConversionException, match=r"\"9\d{4}\""):
+        load_flagged_rows(db, f"SELECT * EXCLUDE (i) FROM ({failing_sql})", "trips_2024_01_new_schema", "new_schema", "b.csv", append=True)
+    assert db.execute('SELECT count(*) FROM "trips_2024_01_new_schema"').fetchone()[0] == 1
+    assert db.execute(f'SELECT source_file FROM "{QUALITY_COUNTS_TABLE}"').fetchall() == [("a.csv",)]
+
+def test_compact_profile_quarantines_values_outside_its_enums():
+    db = duckdb.connect()
+    header = next(variant['header'] for variant in HEADER_VARIANTS if variant['name'] == 'member_casual_2020')
+    trips = [('classic_bike', 'member'), ('electric_bike', 'casual'), ('cargo_bike', 'member'), ('classic_bike', 'Member'), ('classic_bike', None)]
+    values = ", ".join(f"('r{i}', {rideable_type!r}, '2024-01-01 08:00:00', '2024-01-01 08:20:00', 'A', 'A1', 'B', 'B1', "
+                       f"'40.75', '-73.99', '40.76', '-73.98', {'NULL' if member_casual is None else repr(member_casual)})"
+                       for i, (rideable_type, member_casual) in enumerate(trips))
+    source = f"(SELECT * FROM (VALUES {values}) t({', '.join(header)}))"
+    flagged_sql = flagged_select_sql(plan_select_sql(plan_for_header(header, 'compact'), source), NEW_SCHEMA)
+
+    counts = load_flagged_rows(db, flagged_sql, "trips_2024_01_new_schema", "new_schema", "a.csv", partition=(2024, 1))
+    # An empty category isn't a value the ENUM failed to hold
+    assert (counts['loaded'], counts['quarantined'], counts['outside_profile_type']) == (3, 2, 2)
+    assert db.execute(f'SELECT ride_id, dq_flags FROM "{quarantine_table_name("new_schema")}" ORDER BY ride_id').fetchall() == [
+        ("r2", BITS["outside_profile_type"]),
+        ("r3", BITS["outside_profile_type"]),
+    ]
+
+def test_counts_table_from_before_a_check_gets_its_column():
+    db = duckdb.connect()
+    db.execute(f"""
+        CREATE TABLE "{QUALITY_COUNTS_TABLE}" (
+            table_name VARCHAR, source_file VARCHAR, year INTEGER, month INTEGER, rows_loaded BIGINT, quarantined BIGINT,
+            {", ".join(f"{name} BIGINT" for name, _, _ in DQ_CHECKS if name != "outside_profile_type")}, loaded_at TIMESTAMP
+        )
+    """)
+    load_flagged_rows(db, flagged_select_sql(_rows_sql([CLEAN_TRIP]), NEW_SCHEMA), "trips_2024_01_new_schema", "new_schema", "a.csv")
+    assert db.execute(f'SELECT rows_loaded, outside_profile_type, loaded_at IS NOT NULL FROM "{QUALITY_COUNTS_TABLE}"').fetchall() == [(1, 0, True)]
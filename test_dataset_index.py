@@ -0,0 +1,104 @@
+import json
+import os
+
+import duckdb
+import pytest
+
+from dataset_index import INDEX_FILE_NAME, read_parquet_sql, select_indexed_files, write_dataset_index
+from export_schemas import CANONICAL_DETAILS, EXPORT_SCHEMAS
+
+NEW_SCHEMA = EXPORT_SCHEMAS["new_schema_combined"]
+
+def _write_month(db, dataset_path, year, month, trips, keyed=False):
+    """
+    Writes one partition file of trips: (start day, start station, end station, lng offset).
+    """
+    station_columns = ("start_station_key", "end_station_key") if keyed else ("start_station_id", "end_station_id")
+    values = ", ".join(f"(TIMESTAMP '{year}-{month:02d}-{day:02d} 08:00:00', {start!r}, {end!r}, {-73.99 + offset}, 40.75)"
+                       for day, start, end, offset in trips)
+    partition_dir = os.path.join(dataset_path, f"year={year}", f"month={month}")
+    os.makedirs(partition_dir, exist_ok=True)
+    db.execute(f"""
+        COPY (SELECT started_at, started_at + INTERVAL 10 MINUTE AS ended_at, {station_columns[0]}, {station_columns[1]},
+                     lat::DOUBLE AS start_lat, lng::DOUBLE AS start_lng, lat::DOUBLE AS end_lat, lng::DOUBLE AS end_lng
+              FROM (VALUES {values}) t(started_at, {station_columns[0]}, {station_columns[1]}, lng, lat))
+        TO '{os.path.join(partition_dir, "data_0.parquet")}' (FORMAT PARQUET)
+    """)
+
+@pytest.fixture
+def dataset(tmp_path):
+    db = duckdb.connect()
+    dataset_path = str(tmp_path / "new_schema_combined_with_geom.parquet")
+    _write_month(db, dataset_path, 2024, 1, [(1, 'A1', 'B1', 0.0), (31, 'A1', 'C1', 0.01)])
+    _write_month(db, dataset_path, 2024, 2, [(10, 'B1', 'D1', 0.2)])
+    _write_month(db, dataset_path, 2024, 3, [(5, 'E1', 'E1', 0.0)])
+    assert write_dataset_index(db, dataset_path, NEW_SCHEMA) == 3
+    return db, dataset_path
+
+def _months(files):
+    return sorted(os.path.basename(os.path.dirname(path)) for path in files)
+
+def test_index_records_file_stats(dataset):
+    _, dataset_path = dataset
+    with open(os.path.join(dataset_path, INDEX_FILE_NAME)) as f:
+        index = json.load(f)
+    entry = index['files'][0]
+    assert entry['path'] == "year=2024/month=1/data_0.parquet"
+    assert (entry['year'], entry['month'], entry['rows']) == (2024, 1, 2)
+    assert entry['min_time'] == "2024-01-01T08:00:00"
+    assert entry['max_time'] == "2024-01-31T08:00:00"
+    assert entry['station_ids'] == ['A1', 'B1', 'C1']
+    assert entry['bbox'] == pytest.approx([-73.99, 40.75, -73.98, 40.75])
+
+def test_select_indexed_files_prunes_by_time_bbox_and_station(dataset):
+    _, dataset_path = dataset
+    assert _months(select_indexed_files(dataset_path)) == ["month=1", "month=2", "month=3"]
+    assert _months(select_indexed_files(dataset_path, "2024-02-01", "2024-03-01")) == ["month=2"]
+    # The end of the window is exclusive, the start inclusive
+    assert _months(select_indexed_files(dataset_path, "2024-01-31 08:00:00", "2024-03-05 08:00:00")) == ["month=1", "month=2"]
+    assert _months(select_indexed_files(dataset_path, bbox=[-73.85, 40.7, -73.7, 40.8])) == ["month=2"]
+    assert _months(select_indexed_files(dataset_path, station_ids=['B1'])) == ["month=1", "month=2"]
+    assert select_indexed_files(dataset_path, "2025-01-01", "2025-02-01") == []
+
+def test_select_indexed_files_without_index_returns_none(tmp_path):
+    assert select_indexed_files(str(tmp_path)) is None
+
+def test_unchanged_files_are_not_reread(dataset, capsys):
+    db, dataset_path = dataset
+    _write_month(db, dataset_path, 2024, 3, [(6, 'F1', 'F1', 0.0), (7, 'F1', 'F1', 0.0)])
+    capsys.readouterr()
+    write_dataset_index(db, dataset_path, NEW_SCHEMA)
+    assert "(1 re-read)" in capsys.readouterr().out
+    assert _months(select_indexed_files(dataset_path, station_ids=['F1'])) == ["month=3"]
+
+def test_read_parquet_sql_reads_only_selected_files(dataset):
+    db, dataset_path = dataset
+    source_sql = read_parquet_sql(dataset_path, "2024-02-01", "2024-03-01")
+    assert db.execute(f"SELECT year, month, start_station_id FROM {source_sql}").fetchall() == [(2024, 2, 'B1')]
+
+def test_read_parquet_sql_with_no_matching_files_reads_nothing(dataset):
+    db, dataset_path = dataset
+    source_sql = read_parquet_sql(dataset_path, "2025-01-01", "2025-02-01")
+    assert db.execute(f"SELECT count(*) FROM {source_sql}").fetchone()[0] == 0
+    assert "start_station_id" in [row[0] for row in db.execute(f"DESCRIBE SELECT * FROM {source_sql}").fetchall()]
+
+def test_keyed_dataset_indexes_ids_through_station_dimension(tmp_path):
+    db = duckdb.connect()
+    output_dir = tmp_path / "out"
+    dataset_path = str(output_dir / "trips_canonical_with_geom.parquet")
+    _write_month(db, dataset_path, 2024, 1, [(1, 1, 2, 0.0)], keyed=True)
+    _write_month(db, dataset_path, 2024, 2, [(1, 2, 3, 0.0)], keyed=True)
+
+    # No station dimension: keys are indexed, and looking up ids is an error rather than no match
+    write_dataset_index(db, dataset_path, CANONICAL_DETAILS)
+    with pytest.raises(ValueError):
+        select_indexed_files(dataset_path, station_ids=['A1'])
+
+    db.execute(f"""
+        COPY (SELECT * FROM (VALUES (1, 'A1'), (2, 'B1'), (3, 'C1')) t(station_key, station_id))
+        TO '{output_dir / "stations.parquet"}' (FORMAT PARQUET)
+    """)
+    os.remove(os.path.join(dataset_path, INDEX_FILE_NAME))
+    write_dataset_index(db, dataset_path, CANONICAL_DETAILS)
+    assert _months(select_indexed_files(dataset_path, station_ids=['A1'])) == ["month=1"]
+    assert _months(select_indexed_files(dataset_path, station_ids=['C1', 'B1'])) == ["month=1", "month=2"]
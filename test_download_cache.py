@@ -0,0 +1,130 @@
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+import download_cache
+from download_cache import evict_cache, fetch_cached_archive, release_archive
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    # Serves server.files ({path: bytes}) with ETags and Range support, logging every request
+    def _send_head(self):
+        server = self.server
+        server.requests.append((self.command, self.path, self.headers.get('Range')))
+        data = server.files.get(self.path)
+        if data is None:
+            self.send_error(404)
+            return None
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') in (None, etag):
+            start = int(range_header.split('=')[1].split('-')[0])
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(data) - start))
+        self.end_headers()
+        return data[start:]
+
+    def do_HEAD(self):
+        self._send_head()
+
+    def do_GET(self):
+        body = self._send_head()
+        if body is None:
+            return
+        if self.server.truncate_next:
+            # Drop the connection half way through, like an interrupted download
+            self.server.truncate_next = False
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    httpd.files, httpd.requests, httpd.truncate_next = {}, [], False
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = functools.partial("http://127.0.0.1:{}{}".format, httpd.server_address[1])
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def _fetch(url, cache_dir, **kwargs):
+    path, downloaded_bytes, _ = fetch_cached_archive(url, cache_dir, **kwargs)
+    release_archive(path)
+    with open(path, 'rb') as f:
+        return path, downloaded_bytes, f.read()
+
+def test_second_fetch_is_a_cache_hit_without_rehashing(server, tmp_path, monkeypatch):
+    server.files['/202401-citibike-tripdata.zip'] = data = os.urandom(300_000)
+    url = server.url('/202401-citibike-tripdata.zip')
+    path, downloaded_bytes, content = _fetch(url, str(tmp_path))
+    assert (downloaded_bytes, content) == (len(data), data)
+
+    monkeypatch.setattr(download_cache, 'sha256_file', lambda *args: pytest.fail("unchanged archive was re-hashed"))
+    assert _fetch(url, str(tmp_path)) == (path, 0, data)
+    assert [method for method, _, _ in server.requests] == ['HEAD', 'GET', 'HEAD']
+
+def test_interrupted_download_resumes_with_range_request(server, tmp_path):
+    server.files['/a.zip'] = data = os.urandom(3 * download_cache.CHUNK_SIZE)
+    url = server.url('/a.zip')
+    server.truncate_next = True
+    with pytest.raises(IOError):
+        fetch_cached_archive(url, str(tmp_path))
+    part_size = os.path.getsize(download_cache._cache_paths(url, str(tmp_path))[1])
+    assert 0 < part_size < len(data)
+
+    path, downloaded_bytes, content = _fetch(url, str(tmp_path))
+    assert content == data
+    assert downloaded_bytes == len(data) - part_size
+    assert server.requests[-1] == ('GET', '/a.zip', f"bytes={part_size}-")
+    assert download_cache._read_metadata(f"{path}.json")['sha256'] == hashlib.sha256(data).hexdigest()
+
+def test_changed_remote_file_is_not_resumed(server, tmp_path):
+    server.files['/a.zip'] = os.urandom(3 * download_cache.CHUNK_SIZE)
+    url = server.url('/a.zip')
+    server.truncate_next = True
+    with pytest.raises(IOError):
+        fetch_cached_archive(url, str(tmp_path))
+
+    server.files['/a.zip'] = data = os.urandom(2 * download_cache.CHUNK_SIZE)
+    _, downloaded_bytes, content = _fetch(url, str(tmp_path))
+    assert (downloaded_bytes, content) == (len(data), data)
+    assert server.requests[-1] == ('GET', '/a.zip', None)
+
+def test_corrupted_cached_copy_fails_validation_and_is_downloaded_again(server, tmp_path):
+    server.files['/a.zip'] = data = os.urandom(100_000)
+    url = server.url('/a.zip')
+    path, _, _ = _fetch(url, str(tmp_path))
+    with open(path, 'r+b') as f:
+        f.write(b'corrupt')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    _, downloaded_bytes, content = _fetch(url, str(tmp_path))
+    assert (downloaded_bytes, content) == (len(data), data)
+
+def test_eviction_skips_pinned_archives(server, tmp_path):
+    for name in ('/a.zip', '/b.zip'):
+        server.files[name] = os.urandom(100_000)
+    pinned_path, _, _ = fetch_cached_archive(server.url('/a.zip'), str(tmp_path))
+    try:
+        other_path, _, _ = _fetch(server.url('/b.zip'), str(tmp_path))
+        evict_cache(str(tmp_path), 0)
+        assert os.path.exists(pinned_path)
+        assert not os.path.exists(other_path)
+    finally:
+        release_archive(pinned_path)
+    evict_cache(str(tmp_path), 0)
+    assert not os.path.exists(pinned_path)
@@ -0,0 +1,69 @@
+import os
+
+import duckdb
+import pytest
+
+from geoparquet_finalize import finalize_datasets, has_valid_geo_metadata, read_geo_metadata
+
+WKB_COLUMN = {'encoding': 'WKB', 'geometry_types': [], 'crs': {'id': {'authority': 'EPSG', 'code': 4326}}}
+
+@pytest.mark.parametrize("geo_metadata, valid", [
+    ({'version': '1.0.0', 'primary_column': 'start_geom', 'columns': {'start_geom': WKB_COLUMN, 'end_geom': WKB_COLUMN}}, True),
+    (None, False),
+    ({'primary_column': 'start_geom', 'columns': {'start_geom': WKB_COLUMN}}, False),
+    # The primary column has to be one of the declared columns, and every declared column in the file
+    ({'version': '1.0.0', 'primary_column': 'geom', 'columns': {'start_geom': WKB_COLUMN}}, False),
+    ({'version': '1.0.0', 'primary_column': 'start_geom', 'columns': {'start_geom': WKB_COLUMN, 'other_geom': WKB_COLUMN}}, False),
+    ({'version': '1.0.0', 'primary_column': 'start_geom', 'columns': {'start_geom': dict(WKB_COLUMN, crs=None)}}, False),
+    ({'version': '1.0.0', 'primary_column': 'start_geom', 'columns': {'start_geom': dict(WKB_COLUMN, encoding='point')}}, False),
+])
+def test_has_valid_geo_metadata(geo_metadata, valid):
+    assert has_valid_geo_metadata(geo_metadata, {'start_geom', 'end_geom', 'started_at'}) is valid
+
+@pytest.fixture
+def db():
+    db = duckdb.connect()
+    db.load_extension("spatial")
+    return db
+
+def _write_trips(db, path, geometry_sql):
+    """
+    Writes two trips to path, with start_geom/end_geom built by geometry_sql over lng/lat
+    placeholders (None for no geometry columns).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    geometry_columns = ""
+    if geometry_sql:
+        geometry_columns = (f", {geometry_sql.format(lng='start_lng', lat='start_lat')} AS start_geom"
+                            f", {geometry_sql.format(lng='end_lng', lat='end_lat')} AS end_geom")
+    db.execute(f"""
+        COPY (
+            SELECT ride_id, start_lat, start_lng, end_lat, end_lng {geometry_columns}
+            FROM (VALUES ('R1', 40.75, -73.99, 40.76, -73.98), ('R2', 40.72, -74.00, 40.75, -73.99))
+                 t(ride_id, start_lat, start_lng, end_lat, end_lng)
+        ) TO '{path}' (FORMAT PARQUET)
+    """)
+
+def test_finalize_datasets_rewrites_only_files_without_geo_metadata(db, tmp_path):
+    dataset = str(tmp_path / "new_schema_combined_with_geom.parquet")
+    wkb_path = os.path.join(dataset, "year=2024", "month=1", "data_0.parquet")
+    geoparquet_path = os.path.join(dataset, "year=2024", "month=2", "data_0.parquet")
+    broken_path = os.path.join(dataset, "year=2024", "month=3", "data_0.parquet")
+    _write_trips(db, wkb_path, "ST_AsWKB(ST_Point({lng}, {lat}))")
+    _write_trips(db, geoparquet_path, "ST_Point({lng}, {lat})::GEOMETRY('EPSG:4326')")
+    _write_trips(db, broken_path, None)
+    geoparquet_mtime = os.path.getmtime(geoparquet_path)
+
+    assert finalize_datasets([dataset, str(tmp_path / "missing.parquet")], workers=2) == (1, 1, 1)
+    assert os.path.getmtime(geoparquet_path) == geoparquet_mtime
+    geo_metadata = read_geo_metadata(db, wkb_path)
+    assert geo_metadata['primary_column'] == 'start_geom'
+    assert has_valid_geo_metadata(geo_metadata, {'start_geom', 'end_geom'})
+    assert db.execute(f"SELECT ride_id, ST_X(start_geom), ST_Y(end_geom) FROM read_parquet('{wkb_path}') ORDER BY ride_id").fetchall() == [
+        ('R1', -73.99, 40.76), ('R2', -74.00, 40.75)]
+    # Nothing is left behind by the rewrite or by the failed file
+    assert sorted(os.listdir(os.path.dirname(wkb_path))) == ["data_0.parquet"]
+    assert sorted(os.listdir(os.path.dirname(broken_path))) == ["data_0.parquet"]
+
+    # A rerun only retries the file that failed
+    assert finalize_datasets([dataset], workers=2) == (0, 2, 1)
@@ -0,0 +1,372 @@
+import csv
+import datetime
+import functools
+import glob
+import http.server
+import io
+import os
+import threading
+import zipfile
+
+import duckdb
+import pytest
+
+from improved_etl import MANIFEST_TABLE, STATION_MONTHS_TABLE, build_rollups, build_station_dimension, configure_memory_budget, convert_parquet, export_rollups, extract_csvs_from_zip, incremental_ingest, iter_zip_csv_streams, parallel_ingest, pipelined_csv_generator, process_csv_to_duckdb
+from data_quality import QUALITY_COUNTS_TABLE, quarantine_table_name
+from export_schemas import STATIONS_TABLE
+from schema_registry import HEADER_VARIANTS
+
+HEADERS = {variant['name']: variant['header'] for variant in HEADER_VARIANTS}
+# station id -> (name, latitude, longitude)
+STATIONS = {'A1': ('Alpha', 40.75, -73.99), 'B1': ('Beta', 40.76, -73.98), 'C1': ('Gamma', 40.72, -74.00)}
+
+def _csv_bytes(schema, trips, stations=STATIONS):
+    """
+    Returns a CSV of trips (start time, minutes, start station, end station, member) with the
+    member_casual_2020 header for 'new_schema' or the lowercase_2013 one for 'old_schema'.
+    Station names and coordinates come from stations.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(HEADERS['member_casual_2020' if schema == 'new_schema' else 'lowercase_2013'])
+    for i, (start, minutes, start_id, end_id, member) in enumerate(trips):
+        started_at = datetime.datetime.fromisoformat(start)
+        ended_at = (started_at + datetime.timedelta(minutes=minutes)).isoformat(sep=' ')
+        (start_name, start_lat, start_lng), (end_name, end_lat, end_lng) = stations[start_id], stations[end_id]
+        if schema == 'new_schema':
+            writer.writerow([f"R{i}", 'classic_bike', start, ended_at, start_name, start_id, end_name, end_id,
+                             start_lat, start_lng, end_lat, end_lng, 'member' if member else 'casual'])
+        else:
+            writer.writerow([minutes * 60, start, ended_at, start_id, start_name, start_lat, start_lng,
+                             end_id, end_name, end_lat, end_lng, 14529 + i, 'Subscriber' if member else 'Customer', 1980, 1])
+    return buffer.getvalue().encode('utf-8')
+
+def _write_zip(zip_path, members):
+    """
+    Writes a zip of members ({name: bytes}); a dict value is written as a nested zip.
+    """
+    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, data in members.items():
+            if isinstance(data, dict):
+                nested_buffer = io.BytesIO()
+                with zipfile.ZipFile(nested_buffer, 'w', zipfile.ZIP_DEFLATED) as nested_zip:
+                    for nested_name, nested_data in data.items():
+                        nested_zip.writestr(nested_name, nested_data)
+                data = nested_buffer.getvalue()
+            zip_file.writestr(name, data)
+
+JANUARY_2024 = [("2024-01-05 08:00:00", 12, 'A1', 'B1', True), ("2024-01-05 09:00:00", 20, 'B1', 'C1', False),
+                ("2024-01-20 17:30:00", 15, 'C1', 'A1', True)]
+FEBRUARY_2024 = [("2024-02-01 07:45:00", 10, 'A1', 'C1', True), ("2024-02-02 18:00:00", 25, 'B1', 'A1', True)]
+JANUARY_2014 = [("2014-01-03 08:00:00", 14, 'A1', 'B1', True), ("2014-01-03 12:10:00", 30, 'C1', 'B1', False)]
+
+def _archives(archive_dir):
+    """
+    Writes a 2024 monthly archive split into two CSVs and a 2014 annual archive with a nested
+    monthly zip and __MACOSX junk. Returns {archive name: {CSV member: trip count}}.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    _write_zip(os.path.join(archive_dir, "202401-citibike-tripdata.csv.zip"), {
+        "202401-citibike-tripdata_1.csv": _csv_bytes('new_schema', JANUARY_2024[:2]),
+        "202401-citibike-tripdata_2.csv": _csv_bytes('new_schema', JANUARY_2024[2:]),
+    })
+    _write_zip(os.path.join(archive_dir, "2014-citibike-tripdata.zip"), {
+        "201401-citibike-tripdata.zip": {"201401-citibike-tripdata.csv": _csv_bytes('old_schema', JANUARY_2014)},
+        "__MACOSX/._201401-citibike-tripdata.zip": b"\x00\x05\x16\x07",
+    })
+    return {
+        "202401-citibike-tripdata.csv.zip": {"202401-citibike-tripdata_1.csv": 2, "202401-citibike-tripdata_2.csv": 1},
+        "2014-citibike-tripdata.zip": {"201401-citibike-tripdata.csv": 2},
+    }
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def archive_server(tmp_path):
+    archive_dir = str(tmp_path / "archives")
+    archives = _archives(archive_dir)
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(_QuietHandler, directory=archive_dir))
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.archive_dir, httpd.archives = archive_dir, archives
+    httpd.urls = [f"http://127.0.0.1:{httpd.server_address[1]}/{name}" for name in archives]
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def _table_counts(db):
+    tables = [row[0] for row in db.execute(
+        "SELECT table_name FROM duckdb_tables() WHERE starts_with(table_name, 'citibike_data_')").fetchall()]
+    return {table: db.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0] for table in tables}
+
+def test_pipelined_stages_load_every_csv_and_clean_up(archive_server, tmp_path):
+    download_dir = str(tmp_path / "download")
+    db = duckdb.connect()
+    loaded = []
+    for csv_path in pipelined_csv_generator(archive_server.urls, download_dir, download_workers=2, queue_size=1):
+        loaded.append(os.path.basename(csv_path))
+        process_csv_to_duckdb(csv_path, db)
+        os.remove(csv_path)
+
+    assert sorted(loaded) == sorted(member for members in archive_server.archives.values() for member in members)
+    assert _table_counts(db) == {"citibike_data_2014_01_old_schema": 2, "citibike_data_2024_01_new_schema": 3}
+    # Archives are deleted once extracted, and the __MACOSX junk is never extracted
+    leftovers = [name for _, _, names in os.walk(download_dir) for name in names]
+    assert leftovers == []
+
+def test_pipeline_stops_when_the_loader_stops_early(archive_server, tmp_path):
+    pipeline = pipelined_csv_generator(archive_server.urls, str(tmp_path / "download"), queue_size=1)
+    next(pipeline)
+    # Closing the generator has to unblock and join the download and extract threads
+    closer = threading.Thread(target=pipeline.close, daemon=True)
+    closer.start()
+    closer.join(timeout=10)
+    assert not closer.is_alive()
+
+def test_streamed_members_load_like_extracted_files(archive_server, tmp_path):
+    streamed_db, extracted_db = duckdb.connect(), duckdb.connect()
+    for archive_name, members in archive_server.archives.items():
+        streamed = []
+        for member_name, csv_stream in iter_zip_csv_streams(os.path.join(archive_server.archive_dir, archive_name)):
+            streamed.append(member_name)
+            process_csv_to_duckdb(member_name, streamed_db, csv_stream=csv_stream)
+        assert streamed == list(members)
+    # Nested members are streamed too; nothing is written next to the archives
+    assert sorted(os.listdir(archive_server.archive_dir)) == sorted(archive_server.archives)
+
+    for archive_name in archive_server.archives:
+        for csv_path in extract_csvs_from_zip(os.path.join(archive_server.archive_dir, archive_name), str(tmp_path / "extracted")):
+            process_csv_to_duckdb(csv_path, extracted_db)
+
+    assert _table_counts(streamed_db) == _table_counts(extracted_db)
+    for table in _table_counts(streamed_db):
+        query = f'SELECT * FROM "{table}" ORDER BY ALL'
+        assert streamed_db.execute(query).fetchall() == extracted_db.execute(query).fetchall()
+
+def _touch(path, seconds_later):
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime + seconds_later, stat.st_mtime + seconds_later))
+
+def test_incremental_ingest_reloads_only_changed_months(archive_server, tmp_path, capsys):
+    download_dir = str(tmp_path / "download")
+    db = duckdb.connect()
+    assert incremental_ingest(archive_server.urls, download_dir, db) == {
+        "citibike_data_2024_01_new_schema", "citibike_data_2014_01_old_schema"}
+    assert db.execute(f'SELECT member, table_name, row_count FROM "{MANIFEST_TABLE}" ORDER BY member').fetchall() == [
+        ("201401-citibike-tripdata.csv", "citibike_data_2014_01_old_schema", 2),
+        ("202401-citibike-tripdata_1.csv", "citibike_data_2024_01_new_schema", 2),
+        ("202401-citibike-tripdata_2.csv", "citibike_data_2024_01_new_schema", 1),
+    ]
+
+    # Unchanged validators: nothing is downloaded
+    capsys.readouterr()
+    assert incremental_ingest(archive_server.urls, download_dir, db) == set()
+    assert capsys.readouterr().out.count("Unchanged since last load") == 2
+
+    # Same bytes with a new Last-Modified: downloaded and hashed, but nothing is reloaded
+    archive_path = os.path.join(archive_server.archive_dir, "2014-citibike-tripdata.zip")
+    _touch(archive_path, 60)
+    assert incremental_ingest(archive_server.urls, download_dir, db) == set()
+    assert "only refreshing its validators" in capsys.readouterr().out
+
+    # One member of the 2024 archive changes: only its month is reloaded, from both members
+    _write_zip(os.path.join(archive_server.archive_dir, "202401-citibike-tripdata.csv.zip"), {
+        "202401-citibike-tripdata_1.csv": _csv_bytes('new_schema', JANUARY_2024[:2]),
+        "202401-citibike-tripdata_2.csv": _csv_bytes('new_schema', JANUARY_2024[2:] + JANUARY_2024[:1]),
+    })
+    _touch(os.path.join(archive_server.archive_dir, "202401-citibike-tripdata.csv.zip"), 120)
+    assert incremental_ingest(archive_server.urls, download_dir, db) == {"citibike_data_2024_01_new_schema"}
+    assert _table_counts(db) == {"citibike_data_2014_01_old_schema": 2, "citibike_data_2024_01_new_schema": 4}
+    assert db.execute(f'SELECT row_count FROM "{MANIFEST_TABLE}" WHERE member = ?', ["202401-citibike-tripdata_2.csv"]).fetchone() == (2,)
+
+def _write_csvs(csv_dir):
+    """
+    Writes two January 2024 CSVs (one with a trip that ends before it starts) and a January
+    2014 one to csv_dir. Returns their paths.
+    """
+    os.makedirs(csv_dir, exist_ok=True)
+    csvs = {
+        "202401-citibike-tripdata_1.csv": _csv_bytes('new_schema', JANUARY_2024[:2] + [("2024-01-06 08:00:00", -5, 'A1', 'B1', True)]),
+        "202401-citibike-tripdata_2.csv": _csv_bytes('new_schema', JANUARY_2024[2:]),
+        "201401-citibike-tripdata.csv": _csv_bytes('old_schema', JANUARY_2014),
+    }
+    for name, data in csvs.items():
+        with open(os.path.join(csv_dir, name), 'wb') as f:
+            f.write(data)
+    return [os.path.join(csv_dir, name) for name in csvs]
+
+def test_parallel_ingest_matches_sequential_load(tmp_path):
+    sequential_db, parallel_db = duckdb.connect(), duckdb.connect()
+    for csv_path in _write_csvs(str(tmp_path / "sequential")):
+        process_csv_to_duckdb(csv_path, sequential_db)
+
+    csv_paths = _write_csvs(str(tmp_path / "parallel"))
+    staging_dir = str(tmp_path / "staging")
+    assert parallel_ingest(iter(csv_paths), parallel_db, staging_dir, workers=2, threads=1) == 3
+    # Each CSV is deleted once transformed, and the staging files once registered
+    assert not any(os.path.exists(path) for path in csv_paths)
+    assert not os.path.exists(staging_dir)
+
+    assert _table_counts(parallel_db) == _table_counts(sequential_db) == {
+        "citibike_data_2014_01_old_schema": 2, "citibike_data_2024_01_new_schema": 3}
+    for table in _table_counts(sequential_db):
+        query = f'SELECT * FROM "{table}" ORDER BY ALL'
+        assert parallel_db.execute(query).fetchall() == sequential_db.execute(query).fetchall()
+    # The workers' quarantined rows and quality counts end up in the main database
+    quarantine_query = f'SELECT ride_id, source_file FROM "{quarantine_table_name("new_schema")}"'
+    assert parallel_db.execute(quarantine_query).fetchall() == [("R2", "202401-citibike-tripdata_1.csv")]
+    counts_query = f'SELECT source_file, rows_loaded, quarantined, negative_duration FROM "{QUALITY_COUNTS_TABLE}" ORDER BY source_file'
+    assert parallel_db.execute(counts_query).fetchall() == sequential_db.execute(counts_query).fetchall()
+
+def _column_types(db, table):
+    return {name: column_type for name, column_type, *_ in db.execute(f'DESCRIBE "{table}"').fetchall()}
+
+def test_compact_profile_types_survive_parallel_ingest(tmp_path):
+    db = duckdb.connect()
+    parallel_ingest(_write_csvs(str(tmp_path / "csvs")), db, str(tmp_path / "staging"), workers=2, storage_profile='compact')
+    new_schema_types = _column_types(db, "citibike_data_2024_01_new_schema")
+    # Parquet doesn't keep ENUMs; the coordinator restores them from the worker's types
+    assert new_schema_types['member_casual'] == "ENUM('member', 'casual')"
+    assert new_schema_types['rideable_type'] == "ENUM('classic_bike', 'electric_bike', 'docked_bike')"
+    assert new_schema_types['start_lat'] == 'FLOAT'
+    old_schema_types = _column_types(db, "citibike_data_2014_01_old_schema")
+    assert (old_schema_types['usertype'], old_schema_types['gender'], old_schema_types['birth_year']) == (
+        "ENUM('Subscriber', 'Customer')", 'TINYINT', 'SMALLINT')
+    assert db.execute('SELECT usertype::VARCHAR, gender, birth_year FROM "citibike_data_2014_01_old_schema" ORDER BY bikeid').fetchall() == [
+        ('Subscriber', 1, 1980), ('Customer', 1, 1980)]
+
+def _load_csv(db, csv_dir, name, schema, trips, stations=STATIONS):
+    os.makedirs(csv_dir, exist_ok=True)
+    csv_path = os.path.join(csv_dir, name)
+    with open(csv_path, 'wb') as f:
+        f.write(_csv_bytes(schema, trips, stations))
+    return process_csv_to_duckdb(csv_path, db)[0]
+
+def _station_keys(db):
+    return {(station_id, station_name): station_key for station_key, station_id, station_name in db.execute(
+        f'SELECT station_key, station_id, station_name FROM "{STATIONS_TABLE}"').fetchall()}
+
+def test_station_dimension_keys_trips_and_versions_renamed_stations(tmp_path):
+    db = duckdb.connect()
+    january_table = _load_csv(db, str(tmp_path), "202401-citibike-tripdata.csv", 'new_schema', JANUARY_2024)
+    original_rows = db.execute(f'SELECT ride_id, start_station_id, end_station_name FROM "{january_table}" ORDER BY ride_id').fetchall()
+    assert build_station_dimension(db) == [january_table]
+    keys = _station_keys(db)
+    assert sorted(keys) == [('A1', 'Alpha'), ('B1', 'Beta'), ('C1', 'Gamma')]
+
+    # The trip table stores keys only; the _wide view gives back the ids and names
+    columns = [row[0] for row in db.execute(f'DESCRIBE "{january_table}"').fetchall()]
+    assert 'start_station_key' in columns and 'start_station_id' not in columns
+    assert db.execute(f'SELECT ride_id, start_station_id, end_station_name FROM "{january_table}_wide" ORDER BY ride_id').fetchall() == original_rows
+
+    # A renamed station gets a new version; existing keys and keyed tables are left alone
+    renamed = dict(STATIONS, B1=('Beta Plaza', 40.76, -73.98))
+    february_table = _load_csv(db, str(tmp_path), "202402-citibike-tripdata.csv", 'new_schema', FEBRUARY_2024, renamed)
+    assert build_station_dimension(db) == [february_table]
+    february_keys = _station_keys(db)
+    assert {station: key for station, key in february_keys.items() if station in keys} == keys
+    assert sorted(set(february_keys) - set(keys)) == [('B1', 'Beta Plaza')]
+    assert db.execute(f"""
+        SELECT station_name, valid_from::VARCHAR, valid_to::VARCHAR FROM "{STATIONS_TABLE}" WHERE station_id IN ('A1', 'B1') ORDER BY station_key
+    """).fetchall() == [('Alpha', '2024-01-01', '2024-02-29'), ('Beta', '2024-01-01', '2024-01-31'), ('Beta Plaza', '2024-02-01', '2024-02-29')]
+    assert db.execute(f'SELECT start_station_key FROM "{february_table}" WHERE ride_id = ?', ['R1']).fetchone() == (
+        february_keys[('B1', 'Beta Plaza')],)
+    assert db.execute(f'SELECT sum(trip_count) FROM "{STATION_MONTHS_TABLE}"').fetchone()[0] == 2 * (len(JANUARY_2024) + len(FEBRUARY_2024))
+
+def test_rollups_count_trips_and_rebuild_only_reloaded_months(tmp_path):
+    db = duckdb.connect()
+    january_table = _load_csv(db, str(tmp_path), "202401-citibike-tripdata_1.csv", 'new_schema', JANUARY_2024)
+    _load_csv(db, str(tmp_path), "201401-citibike-tripdata.csv", 'old_schema', JANUARY_2014)
+    rollup_names, partitions = build_rollups(db)
+    # Without an H3 resolution the H3 rollup isn't built
+    assert rollup_names == ["rollup_station_hour", "rollup_station_pair_day"]
+    assert partitions == [(2014, 1), (2024, 1)]
+    station_hour_query = """
+        SELECT period_start::VARCHAR, start_station, rider_type, trip_count, avg_duration_s
+        FROM rollup_station_hour WHERE year = ? ORDER BY ALL
+    """
+    assert db.execute(station_hour_query, [2024]).fetchall() == [
+        ("2024-01-05 08:00:00", "A1", "member", 1, 720.0),
+        ("2024-01-05 09:00:00", "B1", "casual", 1, 1200.0),
+        ("2024-01-20 17:00:00", "C1", "member", 1, 900.0),
+    ]
+    # Old-schema user types map onto the same rider types
+    assert db.execute("SELECT rider_type, sum(trip_count) FROM rollup_station_pair_day WHERE year = 2014 GROUP BY ALL ORDER BY ALL").fetchall() == [
+        ("casual", 1), ("member", 1)]
+
+    # A second file for January 2024 only re-aggregates that month
+    _load_csv(db, str(tmp_path), "202401-citibike-tripdata_2.csv", 'new_schema', JANUARY_2024[:1])
+    assert build_rollups(db, tables=[january_table])[1] == [(2024, 1)]
+    assert db.execute(station_hour_query, [2024]).fetchall()[0] == ("2024-01-05 08:00:00", "A1", "member", 2, 720.0)
+    assert db.execute("SELECT sum(trip_count) FROM rollup_station_hour GROUP BY year ORDER BY year").fetchall() == [(2,), (4,)]
+
+    output_dir = str(tmp_path / "parquet")
+    os.makedirs(output_dir)
+    export_rollups(db, output_dir, rollup_names, [(2024, 1)])
+    exported = db.execute(f"SELECT year, month, sum(trip_count) FROM read_parquet('{output_dir}/rollup_station_hour.parquet/*/*/*.parquet', "
+                          f"hive_partitioning=true) GROUP BY ALL").fetchall()
+    assert exported == [(2024, 1, 4)]
+
+def _dataset_sql(dataset_path):
+    return f"read_parquet('{dataset_path}/*/*/*.parquet', hive_partitioning=true)"
+
+def test_canonical_export_writes_both_eras_to_one_dataset(tmp_path):
+    db = duckdb.connect()
+    _load_csv(db, str(tmp_path), "202401-citibike-tripdata.csv", 'new_schema', JANUARY_2024)
+    _load_csv(db, str(tmp_path), "201401-citibike-tripdata.csv", 'old_schema', JANUARY_2014)
+    output_dir = str(tmp_path / "parquet")
+    convert_parquet(db, output_dir, canonical=True)
+    assert sorted(os.listdir(output_dir)) == ["trips_canonical_with_geom.parquet"]
+
+    dataset_sql = _dataset_sql(os.path.join(output_dir, "trips_canonical_with_geom.parquet"))
+    columns = [row[0] for row in db.execute(f"DESCRIBE SELECT * FROM {dataset_sql}").fetchall()]
+    assert columns[:4] == ["ride_id", "rideable_type", "started_at", "ended_at"]
+    assert {"era", "start_geom", "end_geom", "year", "month"} <= set(columns)
+    # Station keys only appear once the station dimension has been built
+    assert "start_station_key" not in columns
+    assert db.execute(f"""
+        SELECT era, started_at::VARCHAR, member_casual, ride_id IS NULL, bikeid IS NULL, usertype, start_lat
+        FROM {dataset_sql} ORDER BY started_at
+    """).fetchall() == [
+        ("old_schema", "2014-01-03 08:00:00", "member", True, False, "Subscriber", 40.75),
+        ("old_schema", "2014-01-03 12:10:00", "casual", True, False, "Customer", 40.72),
+        ("new_schema", "2024-01-05 08:00:00", "member", False, True, None, 40.75),
+        ("new_schema", "2024-01-05 09:00:00", "casual", False, True, None, 40.76),
+        ("new_schema", "2024-01-20 17:30:00", "member", False, True, None, 40.72),
+    ]
+
+    # Exporting only a new month adds its partition and leaves the others as they were
+    january_files = sorted(glob.glob(os.path.join(output_dir, "trips_canonical_with_geom.parquet", "year=*", "month=*", "*.parquet")))
+    january_mtimes = [os.path.getmtime(path) for path in january_files]
+    february_table = _load_csv(db, str(tmp_path), "202402-citibike-tripdata.csv", 'new_schema', FEBRUARY_2024)
+    convert_parquet(db, output_dir, tables=[february_table], canonical=True)
+    assert [os.path.getmtime(path) for path in january_files] == january_mtimes
+    assert db.execute(f"SELECT era, count(*) FROM {dataset_sql} GROUP BY ALL ORDER BY ALL").fetchall() == [
+        ("new_schema", 5), ("old_schema", 2)]
+
+def test_chunked_export_matches_full_export_month_by_month(tmp_path, capsys):
+    exports = {}
+    for chunked in (False, True):
+        db = duckdb.connect()
+        csv_dir = str(tmp_path / f"csvs_{chunked}")
+        _load_csv(db, csv_dir, "202401-citibike-tripdata.csv", 'new_schema', JANUARY_2024)
+        _load_csv(db, csv_dir, "202402-citibike-tripdata.csv", 'new_schema', FEBRUARY_2024)
+        if chunked:
+            configure_memory_budget(db, memory_limit='256MB', temp_directory=str(tmp_path / "spill"))
+            assert db.execute("SELECT current_setting('preserve_insertion_order')").fetchone()[0] is False
+        output_dir = str(tmp_path / f"parquet_{chunked}")
+        capsys.readouterr()
+        convert_parquet(db, output_dir, chunked=chunked)
+        dataset_sql = _dataset_sql(os.path.join(output_dir, "new_schema_combined_with_geom.parquet"))
+        exports[chunked] = db.execute(f"SELECT * EXCLUDE (start_geom, end_geom) FROM {dataset_sql} ORDER BY ALL").fetchall()
+        relation_type = db.execute("SELECT table_type FROM information_schema.tables WHERE table_name = 'new_schema_combined'").fetchone()[0]
+        if chunked:
+            # The combined relation is a view, and each month is a COPY of its own
+            assert relation_type == 'VIEW'
+            assert "for 2024-01" in capsys.readouterr().out
+        else:
+            assert relation_type == 'BASE TABLE'
+    assert len(exports[True]) == len(JANUARY_2024) + len(FEBRUARY_2024)
+    assert exports[True] == exports[False]
@@ -0,0 +1,84 @@
+import json
+import threading
+
+import duckdb
+import pytest
+
+import metrics
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    # Spans and settings are module state; every test starts without either
+    monkeypatch.setattr(metrics, '_spans', [])
+    monkeypatch.setattr(metrics, '_settings', {'jsonl_path': None, 'prometheus_path': None, 'duckdb_profiling': False})
+
+def test_nested_spans_record_parent_rows_and_errors(tmp_path):
+    jsonl_path = str(tmp_path / "metrics" / "spans.jsonl")
+    metrics.configure(jsonl_path=jsonl_path)
+    with metrics.span('download', 'a.zip') as download_span:
+        download_span['bytes'] = 2048
+        with metrics.span('csv_load', 'a.csv', table='trips') as load_span:
+            load_span['rows'] = 10
+    with pytest.raises(ValueError):
+        with metrics.span('csv_load', 'b.csv'):
+            raise ValueError("bad header")
+
+    with open(jsonl_path) as f:
+        records = [json.loads(line) for line in f]
+    # Spans are written as they finish, so the inner one comes first
+    assert [(record['kind'], record['name']) for record in records] == [
+        ('csv_load', 'a.csv'), ('download', 'a.zip'), ('csv_load', 'b.csv')]
+    assert records[0]['parent'] == records[1]['id']
+    assert records[0]['table'] == 'trips'
+    assert records[1]['parent'] is None
+    assert records[2]['error'] == "bad header"
+    assert all(record['seconds'] >= 0 for record in records)
+    assert metrics.current_span() is None
+
+def _download_span():
+    with metrics.span('download', 'a.zip'):
+        pass
+
+def test_spans_on_other_threads_have_their_own_parents():
+    with metrics.span('pipeline', 'run'):
+        thread = threading.Thread(target=_download_span)
+        thread.start()
+        thread.join()
+    # The download thread's span doesn't nest under this thread's open span
+    assert [(record['kind'], record['parent']) for record in metrics._spans] == [('download', None), ('pipeline', None)]
+
+def test_summary_and_prometheus_totals(tmp_path):
+    for rows in (5, 7):
+        with metrics.span('csv_load', f"{rows}.csv") as load_span:
+            load_span['rows'], load_span['bytes'] = rows, 100
+    with pytest.raises(IOError):
+        with metrics.span('download', 'a.zip'):
+            raise IOError("connection reset")
+
+    totals = metrics.summarize()
+    assert (totals['csv_load']['count'], totals['csv_load']['rows'], totals['csv_load']['bytes']) == (2, 12, 200)
+    assert totals['download']['errors'] == 1
+
+    prometheus_path = str(tmp_path / "citibike.prom")
+    metrics.write_prometheus(prometheus_path)
+    with open(prometheus_path) as f:
+        lines = f.read().splitlines()
+    assert 'citibike_etl_rows_total{kind="csv_load"} 12' in lines
+    assert 'citibike_etl_span_errors_total{kind="download"} 1' in lines
+    assert '# TYPE citibike_etl_spans_total counter' in lines
+
+def test_duckdb_profile_is_added_to_the_open_span():
+    db = duckdb.connect()
+    with metrics.span('export', 'untracked') as export_span:
+        db.execute("SELECT sum(i) FROM range(1000) t(i)").fetchall()
+        metrics.record_duckdb_profile(db)
+    # Without profiling enabled nothing is recorded
+    assert 'duckdb' not in export_span
+
+    metrics.enable_duckdb_profiling(db)
+    with metrics.span('export', 'trips') as export_span:
+        for _ in range(2):
+            db.execute("SELECT sum(i) FROM range(1000) t(i)").fetchall()
+            metrics.record_duckdb_profile(db)
+    assert export_span['duckdb']['queries'] == 2
+    assert export_span['duckdb']['cumulative_rows_scanned'] >= 2000
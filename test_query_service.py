@@ -0,0 +1,139 @@
+import datetime
+import os
+
+import duckdb
+import pytest
+
+from dataset_index import write_dataset_index
+from export_schemas import CANONICAL_DETAILS, EXPORT_SCHEMAS
+from query_service import QueryError, QueryService, bbox_query, months_between, parse_time, partition_files, trips_query
+
+NEW_SCHEMA_DATASET = "new_schema_combined_with_geom.parquet"
+CANONICAL_DATASET = "trips_canonical_with_geom.parquet"
+
+def _write_month(db, dataset_path, year, month, trips, keyed=False):
+    """
+    Writes one partition file of trips: (start day, start station, end station, start lng).
+    """
+    station_columns = ("start_station_key", "end_station_key") if keyed else ("start_station_id", "end_station_id")
+    values = ", ".join(f"(TIMESTAMP '{year}-{month:02d}-{day:02d} 08:00:00', {start!r}, {end!r}, {lng}::DOUBLE)"
+                       for day, start, end, lng in trips)
+    partition_dir = os.path.join(dataset_path, f"year={year}", f"month={month}")
+    os.makedirs(partition_dir, exist_ok=True)
+    db.execute(f"""
+        COPY (SELECT started_at, started_at + INTERVAL 10 MINUTE AS ended_at, {station_columns[0]}, {station_columns[1]},
+                     40.75::DOUBLE AS start_lat, lng AS start_lng, 40.76::DOUBLE AS end_lat, -73.98::DOUBLE AS end_lng,
+                     'member' AS member_casual
+              FROM (VALUES {values}) t(started_at, {station_columns[0]}, {station_columns[1]}, lng))
+        TO '{os.path.join(partition_dir, "data_0.parquet")}' (FORMAT PARQUET)
+    """)
+
+@pytest.fixture
+def data_dir(tmp_path):
+    db = duckdb.connect()
+    dataset_path = str(tmp_path / NEW_SCHEMA_DATASET)
+    _write_month(db, dataset_path, 2024, 1, [(5, 'A1', 'B1', -73.99), (20, 'B1', 'A1', -73.99)])
+    _write_month(db, dataset_path, 2024, 2, [(3, 'A1', 'C1', -73.90)])
+    _write_month(db, dataset_path, 2024, 3, [(1, 'C1', 'A1', -73.99)])
+    return str(tmp_path)
+
+def test_parse_time_accepts_dates_and_timestamps():
+    assert parse_time("2024-01-31", "start") == datetime.datetime(2024, 1, 31)
+    assert parse_time("2024-01-31T08:30", "start") == datetime.datetime(2024, 1, 31, 8, 30)
+    with pytest.raises(QueryError, match="'start'"):
+        parse_time("last tuesday", "start")
+    with pytest.raises(QueryError):
+        parse_time(None, "end")
+
+def test_endpoint_parameters_are_validated_and_normalised():
+    _, params = trips_query({'station': 'A1', 'limit': '10'})
+    assert params == {'station': 'A1', 'role': 'any', 'limit': 10}
+    assert trips_query({'station': 'A1', 'limit': '0'})[1]['limit'] == 1
+    assert trips_query({'station': 'A1', 'limit': '10000000'})[1]['limit'] == 100000
+    with pytest.raises(QueryError, match="station"):
+        trips_query({})
+    with pytest.raises(QueryError, match="role"):
+        trips_query({'station': 'A1', 'role': 'middle'})
+    with pytest.raises(QueryError, match="limit"):
+        trips_query({'station': 'A1', 'limit': 'ten'})
+    with pytest.raises(QueryError, match="max_lat"):
+        bbox_query({'min_lng': '-74', 'min_lat': '40.7', 'max_lng': '-73.9'})
+    with pytest.raises(QueryError, match="min_lng"):
+        bbox_query({'min_lng': 'west', 'min_lat': '40.7', 'max_lng': '-73.9', 'max_lat': '40.8'})
+
+def test_months_between_spans_year_boundary():
+    assert months_between(datetime.datetime(2023, 11, 15), datetime.datetime(2024, 2, 15)) == [
+        (2023, 11), (2023, 12), (2024, 1), (2024, 2)]
+    # The end is exclusive, so a window ending at midnight on the 1st doesn't reach into that month
+    assert months_between(datetime.datetime(2023, 12, 1), datetime.datetime(2024, 1, 1)) == [(2023, 12)]
+    assert months_between(datetime.datetime(2024, 1, 1), datetime.datetime(2024, 3, 1)) == [(2024, 1), (2024, 2)]
+
+def _months(files_by_dataset):
+    return sorted(os.path.basename(os.path.dirname(path)) for files in files_by_dataset.values() for path in files)
+
+def test_partition_files_prunes_by_month_without_index(data_dir):
+    files = partition_files(data_dir, datetime.datetime(2024, 1, 10), datetime.datetime(2024, 2, 15))
+    assert list(files) == [NEW_SCHEMA_DATASET]
+    assert _months(files) == ["month=1", "month=2"]
+    assert partition_files(data_dir, datetime.datetime(2025, 1, 1), datetime.datetime(2025, 2, 1)) == {}
+
+def test_partition_files_prunes_by_index_and_ignores_stale_index(data_dir):
+    dataset_path = os.path.join(data_dir, NEW_SCHEMA_DATASET)
+    write_dataset_index(duckdb.connect(), dataset_path, EXPORT_SCHEMAS["new_schema_combined"])
+    # The month partitions alone would keep January; the index knows its last trip starts on the 20th
+    assert _months(partition_files(data_dir, datetime.datetime(2024, 1, 25), datetime.datetime(2024, 2, 15))) == ["month=2"]
+
+    os.remove(os.path.join(dataset_path, "year=2024", "month=2", "data_0.parquet"))
+    assert _months(partition_files(data_dir, datetime.datetime(2024, 1, 25), datetime.datetime(2024, 3, 15))) == ["month=1", "month=3"]
+
+def test_query_reads_only_window_and_caches_result(data_dir):
+    service = QueryService(data_dir, pool_size=2)
+    params = {'station': 'A1', 'role': 'start', 'start': '2024-01-01', 'end': '2024-03-01'}
+    result = service.query("/trips", params)
+    assert result['files'] == 2
+    assert result['cached'] is False
+    rows = [dict(zip(result['columns'], row)) for row in result['rows']]
+    assert [(row['start_station_id'], row['end_station_id']) for row in rows] == [('A1', 'B1'), ('A1', 'C1')]
+    assert all(row['member_casual'] == 'member' for row in rows)
+
+    assert service.query("/trips", dict(params))['cached'] is True
+    # Re-exporting a partition read by the query invalidates the cached result
+    _write_month(duckdb.connect(), os.path.join(data_dir, NEW_SCHEMA_DATASET), 2024, 2, [(4, 'A1', 'D1', -73.90)])
+    result = service.query("/trips", params)
+    assert result['cached'] is False
+    assert [row[3] for row in result['rows']] == ['B1', 'D1']
+
+def test_od_and_bbox_queries(data_dir):
+    service = QueryService(data_dir, pool_size=1)
+    window = {'start': '2024-01-01', 'end': '2024-04-01'}
+    result = service.query("/od", dict(window, limit='2'))
+    assert result['rows'] == [('A1', 'B1', 1), ('A1', 'C1', 1)]
+    result = service.query("/bbox", dict(window, min_lng='-73.95', min_lat='40.7', max_lng='-73.85', max_lat='40.8'))
+    assert [row[2] for row in result['rows']] == ['A1']
+
+def test_query_rejects_bad_requests(data_dir):
+    service = QueryService(data_dir, pool_size=1)
+    with pytest.raises(QueryError, match="unknown endpoint"):
+        service.query("/stations", {'start': '2024-01-01', 'end': '2024-02-01'})
+    with pytest.raises(QueryError, match="required"):
+        service.query("/od", {'start': '2024-01-01'})
+    with pytest.raises(QueryError, match="after"):
+        service.query("/od", {'start': '2024-02-01', 'end': '2024-01-01'})
+
+def test_canonical_dataset_with_station_keys_is_served_by_station_id(data_dir):
+    db = duckdb.connect()
+    canonical_path = os.path.join(data_dir, CANONICAL_DATASET)
+    _write_month(db, canonical_path, 2024, 1, [(5, 1, 2, -73.99), (6, 2, 3, -73.99)], keyed=True)
+    service = QueryService(data_dir, pool_size=1)
+    # The canonical dataset replaces the per-era ones, but can't be read without its station dimension
+    with pytest.raises(RuntimeError, match="stations.parquet"):
+        service.query("/od", {'start': '2024-01-01', 'end': '2024-02-01'})
+
+    db.execute(f"""
+        COPY (SELECT * FROM (VALUES (1, 'A1'), (2, 'B1'), (3, 'C1')) t(station_key, station_id))
+        TO '{os.path.join(data_dir, "stations.parquet")}' (FORMAT PARQUET)
+    """)
+    write_dataset_index(db, canonical_path, CANONICAL_DETAILS)
+    result = service.query("/trips", {'station': 'B1', 'start': '2024-01-01', 'end': '2024-02-01'})
+    assert result['files'] == 1
+    assert [(row[2], row[3]) for row in result['rows']] == [('A1', 'B1'), ('B1', 'C1')]
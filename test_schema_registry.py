@@ -0,0 +1,89 @@
+import io
+
+import pytest
+
+from schema_registry import HEADER_VARIANTS, STORAGE_PROFILES, detect_plan_timestamp_format, detect_timestamp_format, plan_for_header, sniff_csv
+
+@pytest.mark.parametrize("variant", HEADER_VARIANTS, ids=lambda variant: variant['name'])
+def test_registered_variants_resolve_to_their_plan(variant, capsys):
+    for storage_profile in STORAGE_PROFILES:
+        plan = plan_for_header(variant['header'], storage_profile)
+        assert plan['variant'] == variant['name']
+        assert plan['schema'] == variant['schema']
+        assert plan['storage_profile'] == storage_profile
+        assert set(plan['columns'].values()) <= set(variant['header'])
+    # Registered headers never go through the derived-plan fallback
+    assert "not a registered variant" not in capsys.readouterr().out
+
+def test_mixed_case_2017_maps_lowercase_and_title_case_columns():
+    header = next(variant['header'] for variant in HEADER_VARIANTS if variant['name'] == 'mixed_case_2017')
+    plan = plan_for_header(header)
+    assert plan['columns']['starttime'] == 'starttime'
+    assert plan['columns']['start_station_id'] == 'Start Station ID'
+    assert plan['columns']['birth_year'] == 'Birth Year'
+    assert plan['timestamp_columns'] == ['starttime', 'stoptime']
+
+def test_unregistered_header_is_derived_once_and_cached(capsys):
+    header = ('ride_id', 'rideable_type', 'Started At', 'Ended At', 'start_station_name', 'start_station_id',
+              'end_station_name', 'end_station_id', 'start_lat', 'start_lng', 'end_lat', 'end_lng', 'member_casual')
+    plan = plan_for_header(header)
+    assert plan['schema'] == 'new_schema'
+    assert plan['version'] == 0
+    assert plan['columns']['started_at'] == 'Started At'
+    assert plan_for_header(header) is plan
+    assert capsys.readouterr().out.count("derived a plan") == 1
+
+def test_unknown_header_has_no_plan():
+    assert plan_for_header(('a', 'b', 'c')) is None
+    assert plan_for_header(('a', 'b', 'c'), 'compact') is None
+
+def test_compact_profile_narrows_types():
+    header = next(variant['header'] for variant in HEADER_VARIANTS if variant['name'] == 'member_casual_2020')
+    assert "ENUM" not in plan_for_header(header, 'standard')['select_sql']
+    assert "ENUM('member', 'casual')" in plan_for_header(header, 'compact')['select_sql']
+
+@pytest.mark.parametrize("values, expected", [
+    (["2014-01-01 00:00:06", "2014-01-31 23:59:59"], '%Y-%m-%d %H:%M:%S'),
+    (["2016-10-01 00:00:07.1430", "2016-10-01 00:01:02.0000"], '%Y-%m-%d %H:%M:%S.%f'),
+    (["1/1/2015 00:01:00", "12/31/2015 23:59:59"], '%m/%d/%Y %H:%M:%S'),
+    (["9/1/2014 00:00", "9/30/2014 23:59"], '%m/%d/%Y %H:%M'),
+    # The format fitting most values wins; blanks are ignored
+    (["1/1/2015 00:01:00", "", "1/2/2015 00:01:00", "2015-01-03 00:00:00"], '%m/%d/%Y %H:%M:%S'),
+    (["not a time", " "], None),
+    ([], None),
+])
+def test_detect_timestamp_format(values, expected):
+    assert detect_timestamp_format(values) == expected
+
+def test_detect_plan_timestamp_format_reads_only_timestamp_columns():
+    header = next(variant['header'] for variant in HEADER_VARIANTS if variant['name'] == 'title_case_2016')
+    plan = plan_for_header(header)
+    row = ['600', '10/1/2016 00:00:07', '10/1/2016 00:10:07'] + ['2016-10-01 00:00:00'] * (len(header) - 3)
+    assert detect_plan_timestamp_format(plan, header, [row]) == '%m/%d/%Y %H:%M:%S'
+    assert detect_plan_timestamp_format(plan, header, []) is None
+
+class _ForwardOnlyStream(io.RawIOBase):
+    # Like a zip member: readable once, front to back
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._data.readinto(buffer)
+
+    def seek(self, *args):
+        raise AssertionError("sniff_csv must not seek")
+
+def test_sniff_csv_returns_sample_and_full_data_stream_without_seeking():
+    data = "\ufeffa, b\n" + "".join(f"{i},x{i}\n" for i in range(10))
+    stream = io.BufferedReader(_ForwardOnlyStream(data.encode('utf-8')))
+    columns, rows, data_stream = sniff_csv(stream, sample_rows=3)
+    assert columns == ('a', 'b')
+    assert rows == [['0', 'x0'], ['1', 'x1'], ['2', 'x2']]
+    assert data_stream.read().decode('utf-8') == "".join(f"{i},x{i}\n" for i in range(10))
+
+def test_sniff_csv_rejects_empty_file():
+    with pytest.raises(ValueError):
+        sniff_csv(io.BytesIO(b""))
@@ -0,0 +1,103 @@
+import os
+import shutil
+
+import pytest
+
+from upload import MIN_PART_SIZE, LocalObjectStore, default_manifest_path, read_manifest, upload_directory
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+@pytest.fixture
+def source_dir(tmp_path):
+    source_dir = tmp_path / "final_parquet_folder"
+    dataset = source_dir / "new_schema_combined_with_geom.parquet"
+    _write(str(dataset / "year=2024" / "month=1" / "data_0.parquet"), b"january")
+    _write(str(dataset / "year=2024" / "month=2" / "data_0.parquet"), b"february")
+    _write(str(dataset / "_index.json"), b"{}")
+    return str(source_dir)
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def test_only_changed_partitions_are_uploaded(source_dir, tmp_path):
+    store = LocalObjectStore(str(tmp_path / "bucket"))
+    assert upload_directory(store, source_dir, "bucket") == (3, 0, 0)
+    assert _read(str(tmp_path / "bucket" / "new_schema_combined_with_geom.parquet" / "year=2024" / "month=1" / "data_0.parquet")) == b"january"
+    assert upload_directory(store, source_dir, "bucket") == (0, 3, 0)
+
+    _write(os.path.join(source_dir, "new_schema_combined_with_geom.parquet", "year=2024", "month=2", "data_0.parquet"), b"february v2")
+    assert upload_directory(store, source_dir, "bucket") == (1, 2, 0)
+    assert upload_directory(store, source_dir, "bucket", force=True) == (3, 0, 0)
+    # Each destination keeps its own record
+    assert upload_directory(LocalObjectStore(str(tmp_path / "mirror")), source_dir, "mirror") == (3, 0, 0)
+
+def test_manifest_is_kept_out_of_the_upload(source_dir, tmp_path):
+    upload_directory(LocalObjectStore(str(tmp_path / "bucket")), source_dir, "bucket")
+    manifest = read_manifest(default_manifest_path(source_dir))
+    assert sorted(manifest['destinations']['bucket']['partitions']) == [
+        "new_schema_combined_with_geom.parquet",
+        "new_schema_combined_with_geom.parquet/year=2024/month=1",
+        "new_schema_combined_with_geom.parquet/year=2024/month=2",
+    ]
+    assert not os.path.exists(os.path.join(str(tmp_path / "bucket"), os.path.basename(default_manifest_path(source_dir))))
+
+def test_regenerated_source_dir_skips_unchanged_partitions(source_dir, tmp_path):
+    store = LocalObjectStore(str(tmp_path / "bucket"))
+    assert upload_directory(store, source_dir, "bucket") == (3, 0, 0)
+    # A non-incremental ETL run deletes the output directory and writes it again
+    shutil.rmtree(source_dir)
+    dataset = os.path.join(source_dir, "new_schema_combined_with_geom.parquet")
+    _write(os.path.join(dataset, "year=2024", "month=1", "data_0.parquet"), b"january")
+    _write(os.path.join(dataset, "year=2024", "month=2", "data_0.parquet"), b"february v2")
+    _write(os.path.join(dataset, "_index.json"), b"{}")
+    assert upload_directory(store, source_dir, "bucket") == (1, 2, 0)
+
+class _FlakyStore(LocalObjectStore):
+    # Fails the upload of the given part numbers once each and records every part sent
+    def __init__(self, root, failing_parts):
+        super().__init__(root)
+        self.failing_parts = set(failing_parts)
+        self.sent_parts = []
+
+    def upload_part(self, key, upload_id, part_number, data):
+        self.sent_parts.append(part_number)
+        if part_number in self.failing_parts:
+            self.failing_parts.discard(part_number)
+            raise IOError("connection reset")
+        return super().upload_part(key, upload_id, part_number, data)
+
+def test_interrupted_multipart_upload_resumes_missing_parts(source_dir, tmp_path):
+    data = os.urandom(2 * MIN_PART_SIZE + 1000)
+    path = os.path.join(source_dir, "new_schema_combined_with_geom.parquet", "year=2024", "month=3", "data_0.parquet")
+    _write(path, data)
+    store = _FlakyStore(str(tmp_path / "bucket"), failing_parts=[2])
+
+    assert upload_directory(store, source_dir, "bucket", part_size=MIN_PART_SIZE) == (3, 0, 1)
+    assert sorted(store.sent_parts) == [1, 2, 3]
+    pending = read_manifest(default_manifest_path(source_dir))['destinations']['bucket']['uploads']
+    assert list(pending) == ["new_schema_combined_with_geom.parquet/year=2024/month=3/data_0.parquet"]
+
+    store.sent_parts = []
+    assert upload_directory(store, source_dir, "bucket", part_size=MIN_PART_SIZE) == (1, 3, 0)
+    assert store.sent_parts == [2]
+    assert _read(os.path.join(str(tmp_path / "bucket"), os.path.relpath(path, source_dir))) == data
+    assert read_manifest(default_manifest_path(source_dir))['destinations']['bucket']['uploads'] == {}
+
+def test_changed_file_restarts_interrupted_multipart_upload(source_dir, tmp_path):
+    path = os.path.join(source_dir, "new_schema_combined_with_geom.parquet", "year=2024", "month=3", "data_0.parquet")
+    _write(path, os.urandom(2 * MIN_PART_SIZE + 1000))
+    store = _FlakyStore(str(tmp_path / "bucket"), failing_parts=[1])
+    assert upload_directory(store, source_dir, "bucket", part_size=MIN_PART_SIZE)[2] == 1
+
+    data = os.urandom(MIN_PART_SIZE + 1000)
+    _write(path, data)
+    store.sent_parts = []
+    assert upload_directory(store, source_dir, "bucket", part_size=MIN_PART_SIZE) == (1, 3, 0)
+    assert sorted(store.sent_parts) == [1, 2]
+    assert _read(os.path.join(str(tmp_path / "bucket"), os.path.relpath(path, source_dir))) == data
+    # The abandoned upload's parts are cleaned up
+    assert os.listdir(str(tmp_path / "bucket" / ".multipart")) == []
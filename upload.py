@@ -0,0 +1,349 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from download_cache import sha256_file
+
+DEFAULT_PART_SIZE = 32 * 1024 * 1024
+# S3 rejects multipart parts smaller than 5 MiB (except the last one)
+MIN_PART_SIZE = 5 * 1024 * 1024
+# The manifest is kept next to the uploaded directory, not in it: a non-incremental ETL run
+# deletes and rewrites the output directory, and the manifest has to survive that
+MANIFEST_SUFFIX = ".upload_manifest.json"
+
+# Serialises manifest updates from upload workers
+_manifest_lock = threading.Lock()
+
+class LocalObjectStore:
+    """
+    Object store backed by a local directory, used as a stand-in for S3 when testing.
+    Multipart uploads keep their parts under .multipart/<upload_id>/ until completed.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.multipart_root = os.path.join(root, ".multipart")
+        os.makedirs(self.multipart_root, exist_ok=True)
+
+    def _object_path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def put_object(self, key, path):
+        object_path = self._object_path(key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = f"{object_path}.upload.tmp"
+        shutil.copyfile(path, temp_path)
+        os.replace(temp_path, object_path)
+
+    def create_multipart(self, key):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.multipart_root, upload_id))
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, data):
+        part_path = os.path.join(self.multipart_root, upload_id, f"{part_number:05d}")
+        with open(f"{part_path}.tmp", 'wb') as f:
+            f.write(data)
+        os.replace(f"{part_path}.tmp", part_path)
+        return hashlib.md5(data).hexdigest()
+
+    def list_parts(self, key, upload_id):
+        """
+        Returns {part_number: etag} of the parts already uploaded, or None if the upload is gone.
+        """
+        upload_dir = os.path.join(self.multipart_root, upload_id)
+        if not os.path.isdir(upload_dir):
+            return None
+        return {int(name): sha256_file(os.path.join(upload_dir, name), hashlib.md5())
+                for name in os.listdir(upload_dir) if name.isdigit()}
+
+    def complete_multipart(self, key, upload_id, parts):
+        upload_dir = os.path.join(self.multipart_root, upload_id)
+        object_path = self._object_path(key)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        temp_path = f"{object_path}.upload.tmp"
+        with open(temp_path, 'wb') as out:
+            for part_number in sorted(parts):
+                with open(os.path.join(upload_dir, f"{part_number:05d}"), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        os.replace(temp_path, object_path)
+        shutil.rmtree(upload_dir)
+
+    def abort_multipart(self, key, upload_id):
+        shutil.rmtree(os.path.join(self.multipart_root, upload_id), ignore_errors=True)
+
+class S3ObjectStore:
+    """
+    Object store for S3 and S3-compatible endpoints (Source Cooperative, MinIO). boto3 is
+    only imported when this store is used.
+    """
+    def __init__(self, bucket, prefix="", endpoint_url=None, profile=None):
+        import boto3
+        session = boto3.Session(profile_name=profile) if profile else boto3.Session()
+        # boto3 clients are thread-safe, so all upload workers share one
+        self.client = session.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put_object(self, key, path):
+        with open(path, 'rb') as f:
+            self.client.put_object(Bucket=self.bucket, Key=self._key(key), Body=f)
+
+    def create_multipart(self, key):
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self._key(key))
+        return response['UploadId']
+
+    def upload_part(self, key, upload_id, part_number, data):
+        response = self.client.upload_part(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+                                           PartNumber=part_number, Body=data)
+        return response['ETag']
+
+    def list_parts(self, key, upload_id):
+        parts = {}
+        try:
+            paginator = self.client.get_paginator('list_parts')
+            for page in paginator.paginate(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id):
+                for part in page.get('Parts', []):
+                    parts[part['PartNumber']] = part['ETag']
+        except self.client.exceptions.NoSuchUpload:
+            return None
+        return parts
+
+    def complete_multipart(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=self._key(key), UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': parts[number]} for number in sorted(parts)]})
+
+    def abort_multipart(self, key, upload_id):
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self._key(key), UploadId=upload_id)
+        except Exception as e:
+            print(f"Error aborting multipart upload of {key}: {str(e)}")
+
+def open_object_store(destination, endpoint_url=None, profile=None):
+    """
+    Returns the object store for destination: an S3ObjectStore for s3://bucket/prefix,
+    a LocalObjectStore for anything else (a directory path, optionally file://).
+    """
+    if destination.startswith("s3://"):
+        bucket, _, prefix = destination[len("s3://"):].partition("/")
+        return S3ObjectStore(bucket, prefix, endpoint_url, profile)
+    if destination.startswith("file://"):
+        destination = destination[len("file://"):]
+    return LocalObjectStore(destination)
+
+def default_manifest_path(source_dir):
+    """
+    Returns the default manifest path of source_dir: <source_dir>.upload_manifest.json beside it.
+    """
+    return f"{os.path.normpath(os.path.abspath(source_dir))}{MANIFEST_SUFFIX}"
+
+def read_manifest(manifest_path):
+    try:
+        with open(manifest_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_manifest(manifest_path, manifest):
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+def list_partitions(source_dir):
+    """
+    Groups the files under source_dir by directory: {partition: [relative file path, ...]},
+    partition being the directory relative to source_dir ('' for the top level), e.g.
+    'new_schema_combined_with_geom.parquet/year=2024/month=1'. Hidden and temporary files
+    are left out.
+    """
+    partitions = {}
+    for dir_path, dir_names, file_names in os.walk(source_dir):
+        dir_names[:] = sorted(name for name in dir_names if not name.startswith("."))
+        partition = os.path.relpath(dir_path, source_dir).replace(os.sep, "/")
+        partition = "" if partition == "." else partition
+        for file_name in sorted(file_names):
+            if file_name.startswith(".") or file_name.endswith(".tmp"):
+                continue
+            partitions.setdefault(partition, []).append(f"{partition}/{file_name}" if partition else file_name)
+    return partitions
+
+def file_hash(source_dir, relative_path, file_hashes):
+    """
+    Returns the sha256 of a file, reusing the hash stored in file_hashes while the file's
+    size and mtime are unchanged so unchanged output isn't re-read on every run.
+    """
+    stat = os.stat(os.path.join(source_dir, relative_path))
+    cached = file_hashes.get(relative_path)
+    if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+        return cached['sha256']
+    digest = sha256_file(os.path.join(source_dir, relative_path))
+    file_hashes[relative_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest}
+    return digest
+
+def partition_hash(source_dir, relative_paths, file_hashes):
+    """
+    Content hash of a partition: sha256 over the relative path and sha256 of each file.
+    """
+    hasher = hashlib.sha256()
+    for relative_path in sorted(relative_paths):
+        hasher.update(f"{relative_path}\0{file_hash(source_dir, relative_path, file_hashes)}\n".encode('utf-8'))
+    return hasher.hexdigest()
+
+def _read_part(path, part_number, part_size):
+    with open(path, 'rb') as f:
+        f.seek((part_number - 1) * part_size)
+        return f.read(part_size)
+
+def _start_or_resume_multipart(store, key, path, digest, part_size, state, manifest_path, manifest):
+    """
+    Returns (upload_id, part_size, {part_number: etag} already uploaded) for key, resuming the
+    multipart upload recorded in the manifest if it was for the same file content.
+    """
+    pending = state['uploads'].get(key)
+    if pending and pending['sha256'] == digest:
+        uploaded_parts = store.list_parts(key, pending['upload_id'])
+        if uploaded_parts is not None:
+            print(f"Resuming upload of {key}: {len(uploaded_parts)} parts already uploaded")
+            return pending['upload_id'], pending['part_size'], uploaded_parts
+    elif pending:
+        # The file changed since the interrupted upload started
+        store.abort_multipart(key, pending['upload_id'])
+
+    upload_id = store.create_multipart(key)
+    # Record the upload before sending parts so an interrupted run can pick it up again
+    with _manifest_lock:
+        state['uploads'][key] = {'upload_id': upload_id, 'sha256': digest, 'part_size': part_size}
+        write_manifest(manifest_path, manifest)
+    return upload_id, part_size, {}
+
+def upload_directory(store, source_dir, destination, manifest_path=None, workers=8, part_size=DEFAULT_PART_SIZE,
+                     force=False):
+    """
+    Uploads the partitions of source_dir whose content hash differs from the one recorded in
+    the manifest for this destination. Files larger than part_size go up as multipart uploads;
+    all parts and small files are sent by a pool of workers. Interrupted multipart uploads are
+    resumed from their missing parts on the next run. The manifest defaults to
+    default_manifest_path(source_dir). Returns (uploaded, skipped, failed) partition counts.
+    """
+    part_size = max(part_size, MIN_PART_SIZE)
+    manifest_path = manifest_path or default_manifest_path(source_dir)
+    manifest = read_manifest(manifest_path)
+    file_hashes = manifest.setdefault('files', {})
+    state = manifest.setdefault('destinations', {}).setdefault(destination, {'partitions': {}, 'uploads': {}})
+
+    run_start_time = time.time()
+    partitions = list_partitions(source_dir)
+    changed = {}
+    for partition, relative_paths in partitions.items():
+        digest = partition_hash(source_dir, relative_paths, file_hashes)
+        if force or state['partitions'].get(partition) != digest:
+            changed[partition] = digest
+    skipped_count = len(partitions) - len(changed)
+    print(f"Found {len(partitions)} partitions: {len(changed)} changed, {skipped_count} unchanged")
+    if not changed:
+        write_manifest(manifest_path, manifest)
+        return 0, skipped_count, 0
+
+    # file -> (partition, key, path, sha256, size)
+    files = []
+    for partition in changed:
+        for relative_path in partitions[partition]:
+            path = os.path.join(source_dir, relative_path)
+            files.append((partition, relative_path, path, file_hashes[relative_path]['sha256'], os.path.getsize(path)))
+
+    failed_partitions = set()
+    multipart_uploads = {}
+    uploaded_bytes = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for partition, key, path, digest, size in files:
+            try:
+                if size <= part_size:
+                    futures[executor.submit(store.put_object, key, path)] = (partition, key, None, size)
+                    continue
+                upload_id, file_part_size, parts = _start_or_resume_multipart(
+                    store, key, path, digest, part_size, state, manifest_path, manifest)
+                multipart_uploads[key] = (partition, upload_id, parts)
+                part_count = (size + file_part_size - 1) // file_part_size
+                for part_number in range(1, part_count + 1):
+                    if part_number in parts:
+                        continue
+                    future = executor.submit(lambda k=key, u=upload_id, n=part_number, p=path, s=file_part_size:
+                                             store.upload_part(k, u, n, _read_part(p, n, s)))
+                    part_bytes = min(file_part_size, size - (part_number - 1) * file_part_size)
+                    futures[future] = (partition, key, part_number, part_bytes)
+            except Exception as e:
+                print(f"ERROR: could not start upload of {key}: {str(e)}")
+                failed_partitions.add(partition)
+
+        for future in as_completed(futures):
+            partition, key, part_number, size = futures[future]
+            try:
+                etag = future.result()
+                uploaded_bytes += size
+                if part_number is not None:
+                    multipart_uploads[key][2][part_number] = etag
+            except Exception as e:
+                print(f"ERROR: upload of {key}{f' part {part_number}' if part_number else ''} failed: {str(e)}")
+                failed_partitions.add(partition)
+
+    for key, (partition, upload_id, parts) in multipart_uploads.items():
+        if partition in failed_partitions:
+            # Leave the upload open so the next run only sends the missing parts
+            continue
+        try:
+            store.complete_multipart(key, upload_id, parts)
+            with _manifest_lock:
+                state['uploads'].pop(key, None)
+        except Exception as e:
+            print(f"ERROR: could not complete upload of {key}: {str(e)}")
+            failed_partitions.add(partition)
+
+    for partition, digest in changed.items():
+        if partition not in failed_partitions:
+            state['partitions'][partition] = digest
+    write_manifest(manifest_path, manifest)
+
+    seconds = time.time() - run_start_time
+    uploaded_count = len(changed) - len(failed_partitions)
+    print(f"Uploaded {uploaded_count} partitions ({uploaded_bytes / (1024 * 1024):.1f} MB) in {seconds:.2f} seconds, "
+          f"skipped {skipped_count}, failed {len(failed_partitions)}")
+    return uploaded_count, skipped_count, len(failed_partitions)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Upload changed output partitions to an object store')
+    parser.add_argument('source_dir', help='Output directory to upload (e.g. final_parquet_folder)')
+    parser.add_argument('destination', help='s3://bucket/prefix, or a local directory used as a stand-in object store')
+    parser.add_argument('--endpoint-url', type=str, default=None, help='S3-compatible endpoint, e.g. https://data.source.coop or a MinIO server')
+    parser.add_argument('--profile', type=str, default=None, help='AWS credentials profile')
+    parser.add_argument('--workers', type=int, default=8, help='Number of parts/files uploaded in parallel')
+    parser.add_argument('--part-size-mb', type=int, default=DEFAULT_PART_SIZE // (1024 * 1024), help='Multipart upload part size in MB (minimum 5)')
+    parser.add_argument('--manifest', type=str, default=None, help=f'Upload manifest path, outside source_dir (default: <source_dir>{MANIFEST_SUFFIX} next to it)')
+    parser.add_argument('--force', action='store_true', help='Upload every partition even if its content hash is unchanged')
+    args = parser.parse_args()
+
+    SOURCE_DIR = args.source_dir
+    DESTINATION = args.destination
+    ENDPOINT_URL = args.endpoint_url
+    PROFILE = args.profile
+    WORKERS = args.workers
+    PART_SIZE = args.part_size_mb * 1024 * 1024
+    MANIFEST_PATH = args.manifest
+    FORCE = args.force
+
+    store = open_object_store(DESTINATION, ENDPOINT_URL, PROFILE)
+    # The endpoint is part of the manifest key: the same bucket name on another endpoint is another destination
+    manifest_destination = f"{ENDPOINT_URL}|{DESTINATION}" if ENDPOINT_URL else DESTINATION
+    _, _, failed = upload_directory(store, SOURCE_DIR, manifest_destination, MANIFEST_PATH, WORKERS, PART_SIZE, FORCE)
+    if failed:
+        raise SystemExit(1)